@@ -29,6 +29,7 @@ from django.utils.translation import ugettext as _
 
 import re
 import datetime
+import threading
 import six
 
 from django.utils.timezone import now
@@ -42,7 +43,7 @@ from six.moves import html_parser
 
 from jinja2 import BaseLoader as BaseTemplateLoader, TemplateNotFound
 
-from relate.utils import dict_to_struct
+from relate.utils import dict_to_struct, LRUCache
 
 from yaml import load as load_yaml
 
@@ -69,9 +70,91 @@ def get_course_repo_path(course):
     return join(settings.GIT_ROOT, course.identifier)
 
 
+# {{{ repository handle pool
+
+_REPO_POOL = threading.local()
+
+_POOLED_REPO_CLASS = []
+
+
+def _get_pooled_repo_class():
+    if not _POOLED_REPO_CLASS:
+        from dulwich.repo import Repo
+
+        class PooledRepo(Repo):
+            """A :class:`dulwich.repo.Repo` that stays open for reuse by
+            :func:`get_pooled_repo` when its user calls :meth:`close`.
+            """
+
+            def close(self):
+                pass
+
+            def close_for_real(self):
+                Repo.close(self)
+
+        _POOLED_REPO_CLASS.append(PooledRepo)
+
+    return _POOLED_REPO_CLASS[0]
+
+
+def _get_repo_state_signature(repo_path):
+    # Changes whenever a ref is updated or a pack is added.
+    from os.path import join, isdir
+    from os import stat
+
+    controldir = join(repo_path, ".git")
+    if not isdir(controldir):
+        # bare repository
+        controldir = repo_path
+
+    signature = []
+    for rel_path in ["HEAD", "packed-refs", "refs/heads", "objects/pack"]:
+        try:
+            signature.append(stat(join(controldir, rel_path)).st_mtime)
+        except OSError:
+            signature.append(None)
+
+    return tuple(signature)
+
+
+def get_pooled_repo(repo_path):
+    """Return an open :class:`dulwich.repo.Repo` for *repo_path*. Each thread
+    keeps the repositories it has used open, so that their refs and pack
+    indices need not be read again for each request. A repository is
+    reopened once its refs or packs have changed on disk.
+
+    Calling :meth:`close` on the result has no effect.
+    """
+
+    try:
+        pool = _REPO_POOL.repos
+    except AttributeError:
+        pool = _REPO_POOL.repos = {}
+
+    # taken before opening, so that changes made in between are noticed
+    signature = _get_repo_state_signature(repo_path)
+
+    try:
+        repo, repo_signature = pool[repo_path]
+    except KeyError:
+        pass
+    else:
+        if repo_signature == signature:
+            return repo
+
+        del pool[repo_path]
+        repo.close_for_real()
+
+    repo = _get_pooled_repo_class()(repo_path)
+    pool[repo_path] = (repo, signature)
+
+    return repo
+
+# }}}
+
+
 def get_course_repo(course):
-    from dulwich.repo import Repo
-    repo = Repo(get_course_repo_path(course))
+    repo = get_pooled_repo(get_course_repo_path(course))
 
     if course.course_root_path:
         return SubdirRepoWrapper(repo, course.course_root_path)
@@ -79,10 +162,73 @@ def get_course_repo(course):
         return repo
 
 
-def get_repo_blob(repo, full_name, commit_sha):
+class RepoPathIndex(object):
+    """Maps paths in the tree of one commit to ``(mode, sha)`` tuples.
+    Each directory is read once, when a path inside it is first looked up,
+    and all of its entries are recorded.
     """
-    :arg full_name: A Unicode string indicating the file name.
-    :arg commit_sha: A byte string containing the commit hash
+
+    def __init__(self, root_tree_sha):
+        import stat
+        # byte string path -> (mode, sha)
+        self.entries = {b"": (stat.S_IFDIR, root_tree_sha)}
+        self.read_dirs = set()
+
+    def lookup(self, repo, names):
+        """
+        :arg repo: a :class:`dulwich.repo.Repo`
+        :arg names: a list of byte string path components
+        :raises: :exc:`KeyError` if the path does not exist
+        """
+
+        import stat
+
+        path = b""
+        mode, sha = self.entries[path]
+
+        for name in names:
+            if not name:
+                # tolerate empty path components (begrudgingly)
+                continue
+
+            if not stat.S_ISDIR(mode):
+                raise KeyError(name)
+
+            if path not in self.read_dirs:
+                prefix = path + b"/" if path else b""
+                for entry in repo[sha].items():
+                    self.entries[prefix + entry.path] = (entry.mode, entry.sha)
+                self.read_dirs.add(path)
+
+            path = path + b"/" + name if path else name
+            mode, sha = self.entries[path]
+
+        return mode, sha
+
+
+# The number of commits for which get_repo_blob keeps a RepoPathIndex in
+# memory (per process).
+REPO_PATH_INDEX_CACHE_SIZE = 32
+
+_REPO_PATH_INDEX_CACHE = LRUCache(REPO_PATH_INDEX_CACHE_SIZE)
+
+
+def _get_repo_path_index(repo, commit_sha):
+    cache_key = (repo.controldir(), commit_sha)
+
+    index = _REPO_PATH_INDEX_CACHE.get(cache_key)
+    if index is None:
+        index = RepoPathIndex(repo[commit_sha].tree)
+        _REPO_PATH_INDEX_CACHE.put(cache_key, index)
+
+    return index
+
+
+def _lookup_repo_path(repo, full_name, commit_sha):
+    """
+    :returns: a tuple ``(repo, (mode, sha))``, where *repo* is the
+        unwrapped repository.
+    :raises: :exc:`KeyError` if *full_name* does not exist.
     """
 
     if isinstance(repo, SubdirRepoWrapper):
@@ -90,98 +236,708 @@ def get_repo_blob(repo, full_name, commit_sha):
         full_name = repo.subdir + "/" + full_name
         repo = repo.repo
 
-    names = full_name.split("/")
-
     # Allow non-ASCII file name
-    full_name = full_name.encode('utf-8')
+    names = [name.encode("utf-8") for name in full_name.split("/")]
 
-    tree_sha = repo[commit_sha].tree
-    tree = repo[tree_sha]
+    index = _get_repo_path_index(repo, commit_sha)
+    return repo, index.lookup(repo, names)
 
-    if not full_name:
-        return tree
+
+def get_repo_blob(repo, full_name, commit_sha):
+    """
+    :arg full_name: A Unicode string indicating the file name.
+    :arg commit_sha: A byte string containing the commit hash
+    """
 
     try:
-        for name in names[:-1]:
-            if not name:
-                # tolerate empty path components (begrudgingly)
-                continue
+        repo, (mode, blob_sha) = _lookup_repo_path(repo, full_name, commit_sha)
+    except KeyError:
+        raise ObjectDoesNotExist(_("resource '%s' not found") % full_name)
+
+    return repo[blob_sha]
 
-            mode, blob_sha = tree[name.encode()]
-            tree = repo[blob_sha]
 
-        mode, blob_sha = tree[names[-1].encode()]
-        return repo[blob_sha]
+def get_repo_blob_sha(repo, full_name, commit_sha):
+    """
+    :arg full_name: A Unicode string indicating the file name.
+    :arg commit_sha: A byte string containing the commit hash
+    :returns: the SHA of the blob at *full_name*, as a byte string. This
+        does not read the blob.
+    """
+
+    try:
+        repo, (mode, blob_sha) = _lookup_repo_path(repo, full_name, commit_sha)
     except KeyError:
         raise ObjectDoesNotExist(_("resource '%s' not found") % full_name)
 
+    return blob_sha
 
-def get_repo_blob_data_cached(repo, full_name, commit_sha):
+
+def prefetch_repo_paths(repo, full_names, commit_sha):
+    """Look up all of *full_names* at *commit_sha* at once, so that later
+    calls to :func:`get_repo_blob` for them do not need to read any
+    directories.
+
+    :returns: a :class:`set` of those entries of *full_names* that exist.
     """
-    :arg commit_sha: A byte string containing the commit hash
+
+    found = set()
+    for full_name in full_names:
+        try:
+            _lookup_repo_path(repo, full_name, commit_sha)
+        except KeyError:
+            pass
+        else:
+            found.add(full_name)
+
+    return found
+
+
+# {{{ in-process content cache
+
+# Everything cached through content_cache_get/content_cache_add is keyed by
+# commit SHA and so never changes. That makes it safe to keep a copy in each
+# process in front of the (shared, but remote) default cache.
+
+_CONTENT_L1_CACHE = []
+
+
+def get_content_l1_cache():
     """
+    :returns: the process-wide :class:`relate.utils.LRUCache` in front of
+        ``caches["default"]``, or *None* if it is disabled by setting
+        ``RELATE_CONTENT_L1_CACHE_MAX_BYTES`` to 0.
+    """
+
+    if not _CONTENT_L1_CACHE:
+        max_bytes = getattr(settings, "RELATE_CONTENT_L1_CACHE_MAX_BYTES",
+                32*1024*1024)
+        if max_bytes:
+            _CONTENT_L1_CACHE.append(LRUCache(
+                getattr(settings, "RELATE_CONTENT_L1_CACHE_MAX_ENTRIES", 4096),
+                max_bytes=max_bytes))
+        else:
+            _CONTENT_L1_CACHE.append(None)
+
+    return _CONTENT_L1_CACHE[0]
+
+
+# Increase this to make all content cached so far inaccessible, e.g. after
+# changing how any of it is computed.
+CONTENT_CACHE_KEY_VERSION = 1
+
+# Memcache is limited to 250 characters.
+CONTENT_CACHE_MAX_KEY_LENGTH = 240
+
+
+def make_content_cache_key(namespace, parts):
+    """Return a key for ``caches["default"]`` identifying the item
+    described by the sequence *parts* (text or byte strings, or integers)
+    among the content of type *namespace*. Keys that would be too long for
+    memcache are hashed.
+    """
+
+    from six.moves.urllib.parse import quote_plus
+
+    def quote_part(part):
+        if isinstance(part, six.text_type):
+            part = part.encode("utf-8")
+        elif not isinstance(part, six.binary_type):
+            part = str(part).encode("utf-8")
+        return quote_plus(part)
+
+    prefix = "%s:%d:" % (namespace, CONTENT_CACHE_KEY_VERSION)
+    key = prefix + ":".join(quote_part(part) for part in parts)
+
+    if len(key) >= CONTENT_CACHE_MAX_KEY_LENGTH:
+        import hashlib
+        key = prefix + "sha1:" + hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    return key
+
+
+_CONTENT_CACHE_STATS = {}
+_CONTENT_CACHE_STATS_LOCK = threading.Lock()
+
+
+def _count_content_cache_lookup(cache_key, outcome):
+    namespace = cache_key.split(":", 1)[0]
+    with _CONTENT_CACHE_STATS_LOCK:
+        ns_stats = _CONTENT_CACHE_STATS.setdefault(namespace, {
+            "l1_hits": 0, "hits": 0, "misses": 0})
+        ns_stats[outcome] += 1
 
-    if isinstance(commit_sha, six.binary_type):
-        from six.moves.urllib.parse import quote_plus
-        cache_key = "%%%1".join((
-            quote_plus(repo.controldir()),
-            quote_plus(full_name),
-            commit_sha.decode()))
+
+def get_content_cache_stats():
+    """
+    :returns: a :class:`dict` mapping each content cache namespace (see
+        :func:`make_content_cache_key`) to a :class:`dict` with the numbers
+        of lookups in this process that were answered from memory
+        (``l1_hits``), from ``caches["default"]`` (``hits``), or not at all
+        (``misses``).
+    """
+
+    with _CONTENT_CACHE_STATS_LOCK:
+        return dict(
+                (namespace, dict(ns_stats))
+                for namespace, ns_stats in six.iteritems(_CONTENT_CACHE_STATS))
+
+
+def _put_content_l1_cache_entry(l1_cache, cache_key, value):
+    # Values other than strings are kept pickled, so that each lookup gets
+    # its own copy, as it would from the default cache. Callers may modify
+    # what they get.
+    if isinstance(value, (six.binary_type, six.text_type)):
+        entry = (False, value)
     else:
-        cache_key = None
+        from six.moves import cPickle as pickle
+        entry = (True, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    l1_cache.put(cache_key, entry, len(entry[1]))
+
+
+def content_cache_get(def_cache, cache_key):
+    """Look up *cache_key* in the in-process cache, then in *def_cache*."""
+
+    l1_cache = get_content_l1_cache()
+    if l1_cache is not None:
+        entry = l1_cache.get(cache_key)
+        if entry is not None:
+            _count_content_cache_lookup(cache_key, "l1_hits")
+            is_pickled, data = entry
+            if is_pickled:
+                from six.moves import cPickle as pickle
+                return pickle.loads(data)
+            else:
+                return data
+
+    result = def_cache.get(cache_key)
+    if result is None:
+        _count_content_cache_lookup(cache_key, "misses")
+        return None
+
+    _count_content_cache_lookup(cache_key, "hits")
+    if l1_cache is not None:
+        _put_content_l1_cache_entry(l1_cache, cache_key, result)
+
+    return result
+
+
+def content_cache_add(def_cache, cache_key, value):
+    def_cache.add(cache_key, value, None)
+
+    l1_cache = get_content_l1_cache()
+    if l1_cache is not None:
+        _put_content_l1_cache_entry(l1_cache, cache_key, value)
+
+# }}}
+
+
+def _get_repo_blob_data_cache(repo, full_name, commit_sha):
+    """
+    :returns: a tuple ``(cache, cache_key)``, or ``(None, None)`` if the
+        data cannot be cached.
+    """
+
+    if not isinstance(commit_sha, six.binary_type):
+        return None, None
 
     try:
         import django.core.cache as cache
     except ImproperlyConfigured:
-        cache_key = None
+        return None, None
 
-    if cache_key is None:
-        return get_repo_blob(repo, full_name, commit_sha).data
+    cache_key = make_content_cache_key("repo-blob", (
+        repo.controldir(), getattr(repo, "subdir", ""), full_name, commit_sha))
 
-    def_cache = cache.caches["default"]
+    return cache.caches["default"], cache_key
 
-    result = None
-    # Memcache is apparently limited to 250 characters.
-    if len(cache_key) < 240:
-        result = def_cache.get(cache_key)
-    if result is not None:
+
+# {{{ on-disk blob cache
+
+class BlobDiskCache(object):
+    """A directory of files, named after blob SHAs, holding the data of blobs
+    too large for ``caches["default"]``. It may be shared between processes.
+    Once the files take up more than *max_bytes*, the least recently used
+    ones are removed.
+    """
+
+    # Files used less than this many seconds ago are never removed, so that
+    # a file does not disappear while it is being sent.
+    min_evict_age = 60
+
+    # The directory is scanned for files to remove at most this often (in
+    # seconds).
+    min_evict_interval = 60
+
+    read_chunk_size = 64*1024
+
+    # prefix of files still being written
+    temp_prefix = ".tmp"
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+
+        # None until the directory was first checked for its size
+        self.bytes_written_since_eviction = None
+
+        self.evicting = False
+        self.last_eviction_time = 0
+
+    def get_path(self, blob_sha):
+        """
+        :arg blob_sha: A text string containing the blob hash
+        """
+        from os.path import join
+        return join(self.root, blob_sha[:2], blob_sha[2:])
+
+    def _touch(self, path):
+        import os
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def open(self, blob_sha):
+        """
+        :returns: a file object open for reading the blob's data, or *None*
+            if the blob is not in the cache.
+        """
+
+        path = self.get_path(blob_sha)
+        try:
+            result = open(path, "rb")
+        except IOError:
+            return None
+
+        self._touch(path)
         return result
 
-    result = get_repo_blob(repo, full_name, commit_sha).data
+    def put(self, blob_sha, chunks):
+        """Store the byte strings *chunks* as the data of *blob_sha*.
 
-    if len(result) <= getattr(settings, "RELATE_CACHE_MAX_BYTES", 0):
-        def_cache.add(cache_key, result, None)
+        :returns: the name of the file holding them.
+        """
 
-    return result
+        import os
+        from os.path import dirname
 
+        path = self.get_path(blob_sha)
+        blob_dir = dirname(path)
 
-def is_repo_file_accessible_as(access_kind, repo, commit_sha, path):
+        try:
+            os.makedirs(blob_dir)
+        except OSError:
+            # exists already (or was created concurrently)
+            pass
+
+        from tempfile import NamedTemporaryFile
+        size = 0
+        with NamedTemporaryFile(dir=blob_dir, prefix=self.temp_prefix,
+                delete=False) as outf:
+            for chunk in chunks:
+                outf.write(chunk)
+                size += len(chunk)
+
+        # atomic: readers never see a partially written file
+        os.rename(outf.name, path)
+
+        self._note_written(size)
+        return path
+
+    def get_or_put_path(self, repo, blob_sha):
+        """
+        :arg repo: the unwrapped repository containing *blob_sha*.
+        :returns: the name of a file holding the data of *blob_sha*.
+        """
+
+        from os.path import exists
+
+        path = self.get_path(blob_sha)
+        if exists(path):
+            self._touch(path)
+            return path
+
+        return self.put(blob_sha, repo[blob_sha.encode()].chunked)
+
+    def _note_written(self, size):
+        from time import time
+
+        with self.lock:
+            if self.bytes_written_since_eviction is not None:
+                self.bytes_written_since_eviction += size
+                if self.bytes_written_since_eviction < self.max_bytes // 10:
+                    return
+
+            if (self.evicting
+                    or time() - self.last_eviction_time
+                    < self.min_evict_interval):
+                return
+
+            self.bytes_written_since_eviction = 0
+            self.evicting = True
+
+        # Scanning the directory may take a while. Do not hold up the
+        # request that wrote the file.
+        thread = threading.Thread(target=self._evict_in_background)
+        thread.daemon = True
+        thread.start()
+
+    def _evict_in_background(self):
+        from time import time
+
+        try:
+            self.evict()
+        finally:
+            with self.lock:
+                self.evicting = False
+                self.last_eviction_time = time()
+
+    def evict(self):
+        """Remove the least recently used files until the remaining ones
+        take up at most nine tenths of *max_bytes*.
+        """
+
+        import os
+        from os.path import join
+        from time import time
+
+        files = []
+        total_bytes = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.startswith(self.temp_prefix):
+                    # still being written by someone
+                    continue
+
+                path = join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # removed concurrently
+                    continue
+
+                files.append((st.st_mtime, st.st_size, path))
+                total_bytes += st.st_size
+
+        if total_bytes <= self.max_bytes:
+            return
+
+        files.sort()
+
+        target_bytes = self.max_bytes * 9 // 10
+        evict_before = time() - self.min_evict_age
+        for mtime, size, path in files:
+            if total_bytes <= target_bytes or mtime > evict_before:
+                break
+
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+
+            total_bytes -= size
+
+
+_BLOB_DISK_CACHE = []
+
+
+def get_blob_disk_cache():
+    """
+    :returns: the :class:`BlobDiskCache` in ``RELATE_BLOB_DISK_CACHE_DIR``,
+        or *None* if that is not set.
+    """
+
+    if not _BLOB_DISK_CACHE:
+        root = getattr(settings, "RELATE_BLOB_DISK_CACHE_DIR", None)
+        if root:
+            _BLOB_DISK_CACHE.append(BlobDiskCache(root,
+                getattr(settings, "RELATE_BLOB_DISK_CACHE_MAX_BYTES",
+                    1024*1024*1024)))
+        else:
+            _BLOB_DISK_CACHE.append(None)
+
+    return _BLOB_DISK_CACHE[0]
+
+
+class FileChunks(object):
+    """An iterable over the contents of the open file *inf*, in pieces of
+    up to *chunk_size* bytes. The file is closed once it has been read, or
+    by :meth:`close`.
+    """
+
+    def __init__(self, inf, chunk_size):
+        self.inf = inf
+        self.chunk_size = chunk_size
+        self.start = 0
+        self.end = None
+
+    def set_range(self, start, end):
+        """Only iterate over the bytes from *start* to *end* (exclusive, or
+        *None* for the end of the file).
+        """
+        self.start = start
+        self.end = end
+
+    def __iter__(self):
+        try:
+            self.inf.seek(self.start)
+
+            remaining = None if self.end is None else self.end - self.start
+            while remaining is None or remaining > 0:
+                read_size = self.chunk_size
+                if remaining is not None:
+                    read_size = min(read_size, remaining)
+
+                chunk = self.inf.read(read_size)
+                if not chunk:
+                    break
+
+                if remaining is not None:
+                    remaining -= len(chunk)
+
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        self.inf.close()
+
+# }}}
+
+
+def _get_uncached_repo_blob_chunks(repo, full_name, commit_sha,
+        def_cache, cache_key):
+    """Read a blob not found in *def_cache*, and store it either there or,
+    if it is too large, in the :class:`BlobDiskCache`.
+
+    :returns: a tuple ``(size, chunks)``.
+    """
+
+    disk_cache = get_blob_disk_cache()
+    if disk_cache is not None:
+        blob_sha = get_repo_blob_sha(repo, full_name, commit_sha).decode()
+
+        inf = disk_cache.open(blob_sha)
+        if inf is not None:
+            import os
+            size = os.fstat(inf.fileno()).st_size
+            return size, FileChunks(inf, disk_cache.read_chunk_size)
+
+    blob = get_repo_blob(repo, full_name, commit_sha)
+    size = blob.raw_length()
+
+    if size <= getattr(settings, "RELATE_CACHE_MAX_BYTES", 0):
+        data = blob.data
+        if def_cache is not None:
+            content_cache_add(def_cache, cache_key, data)
+
+        return size, [data]
+
+    if disk_cache is not None:
+        disk_cache.put(blob.id.decode(), blob.chunked)
+
+    return size, blob.chunked
+
+
+def get_repo_blob_data_cached(repo, full_name, commit_sha):
     """
     :arg commit_sha: A byte string containing the commit hash
     """
 
-    from os.path import dirname, basename, join
-    attributes_path = join(dirname(path), ".attributes.yml")
+    def_cache, cache_key = _get_repo_blob_data_cache(
+            repo, full_name, commit_sha)
+
+    if def_cache is None:
+        return get_repo_blob(repo, full_name, commit_sha).data
+
+    result = content_cache_get(def_cache, cache_key)
+    if result is not None:
+        return result
+
+    size, chunks = _get_uncached_repo_blob_chunks(
+            repo, full_name, commit_sha, def_cache, cache_key)
+    return b"".join(chunks)
+
+
+def get_repo_blob_chunks(repo, full_name, commit_sha):
+    """Like :func:`get_repo_blob_data_cached`, but the data of blobs too
+    large to be cached in memory is not joined into a single string.
+
+    :returns: a tuple ``(size, chunks)``, where *chunks* is either a list
+        of byte strings or, if the data is read from the
+        :class:`BlobDiskCache`, a :class:`FileChunks`.
+    """
+
+    def_cache, cache_key = _get_repo_blob_data_cache(
+            repo, full_name, commit_sha)
+
+    if def_cache is not None:
+        data = content_cache_get(def_cache, cache_key)
+        if data is not None:
+            return len(data), [data]
+
+    return _get_uncached_repo_blob_chunks(
+            repo, full_name, commit_sha, def_cache, cache_key)
+
+
+def get_repo_blob_disk_path(repo, full_name, commit_sha):
+    """Return the name of a file in the :class:`BlobDiskCache` containing
+    the data of *full_name* at *commit_sha*.
+
+    :raises: :exc:`django.core.exceptions.ObjectDoesNotExist`
+    """
 
-    from course.content import get_raw_yaml_from_repo
     try:
-        attributes = get_raw_yaml_from_repo(
-                repo, attributes_path, commit_sha.encode())
-    except ObjectDoesNotExist:
-        # no attributes file: not public
-        return False
+        repo, (mode, blob_sha) = _lookup_repo_path(repo, full_name, commit_sha)
+    except KeyError:
+        raise ObjectDoesNotExist(_("resource '%s' not found") % full_name)
+
+    disk_cache = get_blob_disk_cache()
+    if disk_cache is None:
+        raise ImproperlyConfigured(
+                "RELATE_BLOB_DISK_CACHE_DIR must be set to send repository "
+                "files through the web server")
+
+    return disk_cache.get_or_put_path(repo, blob_sha.decode())
 
-    path_basename = basename(path)
-    access_patterns = attributes.get(access_kind, [])
 
-    from fnmatch import fnmatch
-    if isinstance(access_patterns, list):
-        for pattern in access_patterns:
-            if isinstance(pattern, six.string_types):
-                if fnmatch(path_basename, pattern):
-                    return True
+class _AttributesLoadError(object):
+    """Remembers the type and message of an exception, so that a new one can
+    be raised each time. (Raising the same exception object again would
+    extend its traceback and keep the frames of earlier requests alive.)
+    """
+
+    def __init__(self, exc):
+        self.exc_class = type(exc)
+        try:
+            self.message = six.text_type(exc)
+        except UnicodeError:
+            self.message = repr(exc)
+
+    def make_exception(self):
+        try:
+            return self.exc_class(self.message)
+        except Exception:
+            return RuntimeError(self.message)
+
+
+class RepoAccessIndex(object):
+    """The access rules from all ``.attributes.yml`` files in one commit.
+
+    .. attribute:: directories
+
+        A :class:`dict` mapping directory names (relative to the course
+        root, ``""`` for the root itself) to a :class:`dict` mapping access
+        kinds to compiled regular expressions, which match the base names of
+        the files in that directory accessible under that access kind. If
+        a directory's ``.attributes.yml`` could not be read, a
+        :class:`_AttributesLoadError` takes the place of the inner
+        dictionary.
+    """
+
+    def __init__(self, repo, commit_sha):
+        from stat import S_ISDIR
+        from os.path import join
+
+        if isinstance(repo, SubdirRepoWrapper):
+            unwrapped_repo = repo.repo
+            mode, tree_sha = _get_repo_path_index(unwrapped_repo, commit_sha) \
+                    .lookup(unwrapped_repo, [
+                        name.encode("utf-8")
+                        for name in repo.subdir.strip("/").split("/")])
+        else:
+            unwrapped_repo = repo
+            tree_sha = unwrapped_repo[commit_sha].tree
+
+        self.directories = {}
+
+        dirs_to_visit = [("", tree_sha)]
+        while dirs_to_visit:
+            directory, tree_sha = dirs_to_visit.pop()
+
+            for entry in unwrapped_repo[tree_sha].items():
+                name = entry.path.decode("utf-8")
+                if S_ISDIR(entry.mode):
+                    dirs_to_visit.append((join(directory, name), entry.sha))
+
+                elif name == ".attributes.yml":
+                    try:
+                        attributes = get_raw_yaml_from_repo(
+                                repo, join(directory, name), commit_sha)
+                    except Exception as e:
+                        self.directories[directory] = _AttributesLoadError(e)
+                    else:
+                        self.directories[directory] = \
+                                self.compile_attributes(attributes)
+
+    @staticmethod
+    def compile_attributes(attributes):
+        if not isinstance(attributes, dict):
+            return {}
+
+        from fnmatch import translate
+
+        result = {}
+        for access_kind, patterns in six.iteritems(attributes):
+            if not isinstance(patterns, list):
+                continue
 
-    return False
+            patterns = [pattern for pattern in patterns
+                    if isinstance(pattern, six.string_types)]
+            if patterns:
+                result[access_kind] = re.compile("|".join(
+                    "(?:%s)" % translate(pattern) for pattern in patterns))
+
+        return result
+
+    def is_accessible_as(self, access_kind, path):
+        from os.path import dirname, basename
+
+        rules = self.directories.get(dirname(path))
+        if rules is None:
+            # no attributes file: not public
+            return False
+        if isinstance(rules, _AttributesLoadError):
+            raise rules.make_exception()
+
+        regex = rules.get(access_kind)
+        return regex is not None and regex.match(basename(path)) is not None
+
+
+# The number of commits for which is_repo_file_accessible_as keeps a
+# RepoAccessIndex in memory (per process).
+REPO_ACCESS_INDEX_CACHE_SIZE = 32
+
+_REPO_ACCESS_INDEX_CACHE = LRUCache(REPO_ACCESS_INDEX_CACHE_SIZE)
+
+
+def get_repo_access_index(repo, commit_sha):
+    """
+    :arg commit_sha: A byte string containing the commit hash
+    :returns: a (shared) :class:`RepoAccessIndex`
+    """
+
+    cache_key = (repo.controldir(), getattr(repo, "subdir", None), commit_sha)
+
+    index = _REPO_ACCESS_INDEX_CACHE.get(cache_key)
+    if index is None:
+        index = RepoAccessIndex(repo, commit_sha)
+        _REPO_ACCESS_INDEX_CACHE.put(cache_key, index)
+
+    return index
+
+
+def is_repo_file_accessible_as(access_kind, repo, commit_sha, path):
+    """
+    :arg commit_sha: A text string containing the commit hash
+    """
+
+    return get_repo_access_index(repo, commit_sha.encode()) \
+            .is_accessible_as(access_kind, path)
 
 # }}}
 
@@ -251,22 +1007,44 @@ class GitTemplateLoader(BaseTemplateLoader):
         self.repo = repo
         self.commit_sha = commit_sha
 
+    def get_template_data(self, template):
+        return get_repo_blob_data_cached(self.repo, template, self.commit_sha)
+
     def get_source(self, environment, template):
         try:
-            data = get_repo_blob_data_cached(self.repo, template, self.commit_sha)
+            data = self.get_template_data(template)
         except ObjectDoesNotExist:
             raise TemplateNotFound(template)
 
         source = data.decode('utf-8')
 
         def is_up_to_date():
-            # There's not much point to caching here, because we create
-            # a new loader for every request anyhow...
-            return False
+            # The content at a given commit never changes.
+            return True
 
         return source, None, is_up_to_date
 
 
+class SharedGitTemplateLoader(GitTemplateLoader):
+    """Like :class:`GitTemplateLoader`, but only remembers the location of
+    the repository, and gets a handle from :func:`get_pooled_repo` when
+    needed. This allows the loader to outlive the request (and the
+    repository handle) it was created for.
+    """
+
+    def __init__(self, repo_path, subdir, commit_sha):
+        self.repo_path = repo_path
+        self.subdir = subdir
+        self.commit_sha = commit_sha
+
+    def get_template_data(self, template):
+        repo = get_pooled_repo(self.repo_path)
+        if self.subdir:
+            repo = SubdirRepoWrapper(repo, self.subdir)
+
+        return get_repo_blob_data_cached(repo, template, self.commit_sha)
+
+
 class YamlBlockEscapingGitTemplateLoader(GitTemplateLoader):
     def get_source(self, environment, template):
         source, path, is_up_to_date = \
@@ -278,16 +1056,71 @@ class YamlBlockEscapingGitTemplateLoader(GitTemplateLoader):
         return source, path, is_up_to_date
 
 
+# The number of Jinja environments kept in memory (per process) by
+# get_jinja_env.
+JINJA_ENV_CACHE_SIZE = 64
+
+_JINJA_ENV_CACHE = LRUCache(JINJA_ENV_CACHE_SIZE)
+
+
+def _get_jinja_bytecode_cache():
+    try:
+        import django.core.cache as cache
+        def_cache = cache.caches["default"]
+    except ImproperlyConfigured:
+        return None
+
+    from jinja2 import MemcachedBytecodeCache
+    return MemcachedBytecodeCache(def_cache, prefix="jinja2-bytecode:",
+            ignore_memcache_errors=True)
+
+
+def get_jinja_env(repo, commit_sha):
+    """Return a :class:`jinja2.Environment` that loads templates from *repo*
+    at *commit_sha*. The environment is shared with other callers in the
+    same process, so templates included from the repository only get
+    compiled once. Compiled templates are also kept in the default cache,
+    for the benefit of other processes.
+    """
+
+    from jinja2 import Environment, StrictUndefined
+
+    if isinstance(repo, SubdirRepoWrapper):
+        repo_path = getattr(repo.repo, "path", None)
+        subdir = repo.subdir
+    else:
+        repo_path = getattr(repo, "path", None)
+        subdir = None
+
+    if repo_path is None:
+        # not a dulwich repository, cannot be reopened
+        return Environment(
+                loader=GitTemplateLoader(repo, commit_sha),
+                undefined=StrictUndefined)
+
+    cache_key = (repo_path, subdir, commit_sha)
+
+    env = _JINJA_ENV_CACHE.get(cache_key)
+    if env is not None:
+        return env
+
+    env = Environment(
+            loader=SharedGitTemplateLoader(repo_path, subdir, commit_sha),
+            undefined=StrictUndefined,
+            bytecode_cache=_get_jinja_bytecode_cache())
+
+    _JINJA_ENV_CACHE.put(cache_key, env)
+
+    return env
+
+
 def expand_yaml_macros(repo, commit_sha, yaml_str):
     if isinstance(yaml_str, six.binary_type):
         yaml_str = yaml_str.decode("utf-8")
 
-    from jinja2 import Environment, StrictUndefined
-    jinja_env = Environment(
-            loader=GitTemplateLoader(repo, commit_sha),
-            # https://github.com/inducer/relate/issues/130
-            # loader=YamlBlockEscapingGitTemplateLoader(repo, commit_sha),
-            undefined=StrictUndefined)
+    # https://github.com/inducer/relate/issues/130
+    # (would need YamlBlockEscapingGitTemplateLoader)
+    jinja_env = get_jinja_env(repo, commit_sha)
 
     # {{{ process explicit [JINJA] tags (deprecated)
 
@@ -322,16 +1155,12 @@ def get_raw_yaml_from_repo(repo, full_name, commit_sha):
     :arg commit_sha: A byte string containing the commit hash
     """
 
-    from six.moves.urllib.parse import quote_plus
-    cache_key = "%RAW%%2".join((
-        quote_plus(repo.controldir()), quote_plus(full_name), commit_sha.decode()))
+    cache_key = make_content_cache_key("raw-yaml", (
+        repo.controldir(), getattr(repo, "subdir", ""), full_name, commit_sha))
 
     import django.core.cache as cache
     def_cache = cache.caches["default"]
-    result = None
-    # Memcache is apparently limited to 250 characters.
-    if len(cache_key) < 240:
-        result = def_cache.get(cache_key)
+    result = content_cache_get(def_cache, cache_key)
     if result is not None:
         return result
 
@@ -340,7 +1169,7 @@ def get_raw_yaml_from_repo(repo, full_name, commit_sha):
                 repo, commit_sha,
                 get_repo_blob(repo, full_name, commit_sha).data))
 
-    def_cache.add(cache_key, result, None)
+    content_cache_add(def_cache, cache_key, result)
 
     return result
 
@@ -351,20 +1180,19 @@ def get_yaml_from_repo(repo, full_name, commit_sha, cached=True):
 
     See :class:`relate.utils.Struct` for more on
     struct-ification.
+
+    If *cached*, the result may be shared with other callers in the same
+    process and must not be modified.
     """
 
     if cached:
-        from six.moves.urllib.parse import quote_plus
-        cache_key = "%%%2".join(
-                (quote_plus(repo.controldir()), quote_plus(full_name),
-                    commit_sha.decode()))
+        cache_key = make_content_cache_key("yaml", (
+            repo.controldir(), getattr(repo, "subdir", ""), full_name,
+            commit_sha))
 
         import django.core.cache as cache
         def_cache = cache.caches["default"]
-        result = None
-        # Memcache is apparently limited to 250 characters.
-        if len(cache_key) < 240:
-            result = def_cache.get(cache_key)
+        result = content_cache_get(def_cache, cache_key)
         if result is not None:
             return result
 
@@ -375,7 +1203,7 @@ def get_yaml_from_repo(repo, full_name, commit_sha, cached=True):
     result = dict_to_struct(load_yaml(expanded))
 
     if cached:
-        def_cache.add(cache_key, result, None)
+        content_cache_add(def_cache, cache_key, result)
 
     return result
 
@@ -593,12 +1421,12 @@ def markup_to_html(course, repo, commit_sha, text, reverse_func=None,
             cache_key = None
         else:
             import hashlib
-            cache_key = ("markup:%d:%s:%s"
-                    % (course.id, str(commit_sha),
-                        hashlib.md5(text.encode("utf-8")).hexdigest()))
+            cache_key = make_content_cache_key("markup", (
+                course.id, commit_sha,
+                hashlib.md5(text.encode("utf-8")).hexdigest()))
 
             def_cache = cache.caches["default"]
-            result = def_cache.get(cache_key)
+            result = content_cache_get(def_cache, cache_key)
             if result is not None:
                 return result
 
@@ -609,10 +1437,7 @@ def markup_to_html(course, repo, commit_sha, text, reverse_func=None,
 
     # {{{ process through Jinja
 
-    from jinja2 import Environment, StrictUndefined
-    env = Environment(
-            loader=GitTemplateLoader(repo, commit_sha),
-            undefined=StrictUndefined)
+    env = get_jinja_env(repo, commit_sha)
     template = env.from_string(text)
     text = template.render(**jinja_env)
 
@@ -633,7 +1458,7 @@ def markup_to_html(course, repo, commit_sha, text, reverse_func=None,
         output_format="html5")
 
     if cache_key is not None:
-        def_cache.add(cache_key, result, None)
+        content_cache_add(def_cache, cache_key, result)
 
     return result
 
@@ -894,16 +1719,24 @@ def compute_chunk_weight_and_shown(course, chunk, role, now_datetime,
 
 def get_processed_course_chunks(course, repo, commit_sha,
         course_desc, role, now_datetime, facilities):
+    # *course_desc* may be shared, so leave it alone.
+    from relate.utils import Struct
+
+    chunks = []
     for chunk in course_desc.chunks:
-        chunk.weight, chunk.shown = \
-                compute_chunk_weight_and_shown(
-                        course, chunk, role, now_datetime,
-                        facilities)
-        chunk.html_content = markup_to_html(course, repo, commit_sha, chunk.content)
+        weight, shown = compute_chunk_weight_and_shown(
+                course, chunk, role, now_datetime, facilities)
 
-    course_desc.chunks.sort(key=lambda chunk: chunk.weight, reverse=True)
+        processed_chunk = Struct(chunk.__dict__)
+        processed_chunk.weight = weight
+        processed_chunk.shown = shown
+        processed_chunk.html_content = markup_to_html(
+                course, repo, commit_sha, chunk.content)
+        chunks.append(processed_chunk)
 
-    return [chunk for chunk in course_desc.chunks
+    chunks.sort(key=lambda chunk: chunk.weight, reverse=True)
+
+    return [chunk for chunk in chunks
             if chunk.shown]
 
 
@@ -944,22 +1777,58 @@ def normalize_flow_desc(flow_desc):
     return flow_desc
 
 
+# The number of normalized flow descriptions kept in memory (per process)
+# by get_flow_desc.
+FLOW_DESC_CACHE_SIZE = 256
+
+_FLOW_DESC_CACHE = LRUCache(FLOW_DESC_CACHE_SIZE)
+
+
 def get_flow_desc(repo, course, flow_id, commit_sha):
+    """Return the normalized description of the flow *flow_id*.
+
+    The result is shared with other callers in the same process and must
+    not be modified.
+    """
+
+    cache_key = (course.id, getattr(repo, "subdir", None), flow_id, commit_sha)
+
+    flow_desc = _FLOW_DESC_CACHE.get(cache_key)
+    if flow_desc is not None:
+        return flow_desc
+
     flow_desc = get_yaml_from_repo(repo, "flows/%s.yml" % flow_id, commit_sha)
 
     flow_desc = normalize_flow_desc(flow_desc)
 
     flow_desc.description_html = markup_to_html(
             course, repo, commit_sha, getattr(flow_desc, "description", None))
+
+    # used by get_flow_page_desc, hidden from struct_to_dict by the underscore
+    flow_desc._page_desc_index = dict(
+            ((grp.id, page.id), page)
+            for grp in getattr(flow_desc, "groups", [])
+            for page in grp.pages)
+
+    _FLOW_DESC_CACHE.put(cache_key, flow_desc)
+
     return flow_desc
 
 
 def get_flow_page_desc(flow_id, flow_desc, group_id, page_id):
-    for grp in flow_desc.groups:
-        if grp.id == group_id:
-            for page in grp.pages:
-                if page.id == page_id:
-                    return page
+    page_desc_index = getattr(flow_desc, "_page_desc_index", None)
+    if page_desc_index is not None:
+        try:
+            return page_desc_index[group_id, page_id]
+        except KeyError:
+            pass
+
+    else:
+        for grp in flow_desc.groups:
+            if grp.id == group_id:
+                for page in grp.pages:
+                    if page.id == page_id:
+                        return page
 
     raise ObjectDoesNotExist(
             _("page '%(group_id)s/%(page_id)s' in flow '%(flow_id)s'") % {
@@ -1025,25 +1894,94 @@ def get_flow_page_class(repo, typename, commit_sha):
 
         module, classname = components
         module_name = "code/"+module+".py"
-        module_code = get_repo_blob(repo, module_name, commit_sha).data
-
-        module_dict = {}
-
-        exec(compile(module_code, module_name, 'exec'), module_dict)
+        module_dict = get_repo_module_dict(repo, module_name, commit_sha)
 
         try:
             return module_dict[classname]
-        except AttributeError:
+        except KeyError:
             raise ClassNotFoundError(typename)
     else:
         raise ClassNotFoundError(typename)
 
 
+# The number of executed modules from course repositories kept in memory
+# (per process) by get_repo_module_dict.
+REPO_MODULE_CACHE_SIZE = 64
+
+_REPO_MODULE_CACHE = LRUCache(REPO_MODULE_CACHE_SIZE)
+
+
+def get_repo_module_dict(repo, module_name, commit_sha):
+    """Return the namespace resulting from executing the Python file
+    *module_name* in *repo* at *commit_sha*. Modules are executed once per
+    repository and content version, and the namespace is shared with
+    other callers in the same process.
+    """
+
+    module_blob = get_repo_blob(repo, module_name, commit_sha)
+
+    # (Files in a FileSystemFakeRepo have no id and are not cached.)
+    blob_id = getattr(module_blob, "id", None)
+    cache_key = (repo.controldir(), module_name, blob_id)
+
+    if blob_id is not None:
+        module_dict = _REPO_MODULE_CACHE.get(cache_key)
+        if module_dict is not None:
+            return module_dict
+
+    module_dict = {}
+
+    exec(compile(module_blob.data, module_name, 'exec'), module_dict)
+
+    if blob_id is not None:
+        _REPO_MODULE_CACHE.put(cache_key, module_dict)
+
+    return module_dict
+
+
 def instantiate_flow_page(location, repo, page_desc, commit_sha):
     class_ = get_flow_page_class(repo, page_desc.type, commit_sha)
 
     return class_(None, location, page_desc)
 
+
+# The number of page objects kept in memory (per process) by get_flow_page.
+FLOW_PAGE_CACHE_SIZE = 1024
+
+_FLOW_PAGE_CACHE = LRUCache(FLOW_PAGE_CACHE_SIZE)
+
+
+def get_flow_page(repo, course, flow_id, flow_desc, group_id, page_id,
+        commit_sha):
+    """Return an instance of the page class for page *page_id* in group
+    *group_id* of the flow *flow_id*. *flow_desc* must be the description
+    of that flow at *commit_sha*, as returned by :func:`get_flow_desc`.
+
+    Page objects depend only on their description, so instances are shared
+    with other callers in the same process and must not be modified.
+
+    :raises: :exc:`django.core.exceptions.ObjectDoesNotExist` if the page
+        does not exist.
+    """
+
+    cache_key = (course.id, getattr(repo, "subdir", None), flow_id,
+            group_id, page_id, commit_sha)
+
+    page = _FLOW_PAGE_CACHE.get(cache_key)
+    if page is not None:
+        return page
+
+    page_desc = get_flow_page_desc(flow_id, flow_desc, group_id, page_id)
+
+    page = instantiate_flow_page(
+            "course '%s', flow '%s', page '%s/%s'"
+            % (course.identifier, flow_id, group_id, page_id),
+            repo, page_desc, commit_sha)
+
+    _FLOW_PAGE_CACHE.put(cache_key, page)
+
+    return page
+
 # }}}
 
 
@@ -79,7 +79,14 @@ from relate.utils import retry_transaction_decorator
 # {{{ grade page visit
 
 def grade_page_visit(visit, visit_grade_model=FlowPageVisitGrade,
-        grade_data=None, graded_at_git_commit_sha=None):
+        grade_data=None, graded_at_git_commit_sha=None,
+        precomputed_feedback=None):
+    """
+    :arg precomputed_feedback: *None* or a dictionary as returned by
+        :func:`batch_grade_page_visits`. If *visit* is contained in it,
+        the feedback found there is used instead of grading the visit again.
+    """
+
     if not visit.is_submitted_answer:
         raise RuntimeError(_("cannot grade ungraded answer"))
 
@@ -95,8 +102,7 @@ def grade_page_visit(visit, visit_grade_model=FlowPageVisitGrade,
             get_course_repo,
             get_course_commit_sha,
             get_flow_desc,
-            get_flow_page_desc,
-            instantiate_flow_page)
+            get_flow_page)
 
     repo = get_course_repo(course)
 
@@ -106,16 +112,8 @@ def grade_page_visit(visit, visit_grade_model=FlowPageVisitGrade,
     flow_desc = get_flow_desc(repo, course,
             flow_session.flow_id, course_commit_sha)
 
-    page_desc = get_flow_page_desc(
-            flow_session.flow_id,
-            flow_desc,
-            page_data.group_id, page_data.page_id)
-
-    page = instantiate_flow_page(
-            location="flow '%s', group, '%s', page '%s'"
-            % (flow_session.flow_id, page_data.group_id, page_data.page_id),
-            repo=repo, page_desc=page_desc,
-            commit_sha=course_commit_sha)
+    page = get_flow_page(repo, course, flow_session.flow_id, flow_desc,
+            page_data.group_id, page_data.page_id, course_commit_sha)
 
     assert page.expects_answer()
     if not page.is_answer_gradable():
@@ -128,10 +126,13 @@ def grade_page_visit(visit, visit_grade_model=FlowPageVisitGrade,
             commit_sha=course_commit_sha,
             flow_session=flow_session)
 
-    with translation.override(settings.RELATE_ADMIN_EMAIL_LOCALE):
-        answer_feedback = page.grade(
-                grading_page_context, visit.page_data.data,
-                visit.answer, grade_data=grade_data)
+    if precomputed_feedback is not None and visit.id in precomputed_feedback:
+        answer_feedback = precomputed_feedback[visit.id]
+    else:
+        with translation.override(settings.RELATE_ADMIN_EMAIL_LOCALE):
+            answer_feedback = page.grade(
+                    grading_page_context, visit.page_data.data,
+                    visit.answer, grade_data=grade_data)
 
     grade = visit_grade_model()
     grade.visit = visit
@@ -148,6 +149,80 @@ def grade_page_visit(visit, visit_grade_model=FlowPageVisitGrade,
 
     update_bulk_feedback(page_data, grade, bulk_feedback_json)
 
+
+def batch_grade_page_visits(repo, course, visits):
+    """Grade the submitted answers in *visits* the way :func:`grade_page_visit`
+    would, but pass all answers to the same page to
+    :meth:`course.page.PageBase.grade_batch` at once. Nothing is saved.
+
+    :returns: a dictionary mapping visit IDs to
+        :class:`course.page.AnswerFeedback` instances (or *None*), suitable
+        as *precomputed_feedback* for :func:`grade_page_visit`.
+    """
+
+    from course.content import (
+            get_course_commit_sha,
+            get_flow_desc,
+            get_flow_page)
+    from course.page import PageContext
+
+    page_key_to_visits = {}
+    for visit in visits:
+        flow_session = visit.flow_session
+        course_commit_sha = get_course_commit_sha(
+                course, flow_session.participation)
+
+        page_key = (course_commit_sha, flow_session.flow_id,
+                visit.page_data.group_id, visit.page_data.page_id)
+        page_key_to_visits.setdefault(page_key, []).append(visit)
+
+    flow_desc_cache = {}
+    result = {}
+
+    for page_key, page_visits in six.iteritems(page_key_to_visits):
+        course_commit_sha, flow_id, group_id, page_id = page_key
+
+        flow_desc_key = (course_commit_sha, flow_id)
+        if flow_desc_key not in flow_desc_cache:
+            flow_desc_cache[flow_desc_key] = get_flow_desc(
+                    repo, course, flow_id, course_commit_sha)
+
+        try:
+            page = get_flow_page(repo, course, flow_id,
+                    flow_desc_cache[flow_desc_key], group_id, page_id,
+                    course_commit_sha)
+        except ObjectDoesNotExist:
+            # Leave it to grade_page_visit to complain.
+            continue
+
+        if not page.expects_answer() or not page.is_answer_gradable():
+            continue
+
+        grading_requests = []
+        for visit in page_visits:
+            grade_data = None
+            most_recent_grade = visit.get_most_recent_grade()
+            if most_recent_grade is not None:
+                grade_data = most_recent_grade.grade_data
+
+            grading_requests.append((
+                PageContext(
+                    course=course,
+                    repo=repo,
+                    commit_sha=course_commit_sha,
+                    flow_session=visit.flow_session),
+                visit.page_data.data,
+                visit.answer,
+                grade_data))
+
+        with translation.override(settings.RELATE_ADMIN_EMAIL_LOCALE):
+            answer_feedbacks = page.grade_batch(grading_requests)
+
+        for visit, answer_feedback in zip(page_visits, answer_feedbacks):
+            result[visit.id] = answer_feedback
+
+    return result
+
 # }}}
 
 
@@ -458,11 +533,18 @@ def gather_grade_info(fctx, flow_session, answer_visits):
 
 
 @transaction.atomic
-def grade_page_visits(fctx, flow_session, answer_visits, force_regrade=False):
+def grade_page_visits(fctx, flow_session, answer_visits, force_regrade=False,
+        precomputed_feedback=None):
     for i in range(len(answer_visits)):
         answer_visit = answer_visits[i]
 
         if answer_visit is not None:
+            # Lock the visit, so that a grade_page_visit_task still grading
+            # it finishes first and its grade is seen below.
+            answer_visit = answer_visits[i] = (FlowPageVisit.objects
+                    .select_for_update()
+                    .get(id=answer_visit.id))
+
             answer_visit.is_submitted_answer = True
             answer_visit.save()
 
@@ -490,12 +572,13 @@ def grade_page_visits(fctx, flow_session, answer_visits, force_regrade=False):
         if (answer_visit is not None
                 and (not answer_visit.grades.count() or force_regrade)):
             grade_page_visit(answer_visit,
-                    graded_at_git_commit_sha=fctx.course_commit_sha)
+                    graded_at_git_commit_sha=fctx.course_commit_sha,
+                    precomputed_feedback=precomputed_feedback)
 
 
 @transaction.atomic
 def finish_flow_session(fctx, flow_session, grading_rule,
-        force_regrade=False, now_datetime=None):
+        force_regrade=False, now_datetime=None, precomputed_feedback=None):
 
     if not flow_session.in_progress:
         raise RuntimeError(_("Can't end a session that's already ended"))
@@ -515,7 +598,8 @@ def finish_flow_session(fctx, flow_session, grading_rule,
 
     if is_graded_flow:
         grade_page_visits(fctx, flow_session, answer_visits,
-                force_regrade=force_regrade)
+                force_regrade=force_regrade,
+                precomputed_feedback=precomputed_feedback)
 
     # ORDERING RESTRICTION: Must grade pages before gathering grade info
 
@@ -716,7 +800,7 @@ def reopen_session(session, force=False, suppress_log=False):
 
 
 def finish_flow_session_standalone(repo, course, session, force_regrade=False,
-        now_datetime=None, past_due_only=False):
+        now_datetime=None, past_due_only=False, precomputed_feedback=None):
     assert session.participation is not None
 
     from course.utils import FlowContext
@@ -736,7 +820,8 @@ def finish_flow_session_standalone(repo, course, session, force_regrade=False,
         return False
 
     finish_flow_session(fctx, session, grading_rule,
-            force_regrade=force_regrade, now_datetime=now_datetime)
+            force_regrade=force_regrade, now_datetime=now_datetime,
+            precomputed_feedback=precomputed_feedback)
 
     return True
 
@@ -756,20 +841,37 @@ def expire_flow_session_standalone(repo, course, session, now_datetime,
             past_due_only=past_due_only)
 
 
-@transaction.atomic
-def regrade_session(repo, course, session):
+def get_answer_visits_to_regrade(session):
+    """Return the answer visits that :func:`regrade_session` will grade."""
+
+    answer_visits = [
+            answer_visit
+            for answer_visit in assemble_answer_visits(session)
+            if answer_visit is not None]
+
     if session.in_progress:
-        fctx = FlowContext(repo, course, session.flow_id, flow_session=session)
+        # Only make a new grade if there already is one.
+        answer_visits = [
+                answer_visit
+                for answer_visit in answer_visits
+                if answer_visit.get_most_recent_grade()]
+
+    return answer_visits
 
-        answer_visits = assemble_answer_visits(session)
 
-        for i in range(len(answer_visits)):
-            answer_visit = answer_visits[i]
+@transaction.atomic
+def regrade_session(repo, course, session, precomputed_feedback=None):
+    """
+    :arg precomputed_feedback: see :func:`grade_page_visit`.
+    """
 
-            if answer_visit is not None and answer_visit.get_most_recent_grade():
-                # Only make a new grade if there already is one.
-                grade_page_visit(answer_visit,
-                        graded_at_git_commit_sha=fctx.course_commit_sha)
+    if session.in_progress:
+        fctx = FlowContext(repo, course, session.flow_id, flow_session=session)
+
+        for answer_visit in get_answer_visits_to_regrade(session):
+            grade_page_visit(answer_visit,
+                    graded_at_git_commit_sha=fctx.course_commit_sha,
+                    precomputed_feedback=precomputed_feedback)
     else:
         prev_completion_time = session.completion_time
 
@@ -782,7 +884,8 @@ def regrade_session(repo, course, session):
         reopen_session(session, force=True, suppress_log=True)
         finish_flow_session_standalone(
                 repo, course, session, force_regrade=True,
-                now_datetime=prev_completion_time)
+                now_datetime=prev_completion_time,
+                precomputed_feedback=precomputed_feedback)
 
 
 @transaction.atomic
@@ -1153,6 +1256,9 @@ def view_flow_page(pctx, flow_session_id, ordinal):
                 answer_data,
                 answer_was_graded) = post_result
 
+            if prev_answer_visits:
+                answer_visit = prev_answer_visits[0]
+
             # continue at common flow page generation below
 
     else:
@@ -1251,6 +1357,24 @@ def view_flow_page(pctx, flow_session_id, ordinal):
         form = add_buttons_to_form(form, fpctx, flow_session,
                 permissions)
 
+    # {{{ check for grading in progress
+
+    grading_task_id = None
+    grading_failed = False
+    if (answer_visit is not None
+            and answer_visit.is_submitted_answer
+            and feedback is None
+            and fpctx.page.expects_answer()
+            and fpctx.page.is_answer_gradable()
+            and is_grading_asynchronous(fpctx.page)
+            and answer_visit.get_most_recent_grade() is None):
+        grading_task_id = get_visit_grading_task_id(answer_visit.id)
+
+        from celery.result import AsyncResult
+        grading_failed = AsyncResult(grading_task_id).state == "FAILURE"
+
+    # }}}
+
     shown_feedback = None
     if (fpctx.page.expects_answer() and answer_was_graded
             and (
@@ -1366,6 +1490,9 @@ def view_flow_page(pctx, flow_session_id, ordinal):
 
         "prev_answer_visits": prev_answer_visits,
         "prev_visit_id": prev_visit_id,
+
+        "grading_task_id": grading_task_id,
+        "grading_failed": grading_failed,
     }
 
     if fpctx.page.expects_answer() and fpctx.page.is_answer_gradable():
@@ -1378,6 +1505,19 @@ def view_flow_page(pctx, flow_session_id, ordinal):
     # }}}
 
 
+def is_grading_asynchronous(page):
+    return (getattr(settings, "RELATE_ASYNC_GRADING", False)
+            and page.is_grading_expensive())
+
+
+def get_visit_grading_task_id(visit_id):
+    # Derived from the visit so that the task can be found without storing
+    # its ID. Needs to match the URL pattern of relate-monitor_task.
+    import uuid
+    return str(uuid.uuid5(uuid.NAMESPACE_URL,
+        "relate-grade-page-visit-%d" % visit_id))
+
+
 def get_pressed_button(form):
     buttons = ["save", "save_and_next", "save_and_finish", "submit"]
     for button in buttons:
@@ -1456,7 +1596,18 @@ def post_flow_page(flow_session, fpctx, request, permissions, generates_grade):
                 generates_grade=generates_grade,
                 is_unenrolled_session=flow_session.participation is None)
 
-        if fpctx.page.is_answer_gradable():
+        if (fpctx.page.is_answer_gradable()
+                and answer_visit.is_submitted_answer
+                and is_grading_asynchronous(fpctx.page)):
+            # view_flow_page shows a 'grading' state until the grade is in.
+            from course.tasks import grade_page_visit_task
+            grade_page_visit_task.apply_async(
+                    args=(answer_visit.id, fpctx.course_commit_sha),
+                    task_id=get_visit_grading_task_id(answer_visit.id))
+
+            feedback = None
+
+        elif fpctx.page.is_answer_gradable():
             with translation.override(settings.RELATE_ADMIN_EMAIL_LOCALE):
                 feedback = fpctx.page.grade(
                         page_context, page_data.data, answer_visit.answer,
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+
+__copyright__ = "Copyright (C) 2015 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import numpy as np
+
+from course.constants import (
+        grade_state_change_types, grade_aggregation_strategy)
+
+__doc__ = """
+Replay of grade changes on arrays
+=================================
+
+:class:`course.models.GradeStateMachine` consumes the grade changes of one
+participation for one grading opportunity at a time. :func:`replay_grade_changes`
+computes the same final states and aggregated percentages for all
+(participation, opportunity) pairs of a course at once, from the grade
+changes given as :mod:`numpy` arrays. This is meant for bulk computations
+and analysis. (The grade books read :class:`course.models.GradeState`.)
+
+:mod:`numpy` is not otherwise required by RELATE. Import this module
+only where it is needed.
+
+Differences from :class:`course.models.GradeStateMachine`:
+
+* Percentages are floating point numbers, not :class:`decimal.Decimal`.
+* Grade changes in the ``graded`` state that have no attempt ID and no
+  percentage are ignored. The state machine keeps a *None* among its valid
+  percentages for them, which breaks aggregating them.
+* Where the state machine raises an exception, the pair gets the state
+  :data:`STATE_ERROR`.
+
+.. autodata:: STATE_NONE
+.. autodata:: STATE_ERROR
+.. autodata:: GRADE_STATES
+.. autodata:: AGGREGATION_STRATEGIES
+
+.. autoclass:: GradeChangeArrays
+.. autofunction:: replay_grade_changes
+.. autofunction:: get_course_grade_arrays
+"""
+
+
+# {{{ codes
+
+#: The state code of pairs without grade changes, or whose grades were
+#: cleared by a ``do_over``.
+STATE_NONE = -1
+
+#: The state code of pairs whose grade changes
+#: :class:`course.models.GradeStateMachine` would not accept.
+STATE_ERROR = -2
+
+#: The state code of a grade change is its index in this list.
+GRADE_STATES = [
+        grade_state_change_types.grading_started,
+        grade_state_change_types.graded,
+        grade_state_change_types.retrieved,
+        grade_state_change_types.unavailable,
+        grade_state_change_types.extension,
+        grade_state_change_types.report_sent,
+        grade_state_change_types.do_over,
+        grade_state_change_types.exempt,
+        ]
+
+#: The code of an aggregation strategy is its index in this list.
+AGGREGATION_STRATEGIES = [
+        grade_aggregation_strategy.max_grade,
+        grade_aggregation_strategy.avg_grade,
+        grade_aggregation_strategy.min_grade,
+        grade_aggregation_strategy.use_earliest,
+        grade_aggregation_strategy.use_latest,
+        ]
+
+_GRADED = GRADE_STATES.index(grade_state_change_types.graded)
+_UNAVAILABLE = GRADE_STATES.index(grade_state_change_types.unavailable)
+_DO_OVER = GRADE_STATES.index(grade_state_change_types.do_over)
+_EXEMPT = GRADE_STATES.index(grade_state_change_types.exempt)
+
+
+def get_grade_state_code(state):
+    try:
+        return GRADE_STATES.index(state)
+    except ValueError:
+        # rejected by replay_grade_changes
+        return len(GRADE_STATES)
+
+
+def get_aggregation_strategy_code(strategy):
+    try:
+        return AGGREGATION_STRATEGIES.index(strategy)
+    except ValueError:
+        # rejected by replay_grade_changes, if it is needed
+        return len(AGGREGATION_STRATEGIES)
+
+# }}}
+
+
+class GradeChangeArrays(object):
+    """Grade changes in columnar form. All attributes are one-dimensional
+    arrays with one entry per grade change.
+
+    .. attribute:: participation_index
+    .. attribute:: opportunity_index
+    .. attribute:: state
+
+        Codes as given by :data:`GRADE_STATES`.
+
+    .. attribute:: points
+
+        Floating point, NaN where missing.
+
+    .. attribute:: max_points
+
+        Floating point, NaN where missing.
+
+    .. attribute:: attempt_id
+
+        Integers identifying the attempt IDs, -1 where missing.
+
+    .. attribute:: grade_time
+
+        Any orderable numbers, such as microseconds since the epoch.
+    """
+
+    def __init__(self, participation_index, opportunity_index, state,
+            points, max_points, attempt_id, grade_time):
+        self.participation_index = np.asarray(participation_index, np.intp)
+        self.opportunity_index = np.asarray(opportunity_index, np.intp)
+        self.state = np.asarray(state, np.int8)
+        self.points = np.asarray(points, np.float64)
+        self.max_points = np.asarray(max_points, np.float64)
+        self.attempt_id = np.asarray(attempt_id, np.int64)
+        self.grade_time = np.asarray(grade_time)
+
+    def __len__(self):
+        return len(self.state)
+
+
+def _first_in_run(values):
+    result = np.ones(len(values), dtype=np.bool_)
+    result[1:] = values[1:] != values[:-1]
+    return result
+
+
+def _last_in_run(values):
+    result = np.ones(len(values), dtype=np.bool_)
+    result[:-1] = values[1:] != values[:-1]
+    return result
+
+
+def replay_grade_changes(gchanges, n_participations, aggregation_strategies):
+    """
+    :arg gchanges: a :class:`GradeChangeArrays`, in any order.
+    :arg aggregation_strategies: an array of aggregation strategy codes (see
+        :data:`AGGREGATION_STRATEGIES`), one per opportunity.
+    :returns: a tuple *(state, percentage, n_valid)* of arrays of shape
+        *(n_participations, n_opportunities)*. *state* contains codes as in
+        :data:`GRADE_STATES`, or :data:`STATE_NONE` or :data:`STATE_ERROR`.
+        *percentage* is the aggregated percentage, NaN where there is
+        none. *n_valid* is the number of percentages that were aggregated
+        (as ``len(GradeStateMachine.valid_percentages)``).
+    :raises ValueError: if a pair with grades uses an unknown aggregation
+        strategy.
+    """
+
+    aggregation_strategies = np.asarray(aggregation_strategies, np.intp)
+    n_opportunities = len(aggregation_strategies)
+    n_cells = n_participations * n_opportunities
+
+    # {{{ sort by pair, then time
+
+    cell = gchanges.participation_index * n_opportunities \
+            + gchanges.opportunity_index
+    order = np.lexsort((gchanges.grade_time, cell))
+
+    cell = cell[order]
+    state = gchanges.state[order]
+    attempt_id = gchanges.attempt_id[order]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percentage = 100*gchanges.points[order]/gchanges.max_points[order]
+
+    idx = np.arange(len(cell))
+
+    # }}}
+
+    # {{{ find where grades were last cleared
+
+    cell_start = np.maximum.accumulate(np.where(_first_in_run(cell), idx, 0))
+
+    is_reset = (
+            (state == _UNAVAILABLE)
+            | (state == _DO_OVER)
+            | (state == _EXEMPT))
+
+    # index of the most recent reset of the pair, or -1
+    last_reset = np.maximum.accumulate(np.where(is_reset, idx, -1))
+    last_reset = np.where(last_reset >= cell_start, last_reset, -1)
+
+    last_in_cell = _last_in_run(cell)
+    final_reset = np.empty(n_cells, np.intp)
+    final_reset.fill(-1)
+    final_reset[cell[last_in_cell]] = last_reset[last_in_cell]
+
+    # }}}
+
+    # {{{ detect grade changes the state machine rejects
+
+    is_graded = state == _GRADED
+
+    reset_state = np.where(last_reset >= 0, state[last_reset], STATE_NONE)
+    is_error = (
+            (is_graded
+                & ((reset_state == _UNAVAILABLE) | (reset_state == _EXEMPT)))
+            | (state < 0) | (state >= len(GRADE_STATES)))
+
+    cell_has_error = np.zeros(n_cells, dtype=np.bool_)
+    cell_has_error[cell[is_error]] = True
+
+    # }}}
+
+    # {{{ final states
+
+    result_state = np.empty(n_cells, np.int8)
+    result_state.fill(STATE_NONE)
+
+    has_reset = final_reset >= 0
+    result_state[has_reset] = state[final_reset[has_reset]]
+    result_state[result_state == _DO_OVER] = STATE_NONE
+
+    live_graded = is_graded & (idx > final_reset[cell])
+    result_state[cell[live_graded]] = _GRADED
+
+    result_state[cell_has_error] = STATE_ERROR
+
+    # }}}
+
+    # {{{ valid percentages
+
+    without_attempt = np.nonzero(live_graded & (attempt_id < 0))[0]
+
+    # Later grades for an attempt supersede earlier ones. A stable sort
+    # by (pair, attempt) keeps them in order of time.
+    with_attempt = np.nonzero(live_graded & (attempt_id >= 0))[0]
+    with_attempt = with_attempt[np.lexsort(
+        (with_attempt, attempt_id[with_attempt], cell[with_attempt]))]
+    with_attempt = with_attempt[
+            _last_in_run(cell[with_attempt])
+            | _last_in_run(attempt_id[with_attempt])]
+
+    # As in GradeStateMachine.consume: grades without an attempt ID in the
+    # order they were given, then the latest grade of each attempt, ordered
+    # by time.
+    valid = np.concatenate((without_attempt, with_attempt))
+    group = np.concatenate((
+        np.zeros(len(without_attempt), np.intp),
+        np.ones(len(with_attempt), np.intp)))
+
+    keep = ~np.isnan(percentage[valid]) & ~cell_has_error[cell[valid]]
+    valid = valid[keep]
+    group = group[keep]
+
+    valid = valid[np.lexsort((valid, group, cell[valid]))]
+    valid_cell = cell[valid]
+    valid_percentage = percentage[valid]
+
+    # }}}
+
+    # {{{ aggregate
+
+    n_valid = np.bincount(valid_cell, minlength=n_cells)
+    total = np.bincount(valid_cell, weights=valid_percentage,
+            minlength=n_cells)
+
+    max_percentage = np.empty(n_cells)
+    max_percentage.fill(-np.inf)
+    np.maximum.at(max_percentage, valid_cell, valid_percentage)
+
+    min_percentage = np.empty(n_cells)
+    min_percentage.fill(np.inf)
+    np.minimum.at(min_percentage, valid_cell, valid_percentage)
+
+    earliest_percentage = np.empty(n_cells)
+    earliest_percentage.fill(np.nan)
+    first = _first_in_run(valid_cell)
+    earliest_percentage[valid_cell[first]] = valid_percentage[first]
+
+    latest_percentage = np.empty(n_cells)
+    latest_percentage.fill(np.nan)
+    last = _last_in_run(valid_cell)
+    latest_percentage[valid_cell[last]] = valid_percentage[last]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_percentage = total/n_valid
+
+    cell_strategy = np.tile(aggregation_strategies, n_participations)
+
+    if np.any((n_valid > 0)
+            & ((cell_strategy < 0)
+                | (cell_strategy >= len(AGGREGATION_STRATEGIES)))):
+        raise ValueError("invalid grade aggregation strategy")
+
+    strategy_results = [
+            max_percentage,
+            avg_percentage,
+            min_percentage,
+            earliest_percentage,
+            latest_percentage,
+            ]
+    assert len(strategy_results) == len(AGGREGATION_STRATEGIES)
+
+    result_percentage = np.empty(n_cells)
+    result_percentage.fill(np.nan)
+    for code, strategy_result in enumerate(strategy_results):
+        selected = (cell_strategy == code) & (n_valid > 0)
+        result_percentage[selected] = strategy_result[selected]
+
+    # }}}
+
+    shape = (n_participations, n_opportunities)
+    return (
+            result_state.reshape(shape),
+            result_percentage.reshape(shape),
+            n_valid.reshape(shape))
+
+
+def get_course_grade_arrays(course):
+    """Load the grade changes of *course* for :func:`replay_grade_changes`.
+
+    :returns: a tuple *(participation_ids, grading_opps, gchanges,
+        aggregation_strategies)*, where the first two give the participation
+        and opportunity corresponding to each index.
+    """
+
+    from course.models import Participation, GradingOpportunity, GradeChange
+
+    participation_ids = list(Participation.objects
+            .filter(course=course)
+            .order_by("id")
+            .values_list("id", flat=True))
+    grading_opps = list(GradingOpportunity.objects
+            .filter(course=course)
+            .order_by("identifier"))
+
+    participation_id_to_index = dict(
+            (participation_id, i)
+            for i, participation_id in enumerate(participation_ids))
+    opp_id_to_index = dict(
+            (opp.id, i)
+            for i, opp in enumerate(grading_opps))
+    attempt_id_to_index = {}
+
+    from datetime import datetime
+    from django.utils.timezone import utc
+    epoch = datetime(1970, 1, 1, tzinfo=utc)
+
+    columns = ([], [], [], [], [], [], [])
+    for (participation_id, opp_id, state, points, max_points, attempt_id,
+            grade_time) in (GradeChange.objects
+                .filter(opportunity__course=course)
+                .values_list(
+                    "participation", "opportunity", "state",
+                    "points", "max_points", "attempt_id", "grade_time")
+                .iterator()):
+        delta = grade_time - epoch
+        for column, value in zip(columns, [
+                participation_id_to_index[participation_id],
+                opp_id_to_index[opp_id],
+                get_grade_state_code(state),
+                np.nan if points is None else points,
+                np.nan if max_points is None else max_points,
+                (-1 if attempt_id is None
+                    else attempt_id_to_index.setdefault(
+                        attempt_id, len(attempt_id_to_index))),
+                (delta.days*86400 + delta.seconds)*10**6 + delta.microseconds,
+                ]):
+            column.append(value)
+
+    aggregation_strategies = np.array([
+        get_aggregation_strategy_code(opp.aggregation_strategy)
+        for opp in grading_opps], np.intp)
+
+    return (participation_ids, grading_opps,
+            GradeChangeArrays(*columns), aggregation_strategies)
+
+# vim: foldmethod=marker
@@ -47,7 +47,7 @@ from crispy_forms.layout import Submit
 from course.utils import course_view, render_course_page
 from course.models import (
         Participation, participation_role, participation_status,
-        GradingOpportunity, GradeChange, GradeStateMachine,
+        GradingOpportunity, GradeChange, GradeStateMachine, GradeState,
         grade_state_change_types,
         FlowSession)
 from course.views import get_now_or_fake_time
@@ -77,8 +77,6 @@ def view_participant_grades(pctx, participation_id=None):
     else:
         raise PermissionDenied()
 
-    # NOTE: It's important that these two queries are sorted consistently,
-    # also consistently with the code below.
     grading_opps = list((GradingOpportunity.objects
             .filter(
                 course=pctx.course,
@@ -86,20 +84,12 @@ def view_participant_grades(pctx, participation_id=None):
                 )
             .order_by("identifier")))
 
-    grade_changes = list(GradeChange.objects
-            .filter(
+    opp_id_to_grade_state = dict(
+            (gstate.opportunity_id, gstate)
+            for gstate in GradeState.objects.filter(
                 participation=grade_participation,
                 opportunity__course=pctx.course,
-                opportunity__shown_in_grade_book=True)
-            .order_by(
-                "participation__id",
-                "opportunity__identifier",
-                "grade_time")
-            .select_related("participation")
-            .select_related("participation__user")
-            .select_related("opportunity"))
-
-    idx = 0
+                opportunity__shown_in_grade_book=True))
 
     grade_table = []
     for opp in grading_opps:
@@ -111,21 +101,8 @@ def view_participant_grades(pctx, participation_id=None):
             if not opp.shown_in_grade_book:
                 continue
 
-        while (
-                idx < len(grade_changes)
-                and grade_changes[idx].opportunity.identifier < opp.identifier
-                ):
-            idx += 1
-
-        my_grade_changes = []
-        while (
-                idx < len(grade_changes)
-                and grade_changes[idx].opportunity.pk == opp.pk):
-            my_grade_changes.append(grade_changes[idx])
-            idx += 1
-
-        state_machine = GradeStateMachine()
-        state_machine.consume(my_grade_changes)
+        state_machine = GradeStateMachine.from_grade_state(
+                opp_id_to_grade_state.get(opp.id), opp)
 
         grade_table.append(
                 GradeInfo(
@@ -196,69 +173,75 @@ class GradeInfo:
         self.grade_state_machine = grade_state_machine
 
 
-def get_grade_table(course):
-    # NOTE: It's important that these queries are sorted consistently,
-    # also consistently with the code below.
-    grading_opps = list((GradingOpportunity.objects
+def get_grade_book_opportunities(course):
+    return list((GradingOpportunity.objects
             .filter(
                 course=course,
                 shown_in_grade_book=True,
                 )
             .order_by("identifier")))
 
-    participations = list(Participation.objects
-            .filter(
-                course=course,
-                status=participation_status.active)
-            .order_by("id")
-            .select_related("user"))
 
-    grade_changes = list(GradeChange.objects
-            .filter(
-                opportunity__course=course,
-                opportunity__shown_in_grade_book=True)
-            .order_by(
-                "participation__id",
-                "opportunity__identifier",
-                "grade_time")
-            .select_related("participation")
-            .select_related("participation__user")
-            .select_related("opportunity"))
+GRADE_TABLE_CHUNK_SIZE = 500
 
-    idx = 0
 
-    grade_table = []
-    for participation in participations:
-        while (
-                idx < len(grade_changes)
-                and grade_changes[idx].participation.id < participation.id):
-            idx += 1
-
-        grade_row = []
-        for opp in grading_opps:
-            while (
-                    idx < len(grade_changes)
-                    and grade_changes[idx].participation.pk == participation.pk
-                    and grade_changes[idx].opportunity.identifier < opp.identifier
-                    ):
-                idx += 1
-
-            my_grade_changes = []
-            while (
-                    idx < len(grade_changes)
-                    and grade_changes[idx].opportunity.pk == opp.pk
-                    and grade_changes[idx].participation.pk == participation.pk):
-                my_grade_changes.append(grade_changes[idx])
-                idx += 1
-
-            state_machine = GradeStateMachine()
-            state_machine.consume(my_grade_changes)
-
-            grade_row.append(
-                    GradeInfo(
-                        opportunity=opp,
-                        grade_state_machine=state_machine))
+def iter_grade_table(course, grading_opps, chunk_size=GRADE_TABLE_CHUNK_SIZE):
+    """Generate tuples *(participation, grade_row)* for the active
+    participations in *course*, where *grade_row* is a list of
+    :class:`GradeInfo` instances corresponding to *grading_opps*.
+
+    Participations are read in chunks of *chunk_size*, in order of their
+    ID, along with the grade states of each chunk, so that at most one
+    chunk's worth of grade states is held in memory at a time.
+    """
+
+    last_participation_id = 0
+
+    while True:
+        participations = list(Participation.objects
+                .filter(
+                    course=course,
+                    status=participation_status.active,
+                    id__gt=last_participation_id)
+                .order_by("id")
+                .select_related("user")
+                [:chunk_size])
+
+        if not participations:
+            return
+
+        last_participation_id = participations[-1].id
+
+        grade_states = {}
+        for gstate in (GradeState.objects
+                .filter(
+                    opportunity__course=course,
+                    opportunity__shown_in_grade_book=True,
+                    participation__in=participations)):
+            grade_states[gstate.participation_id, gstate.opportunity_id] = \
+                    gstate
+
+        for participation in participations:
+            grade_row = []
+            for opp in grading_opps:
+                state_machine = GradeStateMachine.from_grade_state(
+                        grade_states.get((participation.id, opp.id)), opp)
+
+                grade_row.append(
+                        GradeInfo(
+                            opportunity=opp,
+                            grade_state_machine=state_machine))
+
+            yield participation, grade_row
 
+
+def get_grade_table(course):
+    grading_opps = get_grade_book_opportunities(course)
+
+    participations = []
+    grade_table = []
+    for participation, grade_row in iter_grade_table(course, grading_opps):
+        participations.append(participation)
         grade_table.append(grade_row)
 
     return participations, grading_opps, grade_table
@@ -287,45 +270,233 @@ def view_gradebook(pctx):
         "grade_state_change_types": grade_state_change_types,
         })
 
+# }}}
+
+
+# {{{ grade book export
+
+GRADE_BOOK_EXPORT_FORMATS = ["csv", "xlsx", "parquet"]
+
+# export format -> module it needs
+_GRADE_BOOK_EXPORT_FORMAT_MODULES = {
+        "xlsx": "openpyxl",
+        "parquet": "pyarrow",
+        }
+
+_AVAILABLE_GRADE_BOOK_EXPORT_FORMATS = None
+
+
+def get_available_grade_book_export_formats():
+    """Return the entries of :data:`GRADE_BOOK_EXPORT_FORMATS` whose
+    optional dependencies are installed.
+    """
+
+    global _AVAILABLE_GRADE_BOOK_EXPORT_FORMATS
+
+    if _AVAILABLE_GRADE_BOOK_EXPORT_FORMATS is None:
+        from importlib import import_module
+
+        available = []
+        for export_format in GRADE_BOOK_EXPORT_FORMATS:
+            module_name = _GRADE_BOOK_EXPORT_FORMAT_MODULES.get(export_format)
+            if module_name is not None:
+                try:
+                    import_module(module_name)
+                except ImportError:
+                    continue
+
+            available.append(export_format)
+
+        _AVAILABLE_GRADE_BOOK_EXPORT_FORMATS = available
+
+    return _AVAILABLE_GRADE_BOOK_EXPORT_FORMATS
+
+
+def _iter_grade_book_export_rows(course, grading_opps, cell_getter):
+    yield ["user_name", "last_name", "first_name"] + [
+            gopp.identifier for gopp in grading_opps]
+
+    for participation, grades in iter_grade_table(course, grading_opps):
+        yield [
+            participation.user.username,
+            participation.user.last_name,
+            participation.user.first_name,
+            ] + [cell_getter(grade_info.grade_state_machine)
+                for grade_info in grades]
+
+
+class _Echo(object):
+    """A file-like object whose :meth:`write` returns what it is passed, so
+    that each row produced by a :mod:`csv` writer can be yielded.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _iter_csv_chunks(rows):
+    if six.PY2:
+        import unicodecsv as csv
+    else:
+        import csv
+
+    writer = csv.writer(_Echo())
+
+    for row in rows:
+        line = writer.writerow(row)
+        if isinstance(line, six.text_type):
+            line = line.encode("utf-8")
+
+        yield line
+
+
+def _iter_gzip_chunks(chunks):
+    import zlib
+    # wbits + 16: write a gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS + 16)
+
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
+
+
+def _write_xlsx(outf, rows):
+    from openpyxl import Workbook
+
+    # rows are written out as they are appended
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title="Grades")
+    for row in rows:
+        sheet.append(row)
+
+    workbook.save(outf)
+
+
+def _write_parquet(outf, rows, row_group_size=1000):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    header = next(rows)
+
+    schema = pa.schema(
+            [pa.field(name, pa.string()) for name in header[:3]]
+            + [pa.field(name, pa.float64()) for name in header[3:]])
+
+    writer = pq.ParquetWriter(outf, schema)
+
+    def write_row_group(row_group):
+        columns = list(zip(*row_group))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(list(column), type=field.type)
+                for column, field in zip(columns, schema)],
+            schema=schema))
+
+    row_group = []
+    for row in rows:
+        row_group.append(row)
+        if len(row_group) >= row_group_size:
+            write_row_group(row_group)
+            row_group = []
+
+    if row_group:
+        write_row_group(row_group)
+
+    writer.close()
+
+
+def _get_grade_percentage(state_machine):
+    if state_machine.state == grade_state_change_types.graded:
+        percentage = state_machine.percentage()
+        if percentage is not None:
+            return float(percentage)
+
+    return None
+
+
+def _get_xlsx_grade_cell(state_machine):
+    percentage = _get_grade_percentage(state_machine)
+    if percentage is not None:
+        return percentage
+    else:
+        return state_machine.stringify_machine_readable_state()
+
 
 @course_view
 def export_gradebook_csv(pctx):
+    """Send the grade book of the course as a file, writing out each
+    participant's row as it is computed.
+
+    The query parameter ``format`` may be ``csv`` (the default), ``xlsx``
+    (which needs :mod:`openpyxl`) or ``parquet`` (which needs :mod:`pyarrow`).
+    In Parquet files, grades are percentages, and cells without one (such as
+    exempt ones) are empty. ``gzip=1`` compresses CSV output.
+    """
+
     if pctx.role not in [
             participation_role.instructor,
             participation_role.teaching_assistant]:
         raise PermissionDenied(_("must be instructor or TA to export grades"))
 
-    participations, grading_opps, grade_table = get_grade_table(pctx.course)
+    request = pctx.request
 
-    from six import StringIO
-    csvfile = StringIO()
+    export_format = request.GET.get("format", "csv")
+    if export_format not in GRADE_BOOK_EXPORT_FORMATS:
+        raise SuspiciousOperation(_("invalid export format"))
 
-    if six.PY2:
-        import unicodecsv as csv
-    else:
-        import csv
+    if export_format not in get_available_grade_book_export_formats():
+        messages.add_message(request, messages.ERROR,
+                _("Export to '%s' is not available on this server.")
+                % export_format)
+        return redirect("relate-view_gradebook", pctx.course.identifier)
 
-    fieldnames = ['user_name', 'last_name', 'first_name'] + [
-            gopp.identifier for gopp in grading_opps]
+    grading_opps = get_grade_book_opportunities(pctx.course)
 
-    writer = csv.writer(csvfile)
+    filename = "grades-%s.%s" % (pctx.course.identifier, export_format)
 
-    writer.writerow(fieldnames)
+    if export_format == "csv":
+        chunks = _iter_csv_chunks(
+                _iter_grade_book_export_rows(
+                    pctx.course, grading_opps,
+                    lambda gsm: gsm.stringify_machine_readable_state()))
 
-    for participation, grades in zip(participations, grade_table):
-        writer.writerow([
-            participation.user.username,
-            participation.user.last_name,
-            participation.user.first_name,
-            ] + [grade_info.grade_state_machine.stringify_machine_readable_state()
-                for grade_info in grades])
+        if request.GET.get("gzip") == "1":
+            response = http.StreamingHttpResponse(
+                    _iter_gzip_chunks(chunks),
+                    content_type="application/gzip")
+            filename += ".gz"
+        else:
+            response = http.StreamingHttpResponse(
+                    chunks,
+                    content_type="text/plain; charset=utf-8")
+
+    else:
+        # Both formats need to seek back to the start of the file when
+        # finishing it, so it is assembled in a temporary file, which is
+        # then streamed.
+
+        from tempfile import TemporaryFile
+        outf = TemporaryFile()
+
+        if export_format == "xlsx":
+            _write_xlsx(outf,
+                    _iter_grade_book_export_rows(
+                        pctx.course, grading_opps, _get_xlsx_grade_cell))
+            content_type = ("application/vnd.openxmlformats-officedocument"
+                    ".spreadsheetml.sheet")
+        else:
+            _write_parquet(outf,
+                    _iter_grade_book_export_rows(
+                        pctx.course, grading_opps, _get_grade_percentage))
+            content_type = "application/octet-stream"
+
+        outf.seek(0)
+        response = http.FileResponse(outf, content_type=content_type)
 
-    response = http.HttpResponse(
-            csvfile.getvalue().encode("utf-8"),
-            content_type="text/plain; charset=utf-8")
     response['Content-Disposition'] = (
-            'attachment; filename="grades-%s.csv"'
-            % pctx.course.identifier)
+            'attachment; filename="%s"' % filename)
     return response
 
 # }}}
@@ -468,9 +639,6 @@ def view_grades_by_opportunity(pctx, opp_id):
 
     # }}}
 
-    # NOTE: It's important that these queries are sorted consistently,
-    # also consistently with the code below.
-
     participations = list(Participation.objects
             .filter(
                 course=pctx.course,
@@ -478,36 +646,18 @@ def view_grades_by_opportunity(pctx, opp_id):
             .order_by("id")
             .select_related("user"))
 
-    grade_changes = list(GradeChange.objects
-            .filter(opportunity=opportunity)
-            .order_by(
-                "participation__id",
-                "grade_time")
-            .select_related("participation")
-            .select_related("participation__user")
-            .select_related("opportunity"))
-
-    idx = 0
+    participation_id_to_grade_state = dict(
+            (gstate.participation_id, gstate)
+            for gstate in GradeState.objects.filter(opportunity=opportunity))
 
     finished_sessions = 0
     total_sessions = 0
 
     grade_table = []
     for participation in participations:
-        while (
-                idx < len(grade_changes)
-                and grade_changes[idx].participation.id < participation.id):
-            idx += 1
-
-        my_grade_changes = []
-        while (
-                idx < len(grade_changes)
-                and grade_changes[idx].participation.pk == participation.pk):
-            my_grade_changes.append(grade_changes[idx])
-            idx += 1
-
-        state_machine = GradeStateMachine()
-        state_machine.consume(my_grade_changes)
+        state_machine = GradeStateMachine.from_grade_state(
+                participation_id_to_grade_state.get(participation.id),
+                opportunity)
 
         if opportunity.flow_id:
             flow_sessions = (FlowSession.objects
@@ -648,40 +798,13 @@ def view_reopen_session(pctx, flow_session_id, opportunity_id):
 # {{{ view single grade
 
 def average_grade(opportunity):
-    grade_changes = (GradeChange.objects
-            .filter(opportunity=opportunity)
-            .order_by(
-                "participation__id",
-                "grade_time")
-            .select_related("participation")
-            .select_related("opportunity"))
-
     grades = []
-    my_grade_changes = []
-
-    def finalize():
-        if not my_grade_changes:
-            return
-
-        state_machine = GradeStateMachine()
-        state_machine.consume(my_grade_changes)
-
-        percentage = state_machine.percentage()
+    for gstate in GradeState.objects.filter(opportunity=opportunity):
+        percentage = GradeStateMachine.from_grade_state(
+                gstate, opportunity).percentage()
         if percentage is not None:
             grades.append(percentage)
 
-        del my_grade_changes[:]
-
-    last_participation = None
-    for gchange in grade_changes:
-        if last_participation != gchange.participation:
-            finalize()
-            last_participation = gchange.participation
-
-        my_grade_changes.append(gchange)
-
-    finalize()
-
     if grades:
         return sum(grades)/len(grades), len(grades)
     else:
@@ -1098,7 +1221,9 @@ def import_grades(pctx):
                 from django.template.loader import render_to_string
 
                 if is_import:
-                    GradeChange.objects.bulk_create(grade_changes)
+                    from course.models import create_grade_changes
+                    create_grade_changes(grade_changes)
+
                     form_text = render_to_string(
                             "course/grade-import-preview.html", {
                                 "show_grade_changes": False,
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+
+__copyright__ = "Copyright (C) 2015 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("Recompute the stored grade states (as shown in the grade books) "
+            "from the grade changes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("course_identifiers", nargs="*",
+                metavar="COURSE_IDENTIFIER",
+                help="Only rebuild the grade states of these courses "
+                "(default: all courses)")
+
+    def handle(self, *args, **options):
+        from course.models import Course, rebuild_grade_states
+
+        course_identifiers = options["course_identifiers"]
+        if not course_identifiers:
+            count = rebuild_grade_states()
+            self.stdout.write("%d grade states rebuilt" % count)
+            return
+
+        for identifier in course_identifiers:
+            try:
+                course = Course.objects.get(identifier=identifier)
+            except Course.DoesNotExist:
+                raise CommandError("course '%s' does not exist" % identifier)
+
+            count = rebuild_grade_states(course)
+            self.stdout.write("%s: %d grade states rebuilt"
+                    % (identifier, count))
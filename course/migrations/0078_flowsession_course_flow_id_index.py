@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course', '0077_auto_20151023_1004'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='flowsession',
+            index_together=set([('course', 'flow_id')]),
+        ),
+    ]
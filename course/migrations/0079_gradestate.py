@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import jsonfield.fields
+
+
+# {{{ grade change replay
+
+# This is a frozen copy of what course.models.GradeStateMachine did when
+# this migration was written, so that later changes to the state machine
+# do not change what this migration does.
+
+def _grade_change_percentage(gchange):
+    if gchange.max_points is not None and gchange.points is not None:
+        return 100*gchange.points/gchange.max_points
+    else:
+        return None
+
+
+def _replay_grade_changes(grade_changes):
+    """Return the fields of a GradeState summarizing *grade_changes*, which
+    are sorted by grade time. Raise ValueError or RuntimeError if they are
+    not a valid sequence.
+    """
+
+    state = None
+    valid_percentages = []
+    attempt_id_to_gchange = {}
+    has_extension = False
+    extended_due_time = None
+    last_graded_time = None
+    last_report_time = None
+
+    for gchange in grade_changes:
+        if gchange.state == "graded":
+            if state == "unavailable":
+                raise ValueError("cannot accept grade once opportunity has "
+                        "been marked 'unavailable'")
+            if state == "exempt":
+                raise ValueError("cannot accept grade once opportunity has "
+                        "been marked 'exempt'")
+
+            state = gchange.state
+            if gchange.attempt_id is not None:
+                attempt_id_to_gchange[gchange.attempt_id] = gchange
+            else:
+                valid_percentages.append(_grade_change_percentage(gchange))
+
+            last_graded_time = gchange.grade_time
+
+        elif gchange.state in ["unavailable", "do_over", "exempt"]:
+            valid_percentages = []
+            attempt_id_to_gchange = {}
+            state = None if gchange.state == "do_over" else gchange.state
+
+        elif gchange.state == "report_sent":
+            last_report_time = gchange.grade_time
+
+        elif gchange.state == "extension":
+            extended_due_time = gchange.due_time
+            has_extension = True
+
+        elif gchange.state in ["grading_started", "retrieved"]:
+            pass
+
+        else:
+            raise RuntimeError(
+                    "invalid grade change state '%s'" % gchange.state)
+
+    valid_percentages.extend(
+            _grade_change_percentage(gchange)
+            for gchange in sorted(
+                attempt_id_to_gchange.values(),
+                key=lambda gchange: gchange.grade_time)
+            if _grade_change_percentage(gchange) is not None)
+
+    return {
+            "state": state,
+            "valid_percentages": [
+                None if pct is None else str(pct)
+                for pct in valid_percentages],
+            "has_extension": has_extension,
+            "extended_due_time": extended_due_time if has_extension else None,
+            "last_graded_time": last_graded_time,
+            "last_report_time": last_report_time,
+            "error": None,
+            }
+
+# }}}
+
+
+def fill_grade_states(apps, schema_editor):
+    from itertools import groupby
+    import six
+
+    GradeChange = apps.get_model("course", "GradeChange")
+    GradeState = apps.get_model("course", "GradeState")
+
+    grade_changes = (GradeChange.objects
+            .order_by("opportunity__id", "participation__id", "grade_time"))
+
+    new_grade_states = []
+    for (opportunity_id, participation_id), pair_grade_changes in groupby(
+            grade_changes.iterator(),
+            key=lambda gchange: (
+                gchange.opportunity_id, gchange.participation_id)):
+        try:
+            fields = _replay_grade_changes(pair_grade_changes)
+        except (ValueError, RuntimeError) as e:
+            fields = _replay_grade_changes([])
+            fields["error"] = six.text_type(e)
+
+        new_grade_states.append(GradeState(
+            opportunity_id=opportunity_id,
+            participation_id=participation_id,
+            **fields))
+
+    GradeState.objects.bulk_create(new_grade_states, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course', '0078_flowsession_course_flow_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradeState',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('state', models.CharField(blank=True, max_length=50, null=True, verbose_name='State', choices=[(b'grading_started', 'Grading started'), (b'graded', 'Graded'), (b'retrieved', 'Retrieved'), (b'unavailable', 'Unavailable'), (b'extension', 'Extension'), (b'report_sent', 'Report sent'), (b'do_over', 'Do-over'), (b'exempt', 'Exempt')])),
+                ('valid_percentages', jsonfield.fields.JSONField(null=True, verbose_name='Valid percentages', blank=True)),
+                ('has_extension', models.BooleanField(default=False, verbose_name='Has extension')),
+                ('extended_due_time', models.DateTimeField(null=True, verbose_name='Extended due time', blank=True)),
+                ('last_graded_time', models.DateTimeField(null=True, verbose_name='Last graded time', blank=True)),
+                ('last_report_time', models.DateTimeField(null=True, verbose_name='Last report time', blank=True)),
+                ('error', models.TextField(help_text='Why the grade changes were not accepted, if they were not. The other fields are empty then.', null=True, verbose_name='Error', blank=True)),
+                ('opportunity', models.ForeignKey(verbose_name='Grading opportunity', to='course.GradingOpportunity')),
+                ('participation', models.ForeignKey(verbose_name='Participation', to='course.Participation')),
+            ],
+            options={
+                'verbose_name': 'Grade state',
+                'verbose_name_plural': 'Grade states',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='gradestate',
+            unique_together=set([('opportunity', 'participation')]),
+        ),
+        migrations.RunPython(fill_grade_states),
+    ]
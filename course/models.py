@@ -26,7 +26,11 @@ THE SOFTWARE.
 
 import six
 
+from decimal import Decimal
+
 from django.db import models
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
 from django.utils.timezone import now
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
@@ -507,6 +511,10 @@ class FlowSession(models.Model):
         verbose_name_plural = _("Flow sessions")
         ordering = ("course", "-start_time")
 
+        # for finding all sessions of one flow, e.g. in
+        # course.validation.check_for_page_type_changes
+        index_together = [("course", "flow_id")]
+
     def __unicode__(self):
         if self.participation is None:
             return _("anonymous session %(session_id)d on '%(flow_id)s'") % {
@@ -1173,9 +1181,13 @@ class GradeStateMachine(object):
         self.state = None
         self._clear_grades()
         self.due_time = None
+        self.has_extension = False
         self.last_graded_time = None
         self.last_report_time = None
 
+        # set by from_grade_state if the grade changes were not accepted
+        self.error = None
+
         # applies to *all* grade changes
         self._last_grade_change_time = None
 
@@ -1239,6 +1251,7 @@ class GradeStateMachine(object):
 
         elif gchange.state == grade_state_change_types.extension:
             self.due_time = gchange.due_time
+            self.has_extension = True
 
         elif gchange.state in [
                 grade_state_change_types.grading_started,
@@ -1268,11 +1281,63 @@ class GradeStateMachine(object):
 
         return self
 
+    @classmethod
+    def from_grade_state(cls, grade_state, opportunity):
+        """Return a state machine equivalent to one that has consumed the
+        grade changes summarized by the :class:`GradeState` *grade_state*
+        (which may be *None* if there are none).
+
+        :arg opportunity: the :class:`GradingOpportunity` of *grade_state*,
+            passed in to avoid a query.
+        """
+
+        machine = cls()
+        del machine.attempt_id_to_gchange
+
+        if grade_state is None:
+            return machine
+
+        machine.opportunity = opportunity
+        machine.error = grade_state.error
+        machine.state = grade_state.state
+        machine.valid_percentages = [
+                None if pct is None else Decimal(pct)
+                for pct in grade_state.valid_percentages or []]
+
+        machine.has_extension = grade_state.has_extension
+        if grade_state.has_extension:
+            machine.due_time = grade_state.extended_due_time
+        else:
+            machine.due_time = opportunity.due_time
+
+        machine.last_graded_time = grade_state.last_graded_time
+        machine.last_report_time = grade_state.last_report_time
+
+        return machine
+
+    def get_grade_state_fields(self):
+        """Return a :class:`dict` of the values of the fields of a
+        :class:`GradeState` summarizing the grade changes consumed.
+        """
+
+        return {
+                "state": self.state,
+                "valid_percentages": [
+                    None if pct is None else str(pct)
+                    for pct in self.valid_percentages],
+                "has_extension": self.has_extension,
+                "extended_due_time": (
+                    self.due_time if self.has_extension else None),
+                "last_graded_time": self.last_graded_time,
+                "last_report_time": self.last_report_time,
+                }
+
     def percentage(self):
         """
         :return: a percentage of achieved points, or *None*
         """
-        if self.opportunity is None or not self.valid_percentages:
+        if (self.opportunity is None or self.error is not None
+                or not self.valid_percentages):
             return None
 
         strategy = self.opportunity.aggregation_strategy
@@ -1292,7 +1357,9 @@ class GradeStateMachine(object):
                     _("invalid grade aggregation strategy '%s'") % strategy)
 
     def stringify_state(self):
-        if self.state is None:
+        if self.error is not None:
+            return "_((error))"
+        elif self.state is None:
             return u"- ∅ -"
         elif self.state == grade_state_change_types.exempt:
             return "_((exempt))"
@@ -1308,7 +1375,9 @@ class GradeStateMachine(object):
             return "_((other state))"
 
     def stringify_machine_readable_state(self):
-        if self.state is None:
+        if self.error is not None:
+            return u"ERROR"
+        elif self.state is None:
             return u"NONE"
         elif self.state == grade_state_change_types.exempt:
             return "EXEMPT"
@@ -1331,6 +1400,202 @@ class GradeStateMachine(object):
 # }}}
 
 
+# {{{ materialized grade states
+
+class GradeState(models.Model):
+    """The outcome of a :class:`GradeStateMachine` consuming all
+    :class:`GradeChange` instances of one participation for one grading
+    opportunity. These are kept up to date by :func:`update_grade_state`
+    whenever a grade change is saved or deleted, so that grade books need not
+    replay the grade changes. ``python manage.py rebuild_grade_states``
+    recomputes them.
+
+    The percentage is not stored, because it depends on
+    :attr:`GradingOpportunity.aggregation_strategy`, which may change.
+    """
+
+    opportunity = models.ForeignKey(GradingOpportunity,
+            verbose_name=_('Grading opportunity'))
+    participation = models.ForeignKey(Participation,
+            verbose_name=_('Participation'))
+
+    state = models.CharField(max_length=50, null=True, blank=True,
+            choices=GRADE_STATE_CHANGE_CHOICES,
+            verbose_name=_('State'))
+
+    # list of percentages as strings (or None)
+    valid_percentages = JSONField(null=True, blank=True,
+            verbose_name=_('Valid percentages'))
+
+    has_extension = models.BooleanField(default=False,
+            verbose_name=_('Has extension'))
+    extended_due_time = models.DateTimeField(null=True, blank=True,
+            verbose_name=_('Extended due time'))
+
+    last_graded_time = models.DateTimeField(null=True, blank=True,
+            verbose_name=_('Last graded time'))
+    last_report_time = models.DateTimeField(null=True, blank=True,
+            verbose_name=_('Last report time'))
+
+    # Translators: help text of "error" in GradeState class
+    error = models.TextField(null=True, blank=True,
+            help_text=_("Why the grade changes were not accepted, if they "
+                "were not. The other fields are empty then."),
+            verbose_name=_('Error'))
+
+    class Meta:
+        verbose_name = _("Grade state")
+        verbose_name_plural = _("Grade states")
+        unique_together = (("opportunity", "participation"),)
+
+    def __unicode__(self):
+        return _("%(participation)s %(state)s on %(opportunityname)s") % {
+            'participation': self.participation,
+            'state': self.state,
+            'opportunityname': self.opportunity.name}
+
+    if six.PY3:
+        __str__ = __unicode__
+
+
+def _compute_grade_state_fields(grade_changes):
+    """
+    :returns: the fields of a :class:`GradeState`. If
+        :class:`GradeStateMachine` does not accept *grade_changes*, only
+        :attr:`GradeState.error` is set. (The detailed grade view, which
+        replays the grade changes, shows where the error occurs.)
+    """
+
+    try:
+        fields = GradeStateMachine().consume(grade_changes) \
+                .get_grade_state_fields()
+        fields["error"] = None
+    except (ValueError, RuntimeError) as e:
+        fields = GradeStateMachine().get_grade_state_fields()
+        fields["error"] = six.text_type(e)
+
+    return fields
+
+
+def update_grade_state(opportunity_id, participation_id):
+    """Recompute the :class:`GradeState` of one participation for one
+    grading opportunity from its grade changes.
+    """
+
+    from django.db import transaction
+    with transaction.atomic():
+        # serialize concurrent updates of the same grade state
+        list(GradeState.objects
+                .select_for_update()
+                .filter(
+                    opportunity_id=opportunity_id,
+                    participation_id=participation_id))
+
+        grade_changes = list(GradeChange.objects
+                .filter(
+                    opportunity_id=opportunity_id,
+                    participation_id=participation_id)
+                .order_by("grade_time")
+                .select_related("opportunity"))
+
+        if not grade_changes:
+            (GradeState.objects
+                    .filter(
+                        opportunity_id=opportunity_id,
+                        participation_id=participation_id)
+                    .delete())
+        else:
+            GradeState.objects.update_or_create(
+                    opportunity_id=opportunity_id,
+                    participation_id=participation_id,
+                    defaults=_compute_grade_state_fields(grade_changes))
+
+
+def create_grade_changes(grade_changes):
+    """Save the new :class:`GradeChange` instances *grade_changes* in bulk,
+    and update the affected :class:`GradeState` instances. (Saving in bulk
+    does not send the signals that usually take care of that.)
+    """
+
+    from django.db import transaction
+    with transaction.atomic():
+        GradeChange.objects.bulk_create(grade_changes)
+
+        for opportunity_id, participation_id in set(
+                (gchange.opportunity_id, gchange.participation_id)
+                for gchange in grade_changes):
+            update_grade_state(opportunity_id, participation_id)
+
+
+def rebuild_grade_states(course=None):
+    """Recompute all :class:`GradeState` instances (of *course*, if given)
+    from the grade changes.
+
+    :returns: the number of grade states created.
+    """
+
+    grade_changes = (GradeChange.objects
+            .order_by("opportunity__id", "participation__id", "grade_time")
+            .select_related("opportunity"))
+    grade_states = GradeState.objects.all()
+
+    if course is not None:
+        grade_changes = grade_changes.filter(opportunity__course=course)
+        grade_states = grade_states.filter(opportunity__course=course)
+
+    from itertools import groupby
+    from django.db import transaction
+
+    with transaction.atomic():
+        new_grade_states = []
+        for (opportunity_id, participation_id), pair_grade_changes in groupby(
+                grade_changes.iterator(),
+                key=lambda gchange: (
+                    gchange.opportunity_id, gchange.participation_id)):
+            new_grade_states.append(GradeState(
+                opportunity_id=opportunity_id,
+                participation_id=participation_id,
+                **_compute_grade_state_fields(list(pair_grade_changes))))
+
+        grade_states.delete()
+        GradeState.objects.bulk_create(new_grade_states, batch_size=1000)
+
+    return len(new_grade_states)
+
+
+@receiver(pre_save, sender=GradeChange)
+def _remember_grade_state_of_grade_change(sender, instance, **kwargs):
+    # An edit (e.g. in the admin) may move the grade change to a different
+    # opportunity or participation. The grade state it leaves must then be
+    # updated as well.
+    instance._previous_grade_state_pair = None
+
+    if kwargs.get("raw") or instance.pk is None:
+        return
+
+    previous_pairs = list(GradeChange.objects
+            .filter(pk=instance.pk)
+            .values_list("opportunity", "participation"))
+    if previous_pairs:
+        instance._previous_grade_state_pair = previous_pairs[0]
+
+
+@receiver([post_save, post_delete], sender=GradeChange)
+def _update_grade_state_for_grade_change(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        # loading fixtures
+        return
+
+    pair = (instance.opportunity_id, instance.participation_id)
+    update_grade_state(*pair)
+
+    previous_pair = getattr(instance, "_previous_grade_state_pair", None)
+    if previous_pair is not None and previous_pair != pair:
+        update_grade_state(*previous_pair)
+
+# }}}
+
+
 # {{{ flow <-> grading integration
 
 def get_flow_grading_opportunity(course, flow_id, flow_desc, grading_rule):
@@ -217,6 +217,7 @@ class PageBase(object):
 
     .. automethod:: expects_answer
     .. automethod:: is_answer_gradable
+    .. automethod:: is_grading_expensive
     .. automethod:: max_points
 
     .. rubric:: Student Input
@@ -236,6 +237,7 @@ class PageBase(object):
     .. rubric:: Grading/Feedback
 
     .. automethod:: grade
+    .. automethod:: grade_batch
     .. automethod:: correct_answer
     .. automethod:: normalized_answer
     """
@@ -364,6 +366,16 @@ class PageBase(object):
         """
         return True
 
+    def is_grading_expensive(self):
+        """
+        :return: a :class:`bool` indicating whether :meth:`grade` takes long
+            enough that it should not run while the participant waits
+            for a response. (see ``RELATE_ASYNC_GRADING``)
+
+        False by default.
+        """
+        return False
+
     def max_points(self, page_data):
         """
         :return: a :class:`int` or :class:`float` indicating how many points
@@ -490,6 +502,24 @@ class PageBase(object):
 
         raise NotImplementedError()
 
+    def grade_batch(self, grading_requests):
+        """Grade several answers to this page at once. Page types for which
+        grading is expensive may override this to share work between
+        answers.
+
+        :arg grading_requests: a list of tuples
+            ``(page_context, page_data, answer_data, grade_data)``, with
+            arguments as for :meth:`grade`. All page contexts refer to the
+            same course and commit.
+        :return: a list of values as returned by :meth:`grade`, one for each
+            entry of *grading_requests*.
+        """
+
+        return [
+                self.grade(page_context, page_data, answer_data, grade_data)
+                for page_context, page_data, answer_data, grade_data
+                in grading_requests]
+
     def correct_answer(self, page_context, page_data, answer_data, grade_data):
         """The correct answer to this page's interaction, formatted as HTML,
         or *None*.
@@ -67,76 +67,164 @@ class PythonCodeForm(StyledForm):
 
 
 RUNPY_PORT = 9941
+DOCKER_TIMEOUT = 15
 
 
 class InvalidPingResponse(RuntimeError):
     pass
 
 
-def request_python_run(run_req, run_timeout, image=None):
-    import json
-    from six.moves import http_client
+class RunpyContainerTimeout(RuntimeError):
+    pass
+
+
+class RunpyResponseTooLarge(RuntimeError):
+    pass
+
+
+# Responses are read in pieces of this size (in bytes).
+RUNPY_READ_CHUNK_SIZE = 64*1024
+
+
+def make_docker_client():
+    """Return a client for the Docker command interface given by
+    :data:`RELATE_DOCKER_URL`. If that URL starts with ``fake:``, a
+    :class:`course.page.code_pool.FakeDockerClient` is returned instead, which
+    allows the container handling to be exercised without Docker.
+    """
+
+    docker_url = getattr(settings, "RELATE_DOCKER_URL",
+            "unix://var/run/docker.sock")
+
+    if docker_url.startswith("fake:"):
+        from course.page.code_pool import FakeDockerClient
+        return FakeDockerClient()
+
     import docker
-    import socket
-    import errno
-    from docker.errors import APIError as DockerAPIError
+    return docker.Client(
+            base_url=docker_url,
+            version='1.12', timeout=DOCKER_TIMEOUT)
 
-    debug = False
-    if debug:
-        def debug_print(s):
-            print(s)
-    else:
-        def debug_print(s):
+
+class RunpyContainer(object):
+    """A started runpy container, listening on :attr:`port` on localhost.
+
+    .. attribute:: container_id
+
+        May be *None* if this refers to a static container not managed
+        by RELATE.
+    """
+
+    def __init__(self, docker_cnx, container_id, port):
+        self.docker_cnx = docker_cnx
+        self.container_id = container_id
+        self.port = port
+
+    def logs(self):
+        if self.container_id is None:
+            return ""
+
+        return self.docker_cnx.logs(self.container_id)
+
+    def remove(self):
+        if self.container_id is None:
+            return
+
+        try:
+            self.docker_cnx.remove_container(self.container_id, force=True)
+        except Exception:
+            # Oh well. No need to bother the students with this nonsense.
             pass
 
-    docker_timeout = 15
 
-    # DEBUGGING SWITCH: 1 for 'spawn container', 0 for 'static container'
-    if 1:
-        docker_cnx = docker.Client(
-                base_url=getattr(settings, "RELATE_DOCKER_URL",
-                    "unix://var/run/docker.sock"),
-                version='1.12', timeout=docker_timeout)
-
-        if image is None:
-            image = settings.RELATE_DOCKER_RUNPY_IMAGE
-
-        dresult = docker_cnx.create_container(
-                image=image,
-                command=[
-                    "/opt/runpy/runpy",
-                    "-1"],
-                mem_limit=256*10**6,
-                user="runpy")
-
-        container_id = dresult["Id"]
-    else:
-        container_id = None
+def spawn_runpy_container(docker_cnx, image=None):
+    if image is None:
+        image = settings.RELATE_DOCKER_RUNPY_IMAGE
+
+    dresult = docker_cnx.create_container(
+            image=image,
+            command=[
+                "/opt/runpy/runpy",
+                "-1"],
+            mem_limit=256*10**6,
+            user="runpy")
+
+    container_id = dresult["Id"]
 
     try:
         # FIXME: Prohibit networking
 
-        if container_id is not None:
-            docker_cnx.start(
-                    container_id,
-                    port_bindings={RUNPY_PORT: ('127.0.0.1',)})
+        docker_cnx.start(
+                container_id,
+                port_bindings={RUNPY_PORT: ('127.0.0.1',)})
 
-            port_info, = docker_cnx.port(container_id, RUNPY_PORT)
-            port = int(port_info["HostPort"])
-        else:
-            port = RUNPY_PORT
+        port_info, = docker_cnx.port(container_id, RUNPY_PORT)
+        port = int(port_info["HostPort"])
+    except Exception:
+        RunpyContainer(docker_cnx, container_id, None).remove()
+        raise
 
-        from time import time, sleep
-        start_time = time()
+    return RunpyContainer(docker_cnx, container_id, port)
 
-        # {{{ ping until response received
 
-        from traceback import format_exc
+def make_runpy_connection(port, timeout=None):
+    """Return an HTTP connection to the runpy instance on *port*. Recent
+    runpy images keep the connection open between requests, so the same
+    connection can carry the ``/ping`` and the run request.
+    """
+
+    from six.moves import http_client
+    return http_client.HTTPConnection('localhost', port, timeout=timeout)
+
+
+def ping_runpy(port, timeout=None):
+    """Send a single ``/ping`` to the runpy instance on *port*. Return
+    whether it answered as expected.
+    """
+
+    from six.moves import http_client
+    import socket
+
+    connection = make_runpy_connection(port, timeout=timeout)
+    try:
+        connection.request('GET', '/ping')
+
+        response = connection.getresponse()
+        response_data = response.read().decode("utf-8")
+    except (socket.error, http_client.HTTPException):
+        return False
+    finally:
+        # runpy serves one connection at a time, so it must not be kept open.
+        connection.close()
+
+    return response_data == "OK"
+
+
+def wait_for_runpy(port, timeout=DOCKER_TIMEOUT, connection=None):
+    """Ping the runpy instance on *port* until it responds.
+
+    :arg connection: If given, a connection as returned by
+        :func:`make_runpy_connection` that is used for pinging and left
+        open for the caller's next request. Otherwise, a connection is
+        made and closed again.
+    :raises: :exc:`RunpyContainerTimeout` if no response is received
+        within *timeout* seconds.
+    """
+
+    from six.moves import http_client
+    import socket
+    import errno
 
+    from time import time, sleep
+    start_time = time()
+
+    own_connection = connection is None
+    if own_connection:
+        connection = make_runpy_connection(port)
+
+    try:
         while True:
             try:
-                connection = http_client.HTTPConnection('localhost', port)
-
                 connection.request('GET', '/ping')
 
                 response = connection.getresponse()
@@ -145,82 +233,208 @@ def request_python_run(run_req, run_timeout, image=None):
                 if response_data != "OK":
                     raise InvalidPingResponse()
 
-                break
+                return
 
             except socket.error as e:
+                # makes the next attempt reconnect
+                connection.close()
+
                 if e.errno in [errno.ECONNRESET, errno.ECONNREFUSED]:
-                    if time() - start_time < docker_timeout:
+                    if time() - start_time < timeout:
                         sleep(0.1)
                         # and retry
                     else:
-                        return {
-                                "result": "uncaught_error",
-                                "message": "Timeout waiting for container.",
-                                "traceback": "".join(format_exc()),
-                                }
+                        raise RunpyContainerTimeout(
+                                "Timeout waiting for container.")
                 else:
                     raise
 
             except (http_client.BadStatusLine, InvalidPingResponse):
-                if time() - start_time < docker_timeout:
+                connection.close()
+
+                if time() - start_time < timeout:
                     sleep(0.1)
                     # and retry
                 else:
-                    return {
-                            "result": "uncaught_error",
-                            "message": "Timeout waiting for container.",
-                            "traceback": "".join(format_exc()),
-                            }
+                    raise RunpyContainerTimeout(
+                            "Timeout waiting for container.")
+    finally:
+        if own_connection:
+            connection.close()
+
+
+def read_runpy_response(http_response, max_bytes):
+    """Read the body of *http_response* piece by piece.
+
+    :raises: :exc:`RunpyResponseTooLarge` as soon as more than *max_bytes*
+        have been received, without reading the remainder.
+    """
+
+    content_length = http_response.getheader("Content-length")
+    if content_length is not None and int(content_length) > max_bytes:
+        raise RunpyResponseTooLarge(content_length)
+
+    chunks = []
+    size = 0
+    while True:
+        chunk = http_response.read(RUNPY_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        size += len(chunk)
+        if size > max_bytes:
+            raise RunpyResponseTooLarge(size)
+
+        chunks.append(chunk)
+
+    return b"".join(chunks)
+
+
+def _request_runpy(path, req, http_timeout, image=None, max_response_bytes=None):
+    """Send *req* as a POST to *path* in a fresh runpy container.
+
+    :returns: a tuple ``(result, elapsed_time)``. *elapsed_time* is *None*
+        if the container did not produce a response. If the response is
+        larger than *max_response_bytes*, the result is
+        ``output_too_large``.
+    """
+
+    import json
+    import socket
+
+    debug = False
+    if debug:
+        def debug_print(s):
+            print(s)
+    else:
+        def debug_print(s):
+            pass
+
+    if image is None:
+        image = settings.RELATE_DOCKER_RUNPY_IMAGE
+
+    if max_response_bytes is None:
+        max_response_bytes = getattr(
+                settings, "RELATE_RUNPY_MAX_RESPONSE_BYTES", 10*1024*1024)
+
+    from course.page.code_pool import get_runpy_container_pool
+    pool = get_runpy_container_pool(image)
+
+    # DEBUGGING SWITCH: 1 for 'spawn container', 0 for 'static container'
+    if 1:
+        if pool is not None:
+            container = pool.get()
+        else:
+            container = spawn_runpy_container(make_docker_client(), image)
+    else:
+        container = RunpyContainer(None, None, RUNPY_PORT)
+
+    connection = make_runpy_connection(container.port)
+
+    try:
+        # {{{ ping until response received
+
+        from traceback import format_exc
+
+        # For containers that were pre-started by the pool, this
+        # returns after one round trip.
+        try:
+            wait_for_runpy(container.port, connection=connection)
+        except RunpyContainerTimeout:
+            return {
+                    "result": "uncaught_error",
+                    "message": "Timeout waiting for container.",
+                    "traceback": "".join(format_exc()),
+                    }, None
 
         # }}}
 
         debug_print("PING SUCCESSFUL")
 
         try:
-            # Add a second to accommodate 'wire' delays
-            connection = http_client.HTTPConnection('localhost', port,
-                    timeout=1 + run_timeout)
+            connection.timeout = http_timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(http_timeout)
 
             headers = {'Content-type': 'application/json'}
 
-            json_run_req = json.dumps(run_req).encode("utf-8")
+            json_req = json.dumps(req).encode("utf-8")
 
             from time import time
             start_time = time()
 
             debug_print("BEFPOST")
-            connection.request('POST', '/run-python', json_run_req, headers)
+            connection.request('POST', path, json_req, headers)
             debug_print("AFTPOST")
 
             http_response = connection.getresponse()
             debug_print("GETR")
-            response_data = http_response.read().decode("utf-8")
+            response_data = read_runpy_response(
+                    http_response, max_response_bytes)
             debug_print("READR")
 
             end_time = time()
 
-            result = json.loads(response_data)
-
-            result["feedback"] = (result.get("feedback", [])
-                    + ["Execution time: %.1f s -- Time limit: %.1f s"
-                        % (end_time - start_time, run_timeout)])
-
-            return result
+            return (
+                    json.loads(response_data.decode("utf-8")),
+                    end_time - start_time)
 
         except socket.timeout:
-            return {"result": "timeout"}
+            return {"result": "timeout"}, None
+
+        except RunpyResponseTooLarge:
+            return {
+                    "result": "output_too_large",
+                    "message": "Response exceeded %d bytes."
+                    % max_response_bytes,
+                    }, None
 
     finally:
-        if container_id is not None:
-            debug_print("-----------BEGIN DOCKER LOGS for %s" % container_id)
-            debug_print(docker_cnx.logs(container_id))
-            debug_print("-----------END DOCKER LOGS for %s" % container_id)
+        connection.close()
 
-            try:
-                docker_cnx.remove_container(container_id, force=True)
-            except DockerAPIError:
-                # Oh well. No need to bother the students with this nonsense.
-                pass
+        if container.container_id is not None:
+            debug_print("-----------BEGIN DOCKER LOGS for %s"
+                    % container.container_id)
+            if debug:
+                debug_print(container.logs())
+            debug_print("-----------END DOCKER LOGS for %s"
+                    % container.container_id)
+
+            # Containers are single-use, whether they came from the pool
+            # or not.
+            container.remove()
+
+
+EXECUTION_TIME_FEEDBACK_PREFIX = "Execution time: "
+
+
+def _add_execution_time_feedback(result, execution_time, run_timeout):
+    result["feedback"] = (result.get("feedback", [])
+            + [EXECUTION_TIME_FEEDBACK_PREFIX
+                + "%.1f s -- Time limit: %.1f s"
+                % (execution_time, run_timeout)])
+
+
+def request_python_run(run_req, run_timeout, image=None):
+    """Run *run_req* using the code runner selected by
+    ``RELATE_CODE_RUNNER``. See :mod:`course.page.code_runner`.
+    """
+
+    from course.page.code_runner import get_code_runner
+    return get_code_runner().run(run_req, run_timeout, image=image)
+
+
+def request_python_run_in_docker(run_req, run_timeout, image=None):
+    result, execution_time = _request_runpy(
+            "/run-python", run_req,
+            # Add a second to accommodate 'wire' delays
+            http_timeout=1 + run_timeout,
+            image=image)
+
+    if execution_time is not None:
+        _add_execution_time_feedback(result, execution_time, run_timeout)
+
+    return result
 
 
 def is_nuisance_failure(result):
@@ -257,6 +471,200 @@ def request_python_run_with_retries(run_req, run_timeout, image=None, retry_coun
         return result
 
 
+# {{{ result cache
+
+# Results that depend only on the code being run, not on the load on the
+# machine or on the state of Docker.
+RUNPY_CACHEABLE_RESULTS = ["success", "user_compile_error", "user_error"]
+
+RUNPY_IMAGE_ID_LIFETIME = 60
+
+_RUNPY_IMAGE_IDS = {}
+
+
+def get_runpy_image_id(image=None):
+    """Return the ID (i.e. the content digest) of the Docker image *image*,
+    or *None* if it cannot be determined. The result is remembered for
+    :data:`RUNPY_IMAGE_ID_LIFETIME` seconds.
+    """
+
+    if image is None:
+        image = settings.RELATE_DOCKER_RUNPY_IMAGE
+
+    from time import time
+
+    try:
+        image_id, expiry_time = _RUNPY_IMAGE_IDS[image]
+    except KeyError:
+        pass
+    else:
+        if time() < expiry_time:
+            return image_id
+
+    try:
+        image_id = make_docker_client().inspect_image(image)["Id"]
+    except Exception:
+        return None
+
+    _RUNPY_IMAGE_IDS[image] = (image_id, time() + RUNPY_IMAGE_ID_LIFETIME)
+    return image_id
+
+
+def get_run_result_cache_keys(run_req, user_codes, run_timeout, image=None):
+    """Return a list of cache keys identifying the results of running
+    *run_req* (which must not contain ``user_code``) with each of
+    *user_codes*. Entries are *None* if the result should not be cached.
+    """
+
+    from course.page.code_runner import get_code_runner
+    image_id = get_code_runner().get_environment_id(image)
+    if image_id is None:
+        return [None] * len(user_codes)
+
+    import json
+    import hashlib
+
+    run_req_hash = hashlib.sha256(
+            json.dumps([image_id, run_timeout, run_req], sort_keys=True)
+            .encode("utf-8"))
+
+    cache_keys = []
+    for user_code in user_codes:
+        key_hash = run_req_hash.copy()
+        key_hash.update(b"\0")
+        key_hash.update(user_code.encode("utf-8"))
+        cache_keys.append("runpy-result:" + key_hash.hexdigest())
+
+    return cache_keys
+
+
+def get_cached_run_result(cache_key):
+    if cache_key is None:
+        return None
+
+    import django.core.cache as cache
+    return cache.caches["default"].get(cache_key)
+
+
+def cache_run_result(cache_key, result):
+    if cache_key is None or result["result"] not in RUNPY_CACHEABLE_RESULTS:
+        return
+
+    # How long this run took says nothing about the runs served from the
+    # cache, so leave out the feedback added by
+    # _add_execution_time_feedback.
+    feedback = result.get("feedback")
+    if feedback and feedback[-1].startswith(EXECUTION_TIME_FEEDBACK_PREFIX):
+        result = dict(result)
+        result["feedback"] = feedback[:-1]
+
+    import json
+    max_bytes = getattr(settings, "RELATE_RUNPY_CACHE_MAX_BYTES", 256*1024)
+    if len(json.dumps(result)) > max_bytes:
+        return
+
+    import django.core.cache as cache
+    cache.caches["default"].add(cache_key, result, None)
+
+# }}}
+
+
+RUNPY_BATCH_SIZE = 32
+
+
+def _is_batch_unsupported(result):
+    # Images built before /run-python-batch existed fail like this.
+    return (result["result"] == "uncaught_error"
+            and "unrecognized path in POST" in result.get("message", ""))
+
+
+def request_python_run_batch(run_req, user_codes, run_timeout, image=None,
+        retry_count=3):
+    """Run *run_req* once for each entry of *user_codes*, using the code
+    runner selected by ``RELATE_CODE_RUNNER``.
+
+    :returns: a list of results as returned by :func:`request_python_run`,
+        in the same order as *user_codes*.
+    """
+
+    from course.page.code_runner import get_code_runner
+    return get_code_runner().run_batch(run_req, user_codes, run_timeout,
+            image=image, retry_count=retry_count)
+
+
+def request_python_run_batch_in_docker(run_req, user_codes, run_timeout,
+        image=None, retry_count=3):
+    """Run *run_req* once for each entry of *user_codes*, sharing
+    containers between runs. Each run gets its own process inside the
+    container and is subject to *run_timeout* on its own.
+
+    :returns: a list of results as returned by :func:`request_python_run`,
+        in the same order as *user_codes*.
+    """
+
+    max_parallel = getattr(settings, "RELATE_DOCKER_RUNPY_BATCH_MAX_PARALLEL", 1)
+
+    results = []
+    for chunk_start in range(0, len(user_codes), RUNPY_BATCH_SIZE):
+        chunk = user_codes[chunk_start:chunk_start+RUNPY_BATCH_SIZE]
+
+        batch_req = dict(run_req)
+        batch_req["jobs"] = [{"user_code": user_code} for user_code in chunk]
+        batch_req["timeout"] = run_timeout
+        batch_req["max_parallel"] = max_parallel
+
+        # runpy enforces the limit for each job, so that one job's output
+        # cannot take up the space of the whole batch.
+        max_result_bytes = getattr(
+                settings, "RELATE_RUNPY_MAX_RESPONSE_BYTES", 10*1024*1024)
+        batch_req["max_result_bytes"] = max_result_bytes
+        max_response_bytes = len(chunk) * max_result_bytes
+
+        # Jobs are killed by runpy when they exceed run_timeout. Leave room
+        # for that, plus 'wire' delays.
+        rounds = (len(chunk) + max_parallel - 1) // max_parallel
+        http_timeout = 1 + rounds * (run_timeout + 1)
+
+        chunk_retry_count = retry_count
+        while True:
+            batch_result, _ = _request_runpy(
+                    "/run-python-batch", batch_req,
+                    http_timeout=http_timeout, image=image,
+                    max_response_bytes=max_response_bytes)
+
+            if chunk_retry_count and is_nuisance_failure(batch_result):
+                chunk_retry_count -= 1
+                continue
+
+            break
+
+        if batch_result["result"] == "success":
+            for result in batch_result["results"]:
+                execution_time = result.pop("execution_time", None)
+                if execution_time is not None:
+                    _add_execution_time_feedback(
+                            result, execution_time, run_timeout)
+
+                results.append(result)
+
+        elif (_is_batch_unsupported(batch_result)
+                or batch_result["result"] == "output_too_large"):
+            # Rerun individually, which in the second case applies the
+            # size limit to each run on its own.
+            for user_code in chunk:
+                single_run_req = dict(run_req)
+                single_run_req["user_code"] = user_code
+                results.append(
+                        request_python_run_with_retries(single_run_req,
+                            run_timeout=run_timeout, image=image,
+                            retry_count=retry_count))
+
+        else:
+            results.extend(dict(batch_result) for user_code in chunk)
+
+    return results
+
+
 class PythonCodeQuestion(PageBaseWithTitle, PageBaseWithValue):
     """
     An auto-graded question allowing an answer consisting of Python code.
@@ -377,6 +785,15 @@ class PythonCodeQuestion(PageBaseWithTitle, PageBaseWithValue):
         available to :attr:`setup_code` and :attr:`test_code` through the
         ``data_files`` dictionary. (see below)
 
+    .. attribute:: cache_results
+
+        Optional. ``True`` or ``False``. If true, the outcome of running a
+        given answer is remembered, and grading the same answer again
+        (e.g. when regrading, or when a participant resubmits identical
+        code) reuses it instead of running the code again. Only use this
+        if :attr:`setup_code` and :attr:`test_code` always reach the same
+        verdict for the same answer, i.e. if they do not use randomness.
+
     The following symbols are available in :attr:`setup_code` and :attr:`test_code`:
 
     * ``GradingComplete``: An exception class that can be raised to indicated
@@ -442,6 +859,7 @@ class PythonCodeQuestion(PageBaseWithTitle, PageBaseWithValue):
                 ("correct_code", str),
                 ("initial_code", str),
                 ("data_files", list),
+                ("cache_results", bool),
                 )
 
     def _initial_code(self):
@@ -454,6 +872,9 @@ class PythonCodeQuestion(PageBaseWithTitle, PageBaseWithValue):
     def markup_body_for_title(self):
         return self.page_desc.prompt
 
+    def is_grading_expensive(self):
+        return True
+
     def body(self, page_context, page_data):
         from django.template.loader import render_to_string
         return render_to_string(
@@ -525,17 +946,12 @@ class PythonCodeQuestion(PageBaseWithTitle, PageBaseWithValue):
 
         return "\n".join(new_test_code_lines)
 
-    def grade(self, page_context, page_data, answer_data, grade_data):
-
-        if answer_data is None:
-            return AnswerFeedback(correctness=0,
-                    feedback=_("No answer provided."))
-
-        user_code = answer_data["answer"]
-
-        # {{{ request run
+    def _make_run_request(self, page_context):
+        """Return the part of the runpy request that does not depend on the
+        participant's answer.
+        """
 
-        run_req = {"compile_only": False, "user_code": user_code}
+        run_req = {"compile_only": False}
 
         def transfer_attr(name):
             if hasattr(self.page_desc, name):
@@ -551,29 +967,114 @@ class PythonCodeQuestion(PageBaseWithTitle, PageBaseWithValue):
         if hasattr(self.page_desc, "data_files"):
             run_req["data_files"] = {}
 
-            from course.content import get_repo_blob
+            from course.content import get_repo_blob_data_cached
 
             for data_file in self.page_desc.data_files:
                 from base64 import b64encode
                 run_req["data_files"][data_file] = \
                         b64encode(
-                                get_repo_blob(
+                                get_repo_blob_data_cached(
                                     page_context.repo, data_file,
-                                    page_context.commit_sha).data).decode()
+                                    page_context.commit_sha)).decode()
 
-        try:
-            response_dict = request_python_run_with_retries(run_req,
-                    run_timeout=self.page_desc.timeout)
-        except:
-            from traceback import format_exc
-            response_dict = {
-                    "result": "uncaught_error",
-                    "message": "Error connecting to container",
-                    "traceback": "".join(format_exc()),
-                    }
+        return run_req
+
+    def grade(self, page_context, page_data, answer_data, grade_data):
+
+        if answer_data is None:
+            return AnswerFeedback(correctness=0,
+                    feedback=_("No answer provided."))
+
+        user_code = answer_data["answer"]
+
+        # {{{ request run
+
+        run_req = self._make_run_request(page_context)
+
+        cache_key = None
+        if getattr(self.page_desc, "cache_results", False):
+            cache_key, = get_run_result_cache_keys(
+                    run_req, [user_code], self.page_desc.timeout)
+
+        run_req["user_code"] = user_code
+
+        response_dict = get_cached_run_result(cache_key)
+        if response_dict is None:
+            try:
+                response_dict = request_python_run_with_retries(run_req,
+                        run_timeout=self.page_desc.timeout)
+            except:
+                from traceback import format_exc
+                response_dict = {
+                        "result": "uncaught_error",
+                        "message": "Error connecting to container",
+                        "traceback": "".join(format_exc()),
+                        }
+            else:
+                cache_run_result(cache_key, response_dict)
 
         # }}}
 
+        return self._response_to_feedback(page_context, user_code, response_dict)
+
+    def grade_batch(self, grading_requests):
+        results = [None] * len(grading_requests)
+
+        to_run = []
+        for i, (page_context, page_data, answer_data, grade_data) in enumerate(
+                grading_requests):
+            if answer_data is None:
+                results[i] = AnswerFeedback(correctness=0,
+                        feedback=_("No answer provided."))
+            else:
+                to_run.append(i)
+
+        if not to_run:
+            return results
+
+        user_codes = [grading_requests[i][2]["answer"] for i in to_run]
+
+        # All page contexts refer to the same course revision.
+        run_req = self._make_run_request(grading_requests[to_run[0]][0])
+
+        if getattr(self.page_desc, "cache_results", False):
+            cache_keys = get_run_result_cache_keys(
+                    run_req, user_codes, self.page_desc.timeout)
+        else:
+            cache_keys = [None] * len(user_codes)
+
+        response_dicts = [
+                get_cached_run_result(cache_key) for cache_key in cache_keys]
+        uncached = [
+                j for j, response_dict in enumerate(response_dicts)
+                if response_dict is None]
+
+        if uncached:
+            try:
+                run_response_dicts = request_python_run_batch(run_req,
+                        [user_codes[j] for j in uncached],
+                        run_timeout=self.page_desc.timeout)
+            except Exception:
+                from traceback import format_exc
+                run_response_dicts = [{
+                        "result": "uncaught_error",
+                        "message": "Error connecting to container",
+                        "traceback": "".join(format_exc()),
+                        }] * len(uncached)
+            else:
+                for j, response_dict in zip(uncached, run_response_dicts):
+                    cache_run_result(cache_keys[j], response_dict)
+
+            for j, response_dict in zip(uncached, run_response_dicts):
+                response_dicts[j] = response_dict
+
+        for i, user_code, response_dict in zip(to_run, user_codes, response_dicts):
+            results[i] = self._response_to_feedback(
+                    grading_requests[i][0], user_code, response_dict)
+
+        return results
+
+    def _response_to_feedback(self, page_context, user_code, response_dict):
         feedback_bits = []
 
         # {{{ send email if the grading code broke
@@ -706,6 +1207,14 @@ class PythonCodeQuestion(PageBaseWithTitle, PageBaseWithValue):
                     "A traceback is below."),
                 "</p>"]))
 
+            correctness = 0
+        elif response.result == "output_too_large":
+            feedback_bits.append("".join([
+                "<p>",
+                _("Your code produced too much output (including "
+                    "plots). The output was discarded."),
+                "</p>"]))
+
             correctness = 0
         else:
             raise RuntimeError("invalid runpy result: %s" % response.result)
@@ -866,6 +1375,34 @@ class PythonCodeQuestionWithHumanTextFeedback(
         code_feedback = PythonCodeQuestion.grade(self, page_context,
                 page_data, answer_data, grade_data)
 
+        return self._combine_with_human_feedback(
+                page_context, grade_data, code_feedback)
+
+    def grade_batch(self, grading_requests):
+        code_grading_requests = []
+        for page_context, page_data, answer_data, grade_data in grading_requests:
+            if grade_data is not None and not grade_data["released"]:
+                grade_data = None
+
+            code_grading_requests.append(
+                    (page_context, page_data, answer_data, grade_data))
+
+        code_feedbacks = PythonCodeQuestion.grade_batch(
+                self, code_grading_requests)
+
+        results = []
+        for (page_context, page_data, answer_data, grade_data), code_feedback \
+                in zip(code_grading_requests, code_feedbacks):
+            if answer_data is None:
+                results.append(code_feedback)
+            else:
+                results.append(self._combine_with_human_feedback(
+                        page_context, grade_data, code_feedback))
+
+        return results
+
+    def _combine_with_human_feedback(self, page_context, grade_data,
+            code_feedback):
         human_points = self.page_desc.human_feedback_value
         code_points = self.page_desc.value - human_points
 
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+
+__copyright__ = "Copyright (C) 2014 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import threading
+from collections import deque
+
+__doc__ = """
+Pool of pre-started runpy containers
+====================================
+
+Starting a container and waiting for runpy inside it to answer its first
+``/ping`` makes up most of the time needed to grade a
+:class:`course.page.PythonCodeQuestion`. A :class:`RunpyContainerPool`
+starts containers ahead of time in a background thread, so that
+:func:`course.page.code.request_python_run` only has to pick one up.
+Containers are still single-use: each one is removed after it has serviced
+one request.
+
+The pool is configured through these settings:
+
+* ``RELATE_DOCKER_RUNPY_POOL_MAX_SIZE``: The largest number of idle
+  containers kept per image. ``0`` (the default) disables the pool.
+
+* ``RELATE_DOCKER_RUNPY_POOL_MIN_SIZE``: The number of idle containers
+  kept per image even when there is no demand. Defaults to ``0``.
+
+Between those two bounds, the number of containers kept ready grows whenever
+a request finds the pool empty and shrinks again once demand subsides.
+
+The pool is per process and uses a thread to refill itself. If you run
+RELATE under uwsgi, you will need to pass ``enable-threads``.
+
+.. autoclass:: RunpyContainerPool
+.. autofunction:: get_runpy_container_pool
+.. autoclass:: FakeDockerClient
+"""
+
+
+# {{{ pool
+
+class RunpyContainerPool(object):
+    """
+    :arg docker_cnx_factory: A callable returning a client object with
+        the interface of :class:`docker.Client` (or
+        :class:`FakeDockerClient`).
+    """
+
+    # seconds
+    refill_interval = 5
+    failure_backoff = 5
+    health_check_timeout = 1
+
+    def __init__(self, docker_cnx_factory, image, min_size, max_size):
+        if not (0 <= min_size <= max_size):
+            raise ValueError("invalid pool size bounds")
+
+        self.docker_cnx_factory = docker_cnx_factory
+        self.image = image
+        self.min_size = min_size
+        self.max_size = max_size
+
+        self.target_size = min_size
+        self.ready = deque()
+        self.starting_count = 0
+        self.closed = False
+
+        self.lock = threading.Lock()
+        self.refill_needed = threading.Event()
+        self.refill_thread = None
+        self.had_demand = False
+
+    def _spawn(self, docker_cnx):
+        from course.page.code import spawn_runpy_container
+        return spawn_runpy_container(docker_cnx, self.image)
+
+    def _ensure_refill_thread(self):
+        with self.lock:
+            if self.refill_thread is not None or self.closed:
+                return
+
+            self.refill_thread = threading.Thread(
+                    target=self._refill_loop,
+                    name="runpy-pool-%s" % self.image)
+            self.refill_thread.daemon = True
+            self.refill_thread.start()
+
+    def get(self):
+        """Return a :class:`course.page.code.RunpyContainer` that has not
+        serviced a request yet. The caller is responsible for removing it
+        after use.
+
+        If no container is ready, one is started synchronously. It may not
+        respond to ``/ping`` yet.
+        """
+
+        from course.page.code import ping_runpy
+
+        self._ensure_refill_thread()
+
+        while True:
+            with self.lock:
+                self.had_demand = True
+
+                if self.ready:
+                    container = self.ready.popleft()
+                else:
+                    container = None
+                    self.target_size = min(self.target_size + 1, self.max_size)
+
+            self.refill_needed.set()
+
+            if container is None:
+                return self._spawn(self.docker_cnx_factory())
+
+            if ping_runpy(container.port, timeout=self.health_check_timeout):
+                return container
+
+            # Container died while waiting in the pool.
+            container.remove()
+
+    def _refill_loop(self):
+        from course.page.code import wait_for_runpy
+        from time import sleep
+
+        docker_cnx = self.docker_cnx_factory()
+
+        while True:
+            self.refill_needed.wait(self.refill_interval)
+            self.refill_needed.clear()
+
+            with self.lock:
+                if self.closed:
+                    return
+
+                if not self.had_demand:
+                    # quiet for a whole interval: shrink back towards min_size
+                    self.target_size = max(self.target_size - 1, self.min_size)
+
+                self.had_demand = False
+
+            while True:
+                with self.lock:
+                    if (self.closed
+                            or len(self.ready) + self.starting_count
+                            >= self.target_size):
+                        break
+
+                    self.starting_count += 1
+
+                container = None
+                try:
+                    container = self._spawn(docker_cnx)
+                    wait_for_runpy(container.port)
+                except Exception:
+                    if container is not None:
+                        container.remove()
+
+                    with self.lock:
+                        self.starting_count -= 1
+
+                    # Docker is unhappy. Requests will fall back to starting
+                    # their own containers in the meantime.
+                    sleep(self.failure_backoff)
+                    break
+
+                with self.lock:
+                    self.starting_count -= 1
+                    if self.closed:
+                        container.remove()
+                        return
+
+                    self.ready.append(container)
+
+            with self.lock:
+                surplus = []
+                while len(self.ready) > self.target_size:
+                    surplus.append(self.ready.pop())
+
+            for container in surplus:
+                container.remove()
+
+    def close(self):
+        """Stop refilling and remove all idle containers."""
+
+        with self.lock:
+            self.closed = True
+            containers = list(self.ready)
+            self.ready.clear()
+
+        self.refill_needed.set()
+
+        for container in containers:
+            container.remove()
+
+
+_RUNPY_POOLS = {}
+_RUNPY_POOLS_LOCK = threading.Lock()
+
+
+def _close_all_pools():
+    with _RUNPY_POOLS_LOCK:
+        pools = list(_RUNPY_POOLS.values())
+        _RUNPY_POOLS.clear()
+
+    for pool in pools:
+        pool.close()
+
+
+def get_runpy_container_pool(image):
+    """Return the process-wide :class:`RunpyContainerPool` for *image*, or
+    *None* if pooling is disabled.
+    """
+
+    from django.conf import settings
+    max_size = getattr(settings, "RELATE_DOCKER_RUNPY_POOL_MAX_SIZE", 0)
+    if not max_size:
+        return None
+
+    with _RUNPY_POOLS_LOCK:
+        try:
+            return _RUNPY_POOLS[image]
+        except KeyError:
+            pass
+
+        if not _RUNPY_POOLS:
+            import atexit
+            atexit.register(_close_all_pools)
+
+        from course.page.code import make_docker_client
+        pool = RunpyContainerPool(
+                make_docker_client, image,
+                min_size=min(
+                    getattr(settings, "RELATE_DOCKER_RUNPY_POOL_MIN_SIZE", 0),
+                    max_size),
+                max_size=max_size)
+
+        _RUNPY_POOLS[image] = pool
+        return pool
+
+# }}}
+
+
+# {{{ fake docker
+
+class FakeDockerClient(object):
+    """Implements the part of the interface of :class:`docker.Client` used
+    by RELATE. Instead of starting a container, :meth:`start` starts a thread
+    serving runpy's HTTP protocol on a local port. It answers ``/ping`` and
+    one ``/run-python`` request, without running any code.
+
+    Use this by setting ``RELATE_DOCKER_URL = "fake://"``.
+    """
+
+    next_container_nr = [0]
+    class_lock = threading.Lock()
+
+    def __init__(self, run_response=None):
+        if run_response is None:
+            run_response = {
+                    "result": "success",
+                    "points": None,
+                    "feedback": ["(fake container: code was not run)"],
+                    }
+
+        self.run_response = run_response
+        self.containers = {}
+        self.lock = threading.Lock()
+
+    def create_container(self, image, command, **kwargs):
+        with self.class_lock:
+            self.next_container_nr[0] += 1
+            container_id = "fake-%d" % self.next_container_nr[0]
+
+        with self.lock:
+            self.containers[container_id] = None
+
+        return {"Id": container_id}
+
+    def start(self, container_id, port_bindings=None, **kwargs):
+        server = _make_fake_runpy_server(self.run_response)
+
+        with self.lock:
+            if container_id not in self.containers:
+                server.server_close()
+                raise KeyError(container_id)
+            self.containers[container_id] = server
+
+        thread = threading.Thread(target=server.serve_forever,
+                kwargs={"poll_interval": 0.05},
+                name="fake-runpy-%s" % container_id)
+        thread.daemon = True
+        thread.start()
+
+    def port(self, container_id, private_port):
+        with self.lock:
+            server = self.containers[container_id]
+
+        return [{
+            "HostIp": "127.0.0.1",
+            "HostPort": str(server.server_address[1]),
+            }]
+
+    def logs(self, container_id):
+        return b""
+
+    def inspect_image(self, image):
+        return {"Id": "fake:" + image}
+
+    def remove_container(self, container_id, force=False):
+        with self.lock:
+            server = self.containers.pop(container_id)
+
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    def running_container_ids(self):
+        with self.lock:
+            return [container_id
+                    for container_id, server in self.containers.items()
+                    if server is not None]
+
+
+def _make_fake_runpy_server(run_response):
+    import json
+    from six.moves import socketserver
+    from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+
+    class FakeRunRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _respond(self, content_type, data):
+            self.send_response(200)
+            self.send_header("Content-type", content_type)
+            self.send_header("Content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):  # noqa
+            self._respond("text/plain", b"OK")
+
+        def do_POST(self):  # noqa
+            clength = int(self.headers['content-length'])
+            self.rfile.read(clength)
+
+            self._respond("application/json",
+                    json.dumps(run_response).encode("utf-8"))
+
+        def log_message(self, format, *args):
+            pass
+
+    class FakeRunpyServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+        daemon_threads = True
+
+    return FakeRunpyServer(("127.0.0.1", 0), FakeRunRequestHandler)
+
+# }}}
+
+# vim: foldmethod=marker
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+
+__copyright__ = "Copyright (C) 2014 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+import threading
+
+from django.conf import settings
+
+__doc__ = """
+Code runners
+============
+
+A code runner executes the requests described in
+:mod:`docker-image-run-py/runpy_backend.py` on behalf of
+:class:`course.page.PythonCodeQuestion`. The ``RELATE_CODE_RUNNER``
+setting selects one of:
+
+* ``"docker"`` (the default): :class:`DockerCodeRunner`.
+
+* ``"subprocess"``: :class:`SubprocessCodeRunner`. This avoids the cost of
+  starting a container, and it does not need Docker at all, which makes it
+  suitable for testing and for small deployments where all authors of
+  submitted code are trusted. Resource limits guard against accidents, not
+  against malice: the code runs as the same user as RELATE itself and
+  can read anything RELATE can.
+
+  It is configured through these settings:
+
+  * ``RELATE_CODE_RUNNER_SUBPROCESS_PYTHON``: The Python 3 interpreter to
+    run code with. Defaults to ``"python3"``. It needs the same packages
+    as the runpy Docker image (numpy, matplotlib, ...).
+
+  * ``RELATE_CODE_RUNNER_SUBPROCESS_MAX_PARALLEL``: The number of runs per
+    server process that may happen at the same time. Defaults to the
+    number of CPU cores.
+
+  * ``RELATE_CODE_RUNNER_SUBPROCESS_MAX_MEMORY``: The size of the address
+    space (in bytes) of each run. Defaults to 1 GB.
+
+.. autoclass:: CodeRunnerBase
+.. autoclass:: DockerCodeRunner
+.. autoclass:: SubprocessCodeRunner
+.. autofunction:: get_code_runner
+"""
+
+
+class CodeRunnerBase(object):
+    """
+    .. automethod:: run
+    .. automethod:: run_batch
+    .. automethod:: get_environment_id
+    """
+
+    def run(self, run_req, run_timeout, image=None):
+        """
+        :arg image: The Docker image to use, where applicable.
+        :returns: a response as described in
+            :mod:`docker-image-run-py/runpy_backend.py`.
+        """
+
+        raise NotImplementedError()
+
+    def run_batch(self, run_req, user_codes, run_timeout, image=None,
+            retry_count=3):
+        """Run *run_req* once for each entry of *user_codes*.
+
+        :returns: a list of responses, in the same order as *user_codes*.
+        """
+
+        from course.page.code import request_python_run_with_retries
+
+        results = []
+        for user_code in user_codes:
+            single_run_req = dict(run_req)
+            single_run_req["user_code"] = user_code
+            results.append(
+                    request_python_run_with_retries(single_run_req,
+                        run_timeout=run_timeout, image=image,
+                        retry_count=retry_count))
+
+        return results
+
+    def get_environment_id(self, image=None):
+        """
+        :returns: a string that changes whenever the environment in which
+            code is run changes, or *None* if that cannot be determined.
+            Run results are only cached if this is not *None*.
+        """
+
+        return None
+
+
+# {{{ docker
+
+class DockerCodeRunner(CodeRunnerBase):
+    """Runs each request in a fresh container, started from the image given
+    by ``RELATE_DOCKER_RUNPY_IMAGE`` through the Docker interface at
+    ``RELATE_DOCKER_URL``. See also :mod:`course.page.code_pool`.
+    """
+
+    def run(self, run_req, run_timeout, image=None):
+        from course.page.code import request_python_run_in_docker
+        return request_python_run_in_docker(run_req, run_timeout, image=image)
+
+    def run_batch(self, run_req, user_codes, run_timeout, image=None,
+            retry_count=3):
+        from course.page.code import request_python_run_batch_in_docker
+        return request_python_run_batch_in_docker(run_req, user_codes,
+                run_timeout, image=image, retry_count=retry_count)
+
+    def get_environment_id(self, image=None):
+        from course.page.code import get_runpy_image_id
+        return get_runpy_image_id(image)
+
+# }}}
+
+
+# {{{ subprocess
+
+# Runs in the child interpreter. argv[1] is the directory containing
+# runpy_backend.py, argv[2:5] are the CPU time (in seconds), address space
+# and file size limits. Reads the request from stdin, writes the response to
+# the original stdout.
+#
+# The limits are applied here rather than in a preexec_fn, which would run
+# between fork and exec in the (multi-threaded) server process.
+SUBPROCESS_DRIVER = """
+import io
+import json
+import os
+import resource
+import sys
+
+# so that the whole process group can be killed on timeout
+os.setsid()
+
+cpu_seconds, max_memory, max_file_size = [int(arg) for arg in sys.argv[2:5]]
+resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+resource.setrlimit(resource.RLIMIT_FSIZE, (max_file_size, max_file_size))
+resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+# Linux only: this process and its descendants can never gain privileges,
+# e.g. through setuid executables.
+try:
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    PR_SET_NO_NEW_PRIVS = 38
+    libc.prctl(PR_SET_NO_NEW_PRIVS, 1, 0, 0, 0)
+except Exception:
+    pass
+
+sys.path.insert(0, sys.argv[1])
+from runpy_backend import Struct, run_code, package_exception
+
+OUTPUT_LENGTH_LIMIT = 16*1024
+
+
+def truncate_if_long(s):
+    if len(s) > OUTPUT_LENGTH_LIMIT:
+        s = s[:OUTPUT_LENGTH_LIMIT] + "[TRUNCATED... TOO MUCH OUTPUT]"
+    return s
+
+
+run_req = json.loads(sys.stdin.read())
+
+# Keep the response channel away from anything the code being run may
+# print, even via file descriptor 1.
+response_file = os.fdopen(os.dup(1), "w")
+devnull_fd = os.open(os.devnull, os.O_RDWR)
+os.dup2(devnull_fd, 0)
+os.dup2(devnull_fd, 1)
+
+stdout = io.StringIO()
+stderr = io.StringIO()
+sys.stdin = None
+sys.stdout = stdout
+sys.stderr = stderr
+
+response = {}
+try:
+    run_code(response, Struct(run_req))
+except:
+    response = {}
+    package_exception(response, "uncaught_error")
+
+response["stdout"] = truncate_if_long(stdout.getvalue())
+response["stderr"] = truncate_if_long(stderr.getvalue())
+
+response_file.write(json.dumps(response))
+response_file.close()
+"""
+
+SUBPROCESS_BACKEND_DIR = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)))),
+        "docker-image-run-py")
+
+# Largest file (in bytes) the code being run may write.
+SUBPROCESS_MAX_FILE_SIZE = 10*1024*1024
+
+
+class SubprocessCodeRunner(CodeRunnerBase):
+    """Runs each request in a new, resource-limited interpreter process,
+    without any container isolation. See the module documentation for the
+    settings that apply.
+    """
+
+    def __init__(self):
+        import multiprocessing
+        self.python = getattr(settings, "RELATE_CODE_RUNNER_SUBPROCESS_PYTHON",
+                "python3")
+        self.max_parallel = getattr(settings,
+                "RELATE_CODE_RUNNER_SUBPROCESS_MAX_PARALLEL",
+                multiprocessing.cpu_count())
+        self.max_memory = getattr(settings,
+                "RELATE_CODE_RUNNER_SUBPROCESS_MAX_MEMORY", 10**9)
+        self.max_response_bytes = getattr(
+                settings, "RELATE_RUNPY_MAX_RESPONSE_BYTES", 10*1024*1024)
+
+        self.slots = threading.BoundedSemaphore(self.max_parallel)
+
+    def run(self, run_req, run_timeout, image=None):
+        with self.slots:
+            return self._run(run_req, run_timeout)
+
+    def _run(self, run_req, run_timeout):
+        import json
+        import signal
+        import subprocess
+        import tempfile
+        import shutil
+        from time import time
+        from course.page.code import (
+                RUNPY_READ_CHUNK_SIZE, _add_execution_time_feedback)
+
+        work_dir = tempfile.mkdtemp(prefix="relate-run-")
+        stderr_file = tempfile.TemporaryFile()
+
+        env = {
+                "PATH": os.environ.get("PATH", "/usr/bin:/bin"),
+                "HOME": work_dir,
+                "MPLBACKEND": "Agg",
+                # Thread pools reserve address space, which counts against
+                # the memory limit.
+                "OMP_NUM_THREADS": "1",
+                "OPENBLAS_NUM_THREADS": "1",
+                }
+
+        start_time = time()
+        proc = subprocess.Popen(
+                [self.python, "-c", SUBPROCESS_DRIVER, SUBPROCESS_BACKEND_DIR,
+                    # The CPU limit is a backstop. The wall clock timeout
+                    # below is what usually applies.
+                    str(int(run_timeout) + 2),
+                    str(self.max_memory),
+                    str(SUBPROCESS_MAX_FILE_SIZE)],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=stderr_file,
+                cwd=work_dir, env=env, close_fds=True)
+
+        timed_out = [False]
+
+        def kill():
+            timed_out[0] = True
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                # The driver may not have called setsid yet.
+                try:
+                    proc.kill()
+                except OSError:
+                    pass
+
+        # Add a second to accommodate interpreter startup
+        timer = threading.Timer(1 + run_timeout, kill)
+        timer.daemon = True
+        timer.start()
+
+        try:
+            try:
+                proc.stdin.write(json.dumps(run_req).encode("utf-8"))
+                proc.stdin.close()
+            except (IOError, OSError):
+                # child died early, diagnosed below
+                pass
+
+            chunks = []
+            size = 0
+            too_large = False
+            while True:
+                chunk = proc.stdout.read(RUNPY_READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                size += len(chunk)
+                if size > self.max_response_bytes:
+                    too_large = True
+                    kill()
+                    break
+
+                chunks.append(chunk)
+
+            proc.stdout.close()
+            proc.wait()
+            end_time = time()
+
+        finally:
+            timer.cancel()
+
+            if proc.returncode is None:
+                kill()
+                proc.wait()
+
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        if too_large:
+            stderr_file.close()
+            return {
+                    "result": "output_too_large",
+                    "message": "Response exceeded %d bytes."
+                    % self.max_response_bytes,
+                    }
+
+        if timed_out[0] or proc.returncode == -signal.SIGXCPU:
+            stderr_file.close()
+            return {"result": "timeout"}
+
+        stderr_file.seek(0)
+        child_stderr = stderr_file.read().decode("utf-8", "replace")
+        stderr_file.close()
+
+        try:
+            result = json.loads(b"".join(chunks).decode("utf-8"))
+        except ValueError:
+            return {
+                    "result": "uncaught_error",
+                    "message": "Code runner process exited with status %d "
+                    "without a response." % proc.returncode,
+                    "traceback": child_stderr,
+                    }
+
+        _add_execution_time_feedback(result, end_time - start_time, run_timeout)
+        return result
+
+    def run_batch(self, run_req, user_codes, run_timeout, image=None,
+            retry_count=3):
+        from multiprocessing.pool import ThreadPool
+
+        def run_one(user_code):
+            single_run_req = dict(run_req)
+            single_run_req["user_code"] = user_code
+            return self.run(single_run_req, run_timeout)
+
+        pool = ThreadPool(min(self.max_parallel, max(1, len(user_codes))))
+        try:
+            return pool.map(run_one, user_codes)
+        finally:
+            pool.close()
+            pool.join()
+
+# }}}
+
+
+CODE_RUNNER_CLASSES = {
+        "docker": DockerCodeRunner,
+        "subprocess": SubprocessCodeRunner,
+        }
+
+_CODE_RUNNERS = {}
+_CODE_RUNNERS_LOCK = threading.Lock()
+
+
+def get_code_runner():
+    """Return the process-wide :class:`CodeRunnerBase` instance selected by
+    ``RELATE_CODE_RUNNER``.
+    """
+
+    name = getattr(settings, "RELATE_CODE_RUNNER", "docker")
+
+    with _CODE_RUNNERS_LOCK:
+        try:
+            return _CODE_RUNNERS[name]
+        except KeyError:
+            pass
+
+        try:
+            runner_class = CODE_RUNNER_CLASSES[name]
+        except KeyError:
+            from django.core.exceptions import ImproperlyConfigured
+            raise ImproperlyConfigured(
+                    "RELATE_CODE_RUNNER: unknown code runner '%s'" % name)
+
+        runner = runner_class()
+        _CODE_RUNNERS[name] = runner
+        return runner
+
+# vim: foldmethod=marker
@@ -29,7 +29,7 @@ from celery import shared_task
 from django.db import transaction
 from django.utils.translation import ugettext as _
 
-from course.models import (Course, FlowSession)
+from course.models import (Course, FlowSession, FlowPageVisit)
 from course.content import get_course_repo
 
 
@@ -155,9 +155,21 @@ def regrade_flow_sessions(self, course_id, flow_id, access_rules_tag, inprog_val
     nsessions = sessions.count()
     count = 0
 
-    from course.flow import regrade_session
+    from course.flow import (
+            regrade_session, get_answer_visits_to_regrade,
+            batch_grade_page_visits)
+
+    # Grade all answers to a page together, so that pages can share work
+    # between them, e.g. by running many code answers in one container.
+    visits = []
     for session in sessions:
-        regrade_session(repo, course, session)
+        visits.extend(get_answer_visits_to_regrade(session))
+
+    precomputed_feedback = batch_grade_page_visits(repo, course, visits)
+
+    for session in sessions:
+        regrade_session(repo, course, session,
+                precomputed_feedback=precomputed_feedback)
         count += 1
 
         self.update_state(
@@ -169,4 +181,123 @@ def regrade_flow_sessions(self, course_id, flow_id, access_rules_tag, inprog_val
     return {"message": _("%d sessions regraded.") % count}
 
 
+@shared_task(bind=True)
+def warm_course_content(self, course_id, commit_sha):
+    """Render the markup in the course page, the events file and all flows
+    at *commit_sha*, so that it is in the cache by the time participants
+    ask for it.
+    """
+
+    import six
+    from functools import partial
+    from django.core.exceptions import ObjectDoesNotExist
+    from course.content import (
+            get_course_desc, get_raw_yaml_from_repo, list_flow_ids,
+            get_flow_desc, get_flow_page, markup_to_html,
+            prefetch_repo_paths)
+    from course.page import PageContext
+
+    course = Course.objects.get(id=course_id)
+    repo = get_course_repo(course)
+    commit_sha = commit_sha.encode()
+
+    # {{{ gather work
+
+    from collections import deque
+    steps = deque()
+
+    course_desc = get_course_desc(repo, course, commit_sha)
+    for chunk in getattr(course_desc, "chunks", []):
+        steps.append(
+                partial(markup_to_html, course, repo, commit_sha, chunk.content))
+
+    try:
+        event_descr = get_raw_yaml_from_repo(
+                repo, course.events_file, commit_sha)
+    except ObjectDoesNotExist:
+        event_descr = {}
+
+    for event_desc in six.itervalues(event_descr.get("events", {})):
+        if "description" in event_desc:
+            steps.append(partial(markup_to_html, course, repo, commit_sha,
+                event_desc["description"]))
+
+    page_context = PageContext(
+            course=course, repo=repo, commit_sha=commit_sha,
+            flow_session=None)
+
+    def warm_page(flow_id, flow_desc, group_id, page_id):
+        page = get_flow_page(repo, course, flow_id, flow_desc,
+                group_id, page_id, commit_sha)
+        page.body(page_context, page.make_page_data())
+
+    flow_ids = [
+            flow_id.decode("utf-8")
+            if isinstance(flow_id, six.binary_type) else flow_id
+            for flow_id in list_flow_ids(repo, commit_sha)]
+
+    prefetch_repo_paths(repo,
+            ["flows/%s.yml" % flow_id for flow_id in flow_ids], commit_sha)
+
+    def warm_flow(flow_id):
+        # renders the flow description
+        flow_desc = get_flow_desc(repo, course, flow_id, commit_sha)
+
+        # run after the steps known so far
+        steps.extend(
+                partial(warm_page, flow_id, flow_desc, grp.id, page_desc.id)
+                for grp in flow_desc.groups
+                for page_desc in grp.pages)
+
+    for flow_id in flow_ids:
+        steps.append(partial(warm_flow, flow_id))
+
+    # }}}
+
+    done_count = 0
+    failed_count = 0
+    while steps:
+        step = steps.popleft()
+        try:
+            step()
+        except Exception:
+            # Whatever failed here will also fail (and get reported) when
+            # a participant views it.
+            failed_count += 1
+
+        done_count += 1
+        self.update_state(
+                state='PROGRESS',
+                meta={'current': done_count, 'total': done_count + len(steps)})
+
+    repo.close()
+
+    return {"message": _("%(count)d content items rendered, "
+        "%(failed)d failed.") % {
+            "count": done_count - failed_count,
+            "failed": failed_count}}
+
+
+@shared_task(bind=True, max_retries=20)
+@transaction.atomic
+def grade_page_visit_task(self, visit_id, graded_at_git_commit_sha):
+    try:
+        # Lock the visit, so that finishing the session (which also grades
+        # it, see course.flow.grade_page_visits) cannot grade it at the
+        # same time.
+        visit = FlowPageVisit.objects.select_for_update().get(id=visit_id)
+    except FlowPageVisit.DoesNotExist:
+        # The transaction that saved the visit may not have committed yet.
+        raise self.retry(countdown=0.5)
+
+    if visit.get_most_recent_grade() is not None:
+        # e.g. because the session was finished in the meantime
+        return {"message": _("Answer was already graded.")}
+
+    from course.flow import grade_page_visit
+    grade_page_visit(visit, graded_at_git_commit_sha=graded_at_git_commit_sha)
+
+    return {"message": _("Answer graded.")}
+
+
 # vim: foldmethod=marker
@@ -463,17 +463,10 @@ class FlowPageContext(FlowContext):
 
 
 def instantiate_flow_page_with_ctx(fctx, page_data):
-    from course.content import get_flow_page_desc
-    page_desc = get_flow_page_desc(
-            fctx.flow_id, fctx.flow_desc,
-            page_data.group_id, page_data.page_id)
-
-    from course.content import instantiate_flow_page
-    return instantiate_flow_page(
-            "course '%s', flow '%s', page '%s/%s'"
-            % (fctx.course.identifier, fctx.flow_id,
-                page_data.group_id, page_data.page_id),
-            fctx.repo, page_desc, fctx.course_commit_sha)
+    from course.content import get_flow_page
+    return get_flow_page(
+            fctx.repo, fctx.course, fctx.flow_id, fctx.flow_desc,
+            page_data.group_id, page_data.page_id, fctx.course_commit_sha)
 
 # }}}
 
@@ -509,7 +502,10 @@ def render_course_page(pctx, template_name, args,
     else:
         instant_flow_requests = []
 
+    from course.grades import get_available_grade_book_export_formats
+
     args.update({
+        "grade_book_export_formats": get_available_grade_book_export_formats(),
         "course": pctx.course,
         "course_desc": pctx.course_desc,
         "participation": pctx.participation,
@@ -526,14 +522,14 @@ def render_course_page(pctx, template_name, args,
 # {{{ page cache
 
 class PageInstanceCache(object):
-    """Caches instances of :class:`course.page.Page`."""
+    """Retrieves instances of :class:`course.page.Page` through
+    :func:`course.content.get_flow_page`."""
 
     def __init__(self, repo, course, flow_id):
         self.repo = repo
         self.course = course
         self.flow_id = flow_id
         self.flow_desc_cache = {}
-        self.page_cache = {}
 
     def get_flow_desc_from_cache(self, commit_sha):
         try:
@@ -545,25 +541,11 @@ class PageInstanceCache(object):
             return flow_desc
 
     def get_page(self, group_id, page_id, commit_sha):
-        key = (group_id, page_id, commit_sha)
-        try:
-            return self.page_cache[key]
-        except KeyError:
-
-            from course.content import get_flow_page_desc, instantiate_flow_page
-            page_desc = get_flow_page_desc(
-                    self.flow_id,
-                    self.get_flow_desc_from_cache(commit_sha),
-                    group_id, page_id)
-
-            page = instantiate_flow_page(
-                    location="flow '%s', group, '%s', page '%s'"
-                    % (self.flow_id, group_id, page_id),
-                    repo=self.repo, page_desc=page_desc,
-                    commit_sha=commit_sha)
-
-            self.page_cache[key] = page
-            return page
+        from course.content import get_flow_page
+        return get_flow_page(
+                self.repo, self.course, self.flow_id,
+                self.get_flow_desc_from_cache(commit_sha),
+                group_id, page_id, commit_sha)
 
 # }}}
 
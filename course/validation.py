@@ -186,6 +186,12 @@ class ValidationContext(object):
 
         A :class:`course.models.Course` instance, or *None*, if no database
         is currently available.
+
+    .. attribute:: flow_timings
+    .. attribute:: page_timings
+
+        *None*, or lists to which tuples ``(location, seconds)`` are
+        appended for each flow (or page) validated.
     """
 
     def __init__(self, repo, commit_sha, course=None):
@@ -195,6 +201,9 @@ class ValidationContext(object):
 
         self.warnings = []
 
+        self.flow_timings = None
+        self.page_timings = None
+
     def encounter_datespec(self, location, datespec):
         from course.content import parse_date_spec
         parse_date_spec(self.course, datespec, vctx=self, location=location)
@@ -373,6 +382,9 @@ def validate_flow_page(ctx, location, page_desc):
 
     validate_identifier(ctx, location, page_desc.id)
 
+    from time import time
+    start_time = time()
+
     from course.content import get_flow_page_class
     try:
         class_ = get_flow_page_class(ctx.repo, page_desc.type, ctx.commit_sha)
@@ -395,6 +407,9 @@ def validate_flow_page(ctx, location, page_desc):
                     "err_str": str(e),
                     'format_exc': format_exc()})
 
+    if ctx.page_timings is not None:
+        ctx.page_timings.append((location, time() - start_time))
+
 
 def validate_flow_group(ctx, location, grp):
     validate_struct(
@@ -1017,22 +1032,27 @@ def check_for_page_type_changes(vctx, location, course, flow_id, flow_desc):
     from course.content import normalize_flow_desc
     n_flow_desc = normalize_flow_desc(flow_desc)
 
+    # (group_id, page_id) -> set of page types found in the database
+    used_page_types = {}
+
     from course.models import FlowPageData
+    for group_id, page_id, page_type in (
+            FlowPageData.objects
+            .filter(
+                flow_session__course=course,
+                flow_session__flow_id=flow_id)
+            .exclude(page_type=None)
+            .values_list("group_id", "page_id", "page_type")
+            .distinct()):
+        used_page_types.setdefault((group_id, page_id), set()).add(page_type)
+
     for grp in n_flow_desc.groups:
         for page_desc in grp.pages:
-            fpd_with_mismatched_page_types = list(
-                    FlowPageData.objects
-                    .filter(
-                        flow_session__course=course,
-                        flow_session__flow_id=flow_id,
-                        group_id=grp.id,
-                        page_id=page_desc.id)
-                    .exclude(page_type=None)
-                    .exclude(page_type=page_desc.type)
-                    [0:1])
-
-            if fpd_with_mismatched_page_types:
-                mismatched_fpd, = fpd_with_mismatched_page_types
+            mismatched_page_types = sorted(
+                    used_page_types.get((grp.id, page_desc.id), set())
+                    - set([page_desc.type]))
+
+            if mismatched_page_types:
                 raise ValidationError(
                         _("%(loc)s, group '%(group)s', page '%(page)s': "
                             "page type ('%(type_new)s') differs from "
@@ -1040,13 +1060,250 @@ def check_for_page_type_changes(vctx, location, course, flow_id, flow_desc):
                         % {"loc": location, "group": grp.id,
                             "page": page_desc.id,
                             "type_new": page_desc.type,
-                            "type_old": mismatched_fpd.page_type})
+                            "type_old": mismatched_page_types[0]})
+
+# }}}
+
+
+# {{{ incremental flow validation
+
+# Cached outcomes also expire when the code that validates flows changes
+# (see get_flow_validation_code_hash). Increasing this makes them expire
+# regardless.
+FLOW_VALIDATION_CACHE_VERSION = 1
+
+_FLOW_VALIDATION_CODE_HASH = []
+
+
+def get_flow_validation_code_hash():
+    """Return a hash of the source of the modules that validate flows:
+    this one, :mod:`course.content` and the page types in :mod:`course.page`.
+    """
+
+    if not _FLOW_VALIDATION_CODE_HASH:
+        import hashlib
+        from glob import glob
+        from os.path import abspath, dirname, join
+
+        course_dir = dirname(abspath(__file__))
+        paths = (
+                [join(course_dir, "validation.py"),
+                    join(course_dir, "content.py")]
+                + sorted(glob(join(course_dir, "page", "*.py"))))
+
+        code_hash = hashlib.sha1()
+        for path in paths:
+            try:
+                with open(path, "rb") as inf:
+                    code_hash.update(inf.read())
+            except IOError:
+                # e.g. when run from a zip file
+                code_hash.update(path.encode("utf-8"))
+
+        _FLOW_VALIDATION_CODE_HASH.append(code_hash.hexdigest())
+
+    return _FLOW_VALIDATION_CODE_HASH[0]
+
+
+JINJA_TEMPLATE_REFERENCE_RE = re.compile(
+        r"\{%-?\s*(?:include|import|from|extends)\s+(?:([\"'])(.*?)\1)?")
+
+
+class FlowValidationContext(ValidationContext):
+    """Validates one flow. Date specifications are only recorded in
+    :attr:`datespecs`, because whether they are valid depends on the
+    events in the database rather than on the flow.
+    """
+
+    def __init__(self, repo, commit_sha, course=None):
+        super(FlowValidationContext, self).__init__(
+                repo=repo, commit_sha=commit_sha, course=course)
+
+        self.datespecs = []
+
+    def encounter_datespec(self, location, datespec):
+        self.datespecs.append((location, datespec))
+
+
+def find_referenced_templates(repo, commit_sha, text):
+    """
+    :returns: the :class:`set` of names of the templates included or
+        imported by the Jinja code in *text*, directly or through other
+        templates, or *None* if some template name is not a literal.
+    """
+
+    result = set()
+    texts_to_scan = [text]
+
+    while texts_to_scan:
+        for match in JINJA_TEMPLATE_REFERENCE_RE.finditer(texts_to_scan.pop()):
+            name = match.group(2)
+            if name is None:
+                return None
+
+            if name in result:
+                continue
+            result.add(name)
+
+            try:
+                texts_to_scan.append(
+                        get_repo_blob(repo, name, commit_sha).data
+                        .decode("utf-8", "replace"))
+            except ObjectDoesNotExist:
+                # will fail validation
+                pass
+
+    return result
+
+
+def _get_repo_path_sha(repo, path, commit_sha):
+    from course.content import get_repo_blob_sha
+    try:
+        return get_repo_blob_sha(repo, path, commit_sha)
+    except ObjectDoesNotExist:
+        return None
+
+
+def get_flow_validation_dependencies(repo, commit_sha, location, flow_desc):
+    """
+    :returns: a :class:`dict` mapping names of files (or directories) in
+        *repo* on which the validation of the flow at *location* depends
+        to their SHAs (or *None* if they do not exist), or *None* if they
+        cannot be determined.
+    """
+
+    paths = find_referenced_templates(repo, commit_sha,
+            get_repo_blob(repo, location, commit_sha).data
+            .decode("utf-8", "replace"))
+    if paths is None:
+        return None
+
+    if hasattr(flow_desc, "pages"):
+        page_descs = flow_desc.pages
+    else:
+        page_descs = [page_desc
+                for grp in getattr(flow_desc, "groups", [])
+                for page_desc in grp.pages]
+
+    for page_desc in page_descs:
+        if page_desc.type.startswith("repo:"):
+            paths.add("code")
+        paths.update(getattr(page_desc, "data_files", []))
+
+    return dict(
+            (path, _get_repo_path_sha(repo, path, commit_sha))
+            for path in paths)
+
+
+def validate_flow_incrementally(vctx, location):
+    """Parse and validate the flow at *location*, unless an earlier
+    validation of an identical flow with identical dependencies (see
+    :func:`get_flow_validation_dependencies`) succeeded, in which case its
+    outcome is reused. Either way, the warnings produced are added to
+    *vctx*.
+
+    :returns: the flow description
+    """
+
+    repo = vctx.repo
+    commit_sha = vctx.commit_sha
+
+    # Only real repositories have stable SHAs.
+    cacheable = (
+            isinstance(commit_sha, six.binary_type)
+            and getattr(getattr(repo, "repo", repo), "path", None) is not None)
+
+    if cacheable:
+        from course.content import get_repo_blob_sha, make_content_cache_key
+        from django.utils.translation import get_language
+
+        cache_key = make_content_cache_key("flow-validation", (
+            FLOW_VALIDATION_CACHE_VERSION,
+            get_flow_validation_code_hash(),
+            # warnings are translated
+            get_language() or "",
+            repo.controldir(), getattr(repo, "subdir", ""),
+            get_repo_blob_sha(repo, location, commit_sha)))
+
+        import django.core.cache as cache
+        def_cache = cache.caches["default"]
+
+        entry = def_cache.get(cache_key)
+        if entry is not None and all(
+                _get_repo_path_sha(repo, path, commit_sha) == sha
+                for path, sha in six.iteritems(entry["dependencies"])):
+            flow_desc = entry["flow_desc"]
+            warnings = entry["warnings"]
+            datespecs = entry["datespecs"]
+        else:
+            entry = None
+
+    if not cacheable or entry is None:
+        flow_vctx = FlowValidationContext(
+                repo=repo, commit_sha=commit_sha, course=vctx.course)
+        flow_vctx.page_timings = vctx.page_timings
+
+        flow_desc = get_yaml_from_repo_safely(repo, location,
+                commit_sha=commit_sha)
+
+        validate_flow_desc(flow_vctx, location, flow_desc)
+
+        warnings = [
+                ValidationWarning(w.location, six.text_type(w.text))
+                for w in flow_vctx.warnings]
+        datespecs = flow_vctx.datespecs
+
+        if cacheable:
+            dependencies = get_flow_validation_dependencies(
+                    repo, commit_sha, location, flow_desc)
+            if dependencies is not None:
+                def_cache.set(cache_key, {
+                    "dependencies": dependencies,
+                    "flow_desc": flow_desc,
+                    "warnings": warnings,
+                    "datespecs": datespecs,
+                    }, None)
+
+    vctx.warnings.extend(warnings)
+    for datespec_location, datespec in datespecs:
+        vctx.encounter_datespec(datespec_location, datespec)
+
+    return flow_desc
+
+
+def validate_flows_serially(vctx, locations):
+    """
+    :returns: a list of the flow descriptions at *locations*
+    """
+
+    from time import time
+
+    flow_descs = []
+    for location in locations:
+        start_time = time()
+        flow_descs.append(validate_flow_incrementally(vctx, location))
+
+        if vctx.flow_timings is not None:
+            vctx.flow_timings.append((location, time() - start_time))
+
+    return flow_descs
 
 # }}}
 
 
 def validate_course_content(repo, course_file, events_file,
-        validate_sha, course=None):
+        validate_sha, course=None, validate_flows=None, timings=None):
+    """
+    :arg validate_flows: a function with the interface of
+        :func:`validate_flows_serially`, used to validate the flows.
+    :arg timings: if not *None*, a :class:`dict` in which lists of
+        ``(location, seconds)`` for the validation of each flow and each page
+        are placed under the keys ``"flows"`` and ``"pages"``.
+    """
+
+    if validate_flows is None:
+        validate_flows = validate_flows_serially
+
     course_desc = get_yaml_from_repo_safely(repo, course_file,
             commit_sha=validate_sha)
 
@@ -1055,6 +1312,10 @@ def validate_course_content(repo, course_file, events_file,
             commit_sha=validate_sha,
             course=course)
 
+    if timings is not None:
+        vctx.flow_timings = timings["flows"] = []
+        vctx.page_timings = timings["pages"] = []
+
     validate_course_desc_struct(vctx, course_file, course_desc)
 
     try:
@@ -1095,10 +1356,11 @@ def validate_course_content(repo, course_file, events_file,
         # That's OK--no flows yet.
         pass
     else:
-        used_grade_identifiers = set()
+        flow_ids = []
 
-        for entry in flows_tree.items():
-            entry_path = entry.path.decode("utf-8")
+        # sorted, so that errors and warnings are reported in a fixed order
+        for entry_path in sorted(
+                entry.path.decode("utf-8") for entry in flows_tree.items()):
             if not entry_path.endswith(".yml"):
                 continue
 
@@ -1114,11 +1376,15 @@ def validate_course_content(repo, course_file, events_file,
                                 "dashes and underscores."))
                         % entry_path)
 
-            location = "flows/%s" % entry_path
-            flow_desc = get_yaml_from_repo_safely(repo, location,
-                    commit_sha=validate_sha)
+            flow_ids.append(flow_id)
 
-            validate_flow_desc(vctx, location, flow_desc)
+        flow_descs = validate_flows(
+                vctx, ["flows/%s.yml" % flow_id for flow_id in flow_ids])
+
+        used_grade_identifiers = set()
+
+        for flow_id, flow_desc in zip(flow_ids, flow_descs):
+            location = "flows/%s.yml" % flow_id
 
             # {{{ check grade_identifier
 
@@ -1177,10 +1443,13 @@ class FileSystemFakeRepo(object):
 
 
 class FileSystemFakeRepoTreeEntry(object):
-    def __init__(self, path, mode):
+    def __init__(self, path, mode, sha):
         self.path = path
         self.mode = mode
 
+        # the tree or file object itself, see FileSystemFakeRepo.__getitem__
+        self.sha = sha
+
 
 class FileSystemFakeRepoTree(object):
     def __init__(self, root):
@@ -1188,6 +1457,8 @@ class FileSystemFakeRepoTree(object):
 
     def __getitem__(self, name):
         from os.path import join, isdir, exists
+        if isinstance(name, six.binary_type):
+            name = name.decode("utf-8")
         name = join(self.root, name)
 
         if not exists(name):
@@ -1201,11 +1472,19 @@ class FileSystemFakeRepoTree(object):
 
     def items(self):
         import os
-        return [
-                FileSystemFakeRepoTreeEntry(
-                    path=n,
-                    mode=os.stat(os.path.join(self.root, n)).st_mode)
-                for n in os.listdir(self.root)]
+        result = []
+        for n in os.listdir(self.root):
+            mode = os.stat(os.path.join(self.root, n)).st_mode
+            _, sha = self[n]
+
+            # like dulwich: paths are byte strings
+            if isinstance(n, six.text_type):
+                n = n.encode("utf-8")
+
+            result.append(FileSystemFakeRepoTreeEntry(
+                path=n, mode=mode, sha=sha))
+
+        return result
 
 
 class FileSystemFakeRepoFile(object):
@@ -1218,6 +1497,83 @@ class FileSystemFakeRepoFile(object):
             return inf.read()
 
 
+def _init_filesystem_validation_worker():
+    from django.conf import settings
+    if not settings.configured:
+        # not inherited through fork()
+        settings.configure(DEBUG=True)
+
+        import django
+        django.setup()
+
+
+def _validate_flow_on_filesystem(args):
+    root, location, profile = args
+
+    fake_repo = FileSystemFakeRepo(root)
+    vctx = ValidationContext(
+            repo=fake_repo, commit_sha=fake_repo, course=None)
+    if profile:
+        vctx.page_timings = []
+
+    from time import time
+    start_time = time()
+
+    try:
+        flow_desc = validate_flow_incrementally(vctx, location)
+    except ValidationError as e:
+        return {"error": six.text_type(e)}
+
+    return {
+            "flow_desc": flow_desc,
+            "warnings": [
+                (w.location, six.text_type(w.text)) for w in vctx.warnings],
+            "time": time() - start_time,
+            "page_timings": vctx.page_timings,
+            }
+
+
+def make_parallel_filesystem_flow_validator(root, jobs, profile=False):
+    """
+    :returns: a function with the interface of
+        :func:`validate_flows_serially` that validates the flows in the
+        course at *root* on the file system using *jobs* processes.
+        Warnings and errors are reported in the same order as by
+        :func:`validate_flows_serially`.
+    """
+
+    def validate_flows(vctx, locations):
+        from multiprocessing import Pool
+        pool = Pool(jobs, initializer=_init_filesystem_validation_worker)
+        try:
+            results = pool.map(
+                    _validate_flow_on_filesystem,
+                    [(root, location, profile) for location in locations],
+                    chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        flow_descs = []
+        for location, result in zip(locations, results):
+            if "error" in result:
+                raise ValidationError(result["error"])
+
+            for warning_location, text in result["warnings"]:
+                vctx.add_warning(warning_location, text)
+
+            if vctx.flow_timings is not None:
+                vctx.flow_timings.append((location, result["time"]))
+            if vctx.page_timings is not None:
+                vctx.page_timings.extend(result["page_timings"])
+
+            flow_descs.append(result["flow_desc"])
+
+        return flow_descs
+
+    return validate_flows
+
+
 def validate_course_on_filesystem_script_entrypoint():
     from django.conf import settings
     settings.configure(DEBUG=True)
@@ -1230,21 +1586,42 @@ def validate_course_on_filesystem_script_entrypoint():
     parser = argparse.ArgumentParser(description='Process some integers.')
     parser.add_argument("--course-file", default="course.yml")
     parser.add_argument("--events-file", default="events.yml")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+            help="Number of processes validating flows at the same time")
+    parser.add_argument("--profile", action="store_true",
+            help="Report the flows and pages that took longest to validate")
     parser.add_argument('root', default=os.getcwd())
 
     args = parser.parse_args()
 
+    validate_flows = None
+    if args.jobs > 1:
+        validate_flows = make_parallel_filesystem_flow_validator(
+                args.root, args.jobs, profile=args.profile)
+
+    timings = None
+    if args.profile:
+        timings = {}
+
     fake_repo = FileSystemFakeRepo(args.root)
     warnings = validate_course_content(
             fake_repo,
             args.course_file, args.events_file,
-            validate_sha=fake_repo, course=None)
+            validate_sha=fake_repo, course=None,
+            validate_flows=validate_flows, timings=timings)
 
     if warnings:
         print(_("WARNINGS: "))
         for w in warnings:
             print("***", w.location, w.text)
 
+    if timings:
+        for kind in ["flows", "pages"]:
+            print("Slowest %s:" % kind)
+            for location, seconds in sorted(
+                    timings.get(kind, []), key=lambda item: -item[1])[:10]:
+                print("%8.3f s  %s" % (seconds, location))
+
 # }}}
 
 # vim: foldmethod=marker
@@ -456,6 +456,17 @@ def run_course_update_command(
     else:
         raise RuntimeError(_("invalid command"))
 
+    from django.conf import settings
+    if getattr(settings, "RELATE_WARM_CONTENT_AFTER_UPDATE", False):
+        from course.tasks import warm_course_content
+        async_res = warm_course_content.delay(pctx.course.id, new_sha.decode())
+
+        from django.core.urlresolvers import reverse
+        messages.add_message(request, messages.INFO,
+                _("Content is being rendered ahead of time. "
+                    "<a href='%s'>Progress</a>")
+                % reverse("relate-monitor_task", args=(async_res.id,)))
+
 
 class GitUpdateForm(StyledForm):
 
@@ -24,6 +24,8 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import re
+
 from django.shortcuts import (  # noqa
         render, get_object_or_404, redirect)
 from django.contrib import messages  # noqa
@@ -176,7 +178,8 @@ def get_media(request, course_identifier, commit_sha, media_path):
     role, participation = get_role_and_participation(request, course)
 
     repo = get_course_repo(course)
-    return get_repo_file_response(repo, "media/" + media_path, commit_sha)
+    return get_repo_file_response(repo, "media/" + media_path, commit_sha,
+            request=request)
 
 
 def repo_file_etag_func(request, course_identifier, commit_sha, path):
@@ -194,29 +197,54 @@ def get_repo_file(request, course_identifier, commit_sha, path):
             request, course, role, participation, commit_sha, path)
 
 
-def current_repo_file_etag_func(request, course_identifier, path):
+def get_current_repo_file_context(request, course_identifier):
+    """
+    :returns: a tuple ``(course, role, participation, commit_sha)``. This is
+        only computed once per request, so that
+        :func:`current_repo_file_etag_func` and :func:`get_current_repo_file`
+        can share it.
+    """
+
+    try:
+        return request._relate_current_repo_file_context
+    except AttributeError:
+        pass
+
     course = get_object_or_404(Course, identifier=course_identifier)
     role, participation = get_role_and_participation(
             request, course)
 
-    from course.views import check_course_state
     check_course_state(course, role)
 
     from course.content import get_course_commit_sha
     commit_sha = get_course_commit_sha(course, participation)
 
-    return ":".join([course_identifier, commit_sha, path])
+    result = (course, role, participation, commit_sha)
+    request._relate_current_repo_file_context = result
+    return result
+
+
+def current_repo_file_etag_func(request, course_identifier, path):
+    course, role, participation, commit_sha = get_current_repo_file_context(
+            request, course_identifier)
+
+    # Based on the file's contents rather than on the commit, so that files
+    # that did not change stay valid across course updates.
+    from course.content import get_repo_blob_sha
+    try:
+        blob_sha = get_repo_blob_sha(
+                get_course_repo(course), path, commit_sha.encode())
+    except ObjectDoesNotExist:
+        return None
+
+    return ":".join([course_identifier, blob_sha.decode(), path])
 
 
 @cache_control(max_age=3600*24*31)  # cache for a month
 @http_dec.condition(etag_func=current_repo_file_etag_func)
 def get_current_repo_file(request, course_identifier, path):
-    course = get_object_or_404(Course, identifier=course_identifier)
-    role, participation = get_role_and_participation(
-            request, course)
-
-    from course.content import get_course_commit_sha
-    commit_sha = get_course_commit_sha(course, participation)
+    course, role, participation, commit_sha = get_current_repo_file_context(
+            request, course_identifier)
 
     return get_repo_file_backend(
             request, course, role, participation, commit_sha, path)
@@ -236,25 +264,149 @@ def get_repo_file_backend(request, course, role, participation, commit_sha, path
     if not is_repo_file_accessible_as(access_kind, repo, commit_sha, path):
         raise PermissionDenied()
 
-    return get_repo_file_response(repo, path, commit_sha)
+    return get_repo_file_response(repo, path, commit_sha, request=request)
 
 
-def get_repo_file_response(repo, path, commit_sha):
-    from course.content import get_repo_blob_data_cached
+BYTE_RANGE_RE = re.compile(r"^\s*bytes=(\d*)-(\d*)\s*$")
 
-    try:
-        data = get_repo_blob_data_cached(
-                repo, path, commit_sha.encode())
-    except ObjectDoesNotExist:
-        raise http.Http404()
 
+class UnsatisfiableRange(Exception):
+    pass
+
+
+def parse_byte_range(request, size):
+    """Parse a ``Range`` header asking for one range of bytes.
+
+    :returns: a tuple ``(start, end)`` (end exclusive), or *None* if the
+        whole file should be sent.
+    :raises: :exc:`UnsatisfiableRange`
+    """
+
+    range_header = request.META.get("HTTP_RANGE")
+    if range_header is None or "HTTP_IF_RANGE" in request.META:
+        # If-Range would have to be checked against the ETag, which is not
+        # known here. Sending the whole file is always correct.
+        return None
+
+    match = BYTE_RANGE_RE.match(range_header)
+    if match is None:
+        # includes requests for multiple ranges
+        return None
+
+    first, last = match.groups()
+    if first:
+        if last and int(last) < int(first):
+            # invalid, so the header is ignored (RFC 7233, section 3.1)
+            return None
+
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+    elif last:
+        # suffix: the last n bytes
+        start = max(size - int(last), 0)
+        end = size
+    else:
+        return None
+
+    if start >= end:
+        raise UnsatisfiableRange()
+
+    return start, end
+
+
+def iter_byte_range(chunks, start, end):
+    offset = 0
+    for chunk in chunks:
+        chunk_end = offset + len(chunk)
+        if chunk_end > start and offset < end:
+            yield chunk[max(start - offset, 0):end - offset]
+
+        offset = chunk_end
+        if offset >= end:
+            break
+
+
+def get_repo_file_response(repo, path, commit_sha, request=None):
     from mimetypes import guess_type
     content_type, _ = guess_type(path)
 
     if content_type is None:
         content_type = "application/octet-stream"
 
-    return http.HttpResponse(data, content_type=content_type)
+    from django.conf import settings
+    sendfile_header = getattr(settings, "RELATE_REPO_FILE_SENDFILE_HEADER", None)
+    if sendfile_header is not None:
+        from course.content import get_repo_blob_disk_path
+        try:
+            disk_path = get_repo_blob_disk_path(repo, path, commit_sha.encode())
+        except ObjectDoesNotExist:
+            raise http.Http404()
+
+        # The web server sends the file, including Range handling.
+        response = http.HttpResponse(content_type=content_type)
+        if sendfile_header == "X-Accel-Redirect":
+            from os.path import relpath
+            response[sendfile_header] = (
+                    settings.RELATE_REPO_FILE_ACCEL_REDIRECT_PREFIX
+                    + relpath(disk_path, settings.RELATE_BLOB_DISK_CACHE_DIR))
+        else:
+            response[sendfile_header] = disk_path
+
+        return response
+
+    from course.content import get_repo_blob_chunks
+
+    try:
+        size, chunks = get_repo_blob_chunks(repo, path, commit_sha.encode())
+    except ObjectDoesNotExist:
+        raise http.Http404()
+
+    byte_range = None
+    if request is not None:
+        try:
+            byte_range = parse_byte_range(request, size)
+        except UnsatisfiableRange:
+            if not isinstance(chunks, list):
+                chunks.close()
+
+            response = http.HttpResponse(status=416)
+            response["Content-Range"] = "bytes */%d" % size
+            return response
+
+    if byte_range is None:
+        start, end = 0, size
+    else:
+        start, end = byte_range
+
+    if request is not None and request.method == "HEAD":
+        if not isinstance(chunks, list):
+            chunks.close()
+
+        response = http.HttpResponse(content_type=content_type)
+
+    elif isinstance(chunks, list) and len(chunks) == 1:
+        response = http.HttpResponse(
+                chunks[0][start:end], content_type=content_type)
+    elif isinstance(chunks, list):
+        response = http.StreamingHttpResponse(
+                iter_byte_range(chunks, start, end),
+                content_type=content_type)
+
+    else:
+        # a FileChunks, which seeks to the start of the range, and which
+        # the response closes when it is done
+        chunks.set_range(start, end)
+        response = http.StreamingHttpResponse(
+                chunks, content_type=content_type)
+
+    response["Content-Length"] = str(end - start)
+    response["Accept-Ranges"] = "bytes"
+
+    if byte_range is not None:
+        response.status_code = 206
+        response["Content-Range"] = "bytes %d-%d/%d" % (start, end - 1, size)
+
+    return response
 
 # }}}
 
@@ -108,6 +108,51 @@ PROTOCOL
         A list of strings.
 
         Present on ``success`` if :attr:`Request.compile_only` is *False*.
+
+BATCH PROTOCOL
+==============
+
+A POST to ``/run-python-batch`` runs several requests that share their
+setup and test code. Each job runs in its own forked process.
+
+.. class:: BatchRequest
+
+    All attributes of :class:`Request` except :attr:`Request.user_code`
+    may be given. They are shared by all jobs.
+
+    .. attribute:: jobs
+
+        A list of dictionaries, each with at least a ``user_code`` entry.
+        Entries present here override the shared attributes.
+
+    .. attribute:: timeout
+
+        The number of seconds each job may run before it is killed.
+
+    .. attribute:: max_parallel
+
+        The number of jobs to run at the same time. Optional, defaults to 1.
+
+    .. attribute:: max_result_bytes
+
+        Optional. A job whose response grows beyond this many bytes is
+        killed, and its ``result`` is ``output_too_large``.
+
+.. class:: BatchResponse
+
+    .. attribute:: result
+
+        ``success``, or one of the error values of :attr:`Response.result`
+        if the batch as a whole could not be processed.
+
+    .. attribute:: results
+
+        A list of :class:`Response` objects, one for each of
+        :attr:`BatchRequest.jobs`, in the same order. Besides the values
+        listed for :attr:`Response.result`, their ``result`` may be
+        ``output_too_large``. Each of them additionally has an
+        ``execution_time`` attribute (in seconds), unless its ``result`` is
+        ``timeout`` or ``output_too_large``.
 """
 
 
@@ -177,6 +177,14 @@ CELERY_TASK_SERIALIZER = 'pickle'
 CELERY_RESULT_SERIALIZER = 'pickle'
 CELERY_TRACK_STARTED = True
 
+if "CELERY_ROUTES" not in globals():
+    # Grading tasks go to a queue of their own so that the number of
+    # answers graded at the same time is capped by the concurrency of the
+    # worker(s) consuming it. See RELATE_ASYNC_GRADING.
+    CELERY_ROUTES = {
+            "course.tasks.grade_page_visit_task": {"queue": "relate_grading"},
+            }
+
 if "CELERY_RESULT_BACKEND" not in globals():
     if ("CACHES" in globals()
             and "LocMem" not in CACHES["default"]["BACKEND"]  # noqa
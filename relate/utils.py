@@ -140,6 +140,86 @@ def struct_to_dict(data):
 # }}}
 
 
+# {{{ in-process LRU cache
+
+class LRUCache(object):
+    """A mapping local to the current process that holds at most *max_size*
+    entries, evicting the least recently used one first. If *max_bytes* is
+    given, the sizes passed to :meth:`put` also may not add up to more than
+    that. Safe to use from multiple threads.
+
+    .. attribute:: hits
+    .. attribute:: misses
+
+        The number of calls to :meth:`get` that found (or did not find) the
+        key.
+    """
+
+    def __init__(self, max_size, max_bytes=None):
+        from collections import OrderedDict
+        import threading
+
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+
+        # key -> (value, size)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                entry = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self.entries[key] = entry
+            return entry[0]
+
+    def put(self, key, value, size=0):
+        with self.lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+
+            old_entry = self.entries.pop(key, None)
+            if old_entry is not None:
+                self.total_bytes -= old_entry[1]
+
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+
+            while (len(self.entries) > self.max_size
+                    or (self.max_bytes is not None
+                        and self.total_bytes > self.max_bytes)):
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                    "entries": len(self.entries),
+                    "bytes": self.total_bytes,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    }
+
+    def __len__(self):
+        return len(self.entries)
+
+# }}}
+
+
 def retry_transaction(f, args, kwargs={}, max_tries=None, serializable=None):
     from django.db import transaction
     from django.db.utils import OperationalError
@@ -0,0 +1,244 @@
+from __future__ import division, print_function
+
+__copyright__ = "Copyright (C) 2015 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+# Run as
+#
+#   PYTHONPATH=. python test/test_grade_aggregation.py [N_PARTICIPATIONS]
+#
+# to compare the speed of course.grade_aggregation with GradeStateMachine.
+
+import random
+import six
+
+from django.test import SimpleTestCase
+
+from course.constants import (
+        grade_state_change_types as gsct, grade_aggregation_strategy)
+
+
+# {{{ synthetic grade changes
+
+class FakeOpportunity(object):
+    def __init__(self, pk, aggregation_strategy):
+        self.pk = pk
+        self.due_time = None
+        self.aggregation_strategy = aggregation_strategy
+
+
+class FakeGradeChange(object):
+    def __init__(self, participation_index, opportunity, state,
+            points, max_points, attempt_id, grade_time):
+        self.participation_index = participation_index
+        self.opportunity = opportunity
+        self.state = state
+        self.points = points
+        self.max_points = max_points
+        self.attempt_id = attempt_id
+        self.grade_time = grade_time
+        self.due_time = None
+
+    def percentage(self):
+        if self.max_points is not None and self.points is not None:
+            return 100*self.points/self.max_points
+        else:
+            return None
+
+
+def make_synthetic_grade_changes(n_participations, n_opportunities,
+        max_changes_per_pair, seed=17):
+    rng = random.Random(seed)
+
+    strategies = [
+            grade_aggregation_strategy.max_grade,
+            grade_aggregation_strategy.avg_grade,
+            grade_aggregation_strategy.min_grade,
+            grade_aggregation_strategy.use_earliest,
+            grade_aggregation_strategy.use_latest,
+            ]
+    opportunities = [
+            FakeOpportunity(i, strategies[i % len(strategies)])
+            for i in range(n_opportunities)]
+
+    # mostly grades, occasionally everything else
+    states = (
+            [gsct.graded]*12
+            + [gsct.grading_started, gsct.retrieved, gsct.extension,
+                gsct.report_sent, gsct.do_over, gsct.unavailable,
+                gsct.exempt])
+
+    grade_time = 0
+    pair_to_gchanges = {}
+    for participation_index in range(n_participations):
+        for opp in opportunities:
+            gchanges = []
+            for i in range(rng.randint(0, max_changes_per_pair)):
+                grade_time += 1
+                state = rng.choice(states)
+
+                points = max_points = attempt_id = None
+                if state == gsct.graded:
+                    if rng.random() < 0.7:
+                        attempt_id = "flow-session-%d" % rng.randint(0, 2)
+                        if rng.random() < 0.9:
+                            points = float(rng.randint(0, 10))
+                            max_points = 10.
+                    else:
+                        points = float(rng.randint(0, 5))
+                        max_points = 5.
+
+                gchanges.append(FakeGradeChange(
+                    participation_index, opp, state, points, max_points,
+                    attempt_id, grade_time))
+
+            pair_to_gchanges[participation_index, opp.pk] = gchanges
+
+    return opportunities, pair_to_gchanges
+
+
+def make_grade_change_arrays(pair_to_gchanges):
+    from course.grade_aggregation import (
+            GradeChangeArrays, get_grade_state_code)
+
+    all_gchanges = [
+            gchange
+            for gchanges in pair_to_gchanges.values()
+            for gchange in gchanges]
+    random.Random(0).shuffle(all_gchanges)
+
+    attempt_id_to_index = {}
+
+    def nan_if_none(x):
+        return float("nan") if x is None else x
+
+    return GradeChangeArrays(
+            participation_index=[
+                gchange.participation_index for gchange in all_gchanges],
+            opportunity_index=[
+                gchange.opportunity.pk for gchange in all_gchanges],
+            state=[
+                get_grade_state_code(gchange.state)
+                for gchange in all_gchanges],
+            points=[nan_if_none(gchange.points) for gchange in all_gchanges],
+            max_points=[
+                nan_if_none(gchange.max_points) for gchange in all_gchanges],
+            attempt_id=[
+                -1 if gchange.attempt_id is None
+                else attempt_id_to_index.setdefault(
+                    gchange.attempt_id, len(attempt_id_to_index))
+                for gchange in all_gchanges],
+            grade_time=[gchange.grade_time for gchange in all_gchanges])
+
+
+def replay_with_state_machine(opportunities, pair_to_gchanges):
+    from course.models import GradeStateMachine
+    from course.grade_aggregation import (
+            STATE_NONE, STATE_ERROR, get_grade_state_code)
+
+    result = {}
+    for (participation_index, opp_pk), gchanges in six.iteritems(
+            pair_to_gchanges):
+        try:
+            machine = GradeStateMachine().consume(gchanges)
+        except (ValueError, RuntimeError):
+            result[participation_index, opp_pk] = (STATE_ERROR, None, 0)
+            continue
+
+        result[participation_index, opp_pk] = (
+                STATE_NONE if machine.state is None
+                else get_grade_state_code(machine.state),
+                machine.percentage(),
+                len(machine.valid_percentages))
+
+    return result
+
+# }}}
+
+
+class GradeAggregationTest(SimpleTestCase):
+    def test_matches_state_machine(self):
+        from course.grade_aggregation import (
+                replay_grade_changes, get_aggregation_strategy_code)
+
+        n_participations = 40
+        opportunities, pair_to_gchanges = make_synthetic_grade_changes(
+                n_participations, 10, 8)
+
+        expected = replay_with_state_machine(opportunities, pair_to_gchanges)
+
+        state, percentage, n_valid = replay_grade_changes(
+                make_grade_change_arrays(pair_to_gchanges),
+                n_participations,
+                [get_aggregation_strategy_code(opp.aggregation_strategy)
+                    for opp in opportunities])
+
+        for (participation_index, opp_pk), (exp_state, exp_percentage,
+                exp_n_valid) in six.iteritems(expected):
+            i, j = participation_index, opp_pk
+            self.assertEqual(state[i, j], exp_state)
+            self.assertEqual(n_valid[i, j], exp_n_valid)
+            if exp_percentage is None:
+                self.assertNotEqual(percentage[i, j], percentage[i, j])
+            else:
+                self.assertAlmostEqual(percentage[i, j], exp_percentage)
+
+
+def benchmark(n_participations=600, n_opportunities=80,
+        max_changes_per_pair=6):
+    from time import time
+    from course.grade_aggregation import (
+            replay_grade_changes, get_aggregation_strategy_code)
+
+    opportunities, pair_to_gchanges = make_synthetic_grade_changes(
+            n_participations, n_opportunities, max_changes_per_pair)
+    gchanges = make_grade_change_arrays(pair_to_gchanges)
+    strategies = [
+            get_aggregation_strategy_code(opp.aggregation_strategy)
+            for opp in opportunities]
+
+    print("%d participations, %d opportunities, %d grade changes"
+            % (n_participations, n_opportunities, len(gchanges)))
+
+    start = time()
+    replay_with_state_machine(opportunities, pair_to_gchanges)
+    print("GradeStateMachine: %.3f s" % (time() - start))
+
+    start = time()
+    replay_grade_changes(gchanges, n_participations, strategies)
+    print("replay_grade_changes: %.3f s" % (time() - start))
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "relate.settings")
+
+    import django
+    django.setup()
+
+    if len(sys.argv) > 1:
+        benchmark(n_participations=int(sys.argv[1]))
+    else:
+        benchmark()
+
+# vim: foldmethod=marker
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2015 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.utils.timezone import now
+
+from course.constants import (
+        participation_role, participation_status,
+        grade_state_change_types as gsct, grade_aggregation_strategy)
+from course.models import (
+        Course, Participation, GradingOpportunity, GradeChange,
+        GradeState, GradeStateMachine,
+        create_grade_changes, rebuild_grade_states)
+
+
+class GradeStateTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):  # noqa
+        cls.course = Course.objects.create(
+                identifier="test-course",
+                from_email="inform@tiker.net",
+                notify_email="inform@tiker.net",
+                active_git_commit_sha="0"*40)
+
+        cls.participations = []
+        for username in ["student1", "student2"]:
+            user = User.objects.create(
+                    username=username,
+                    email="%s@example.com" % username)
+            cls.participations.append(Participation.objects.create(
+                user=user,
+                course=cls.course,
+                role=participation_role.student,
+                status=participation_status.active))
+
+        cls.opportunities = [
+                GradingOpportunity.objects.create(
+                    course=cls.course,
+                    identifier="opp%d" % i,
+                    name="Opportunity %d" % i,
+                    aggregation_strategy=strategy)
+                for i, strategy in enumerate([
+                    grade_aggregation_strategy.max_grade,
+                    grade_aggregation_strategy.use_earliest,
+                    ])]
+
+        cls.start_time = now()
+
+    def make_grade_change(self, state, points=None, attempt_id="main",
+            opportunity=None, participation=None, minutes=0, due_time=None):
+        return GradeChange(
+                opportunity=opportunity or self.opportunities[0],
+                participation=participation or self.participations[0],
+                state=state,
+                attempt_id=attempt_id,
+                points=points,
+                max_points=10,
+                due_time=due_time,
+                grade_time=self.start_time + timedelta(minutes=minutes))
+
+    def get_machine(self, opportunity=None, participation=None):
+        opportunity = opportunity or self.opportunities[0]
+        participation = participation or self.participations[0]
+
+        try:
+            grade_state = GradeState.objects.get(
+                    opportunity=opportunity, participation=participation)
+        except GradeState.DoesNotExist:
+            grade_state = None
+
+        return GradeStateMachine.from_grade_state(grade_state, opportunity)
+
+    def test_save_and_delete(self):
+        gchange = self.make_grade_change(gsct.graded, points=5)
+        gchange.save()
+        self.assertEqual(self.get_machine().percentage(), 50)
+
+        gchange.points = 7
+        gchange.save()
+        self.assertEqual(self.get_machine().percentage(), 70)
+
+        gchange.delete()
+        self.assertFalse(GradeState.objects.exists())
+        self.assertEqual(self.get_machine().stringify_state(), u"- ∅ -")
+
+    def test_move_to_other_participation(self):
+        gchange = self.make_grade_change(gsct.graded, points=5)
+        gchange.save()
+
+        gchange.participation = self.participations[1]
+        gchange.save()
+
+        self.assertIsNone(self.get_machine().percentage())
+        self.assertEqual(
+                self.get_machine(participation=self.participations[1])
+                .percentage(),
+                50)
+
+    def test_import(self):
+        create_grade_changes([
+            self.make_grade_change(gsct.graded, points=2, attempt_id="a",
+                minutes=1),
+            self.make_grade_change(gsct.graded, points=8, attempt_id="b",
+                minutes=2),
+            self.make_grade_change(gsct.graded, points=3,
+                participation=self.participations[1], minutes=3),
+            ])
+
+        self.assertEqual(GradeState.objects.count(), 2)
+        self.assertEqual(self.get_machine().percentage(), 80)
+        self.assertEqual(
+                self.get_machine(participation=self.participations[1])
+                .percentage(),
+                30)
+
+    def test_rejected_grade_changes(self):
+        self.make_grade_change(gsct.exempt, minutes=1).save()
+        self.make_grade_change(gsct.graded, points=5, minutes=2).save()
+
+        machine = self.get_machine()
+        self.assertIsNone(machine.percentage())
+        self.assertEqual(machine.stringify_machine_readable_state(), "ERROR")
+
+    def test_rebuild(self):
+        self.make_grade_change(gsct.graded, points=5, minutes=1).save()
+        self.make_grade_change(gsct.graded, points=4, minutes=2,
+                participation=self.participations[1]).save()
+
+        expected = dict(
+                ((gstate.opportunity_id, gstate.participation_id),
+                    gstate.valid_percentages)
+                for gstate in GradeState.objects.all())
+
+        GradeState.objects.all().delete()
+        # a stale one, to be removed
+        GradeState.objects.create(
+                opportunity=self.opportunities[1],
+                participation=self.participations[0],
+                state=gsct.exempt)
+
+        self.assertEqual(rebuild_grade_states(self.course), 2)
+        self.assertEqual(
+                dict(
+                    ((gstate.opportunity_id, gstate.participation_id),
+                        gstate.valid_percentages)
+                    for gstate in GradeState.objects.all()),
+                expected)
+
+    def test_from_grade_state_matches_consume(self):
+        due_time = self.start_time + timedelta(days=3)
+
+        sequences = [
+                [(gsct.graded, 5, "a", None)],
+                [(gsct.graded, 5, "a", None), (gsct.graded, 9, "b", None),
+                    (gsct.graded, 2, "a", None)],
+                [(gsct.graded, 5, None, None), (gsct.graded, 7, None, None)],
+                [(gsct.extension, None, None, due_time),
+                    (gsct.graded, 6, "a", None),
+                    (gsct.report_sent, None, None, None)],
+                [(gsct.graded, 5, "a", None), (gsct.do_over, None, None, None),
+                    (gsct.graded, 1, "a", None)],
+                [(gsct.graded, 5, "a", None), (gsct.unavailable, None, None,
+                    None)],
+                [(gsct.graded, 5, "a", None), (gsct.exempt, None, None, None)],
+                ]
+
+        for opportunity in self.opportunities:
+            for sequence in sequences:
+                GradeChange.objects.all().delete()
+
+                for i, (state, points, attempt_id, gchange_due_time) in (
+                        enumerate(sequence)):
+                    self.make_grade_change(state, points=points,
+                            attempt_id=attempt_id, opportunity=opportunity,
+                            due_time=gchange_due_time, minutes=i).save()
+
+                expected = GradeStateMachine().consume(
+                        GradeChange.objects
+                        .filter(opportunity=opportunity)
+                        .order_by("grade_time"))
+                machine = self.get_machine(opportunity=opportunity)
+
+                for attr in ["state", "due_time", "has_extension",
+                        "last_graded_time", "last_report_time"]:
+                    self.assertEqual(
+                            getattr(machine, attr), getattr(expected, attr),
+                            "%s after %s" % (attr, sequence))
+
+                self.assertEqual(machine.valid_percentages,
+                        [Decimal(pct) for pct in expected.valid_percentages])
+                self.assertEqual(machine.percentage(), expected.percentage())
+                self.assertEqual(machine.stringify_state(),
+                        expected.stringify_state())
@@ -0,0 +1,152 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2014 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import sys
+from os.path import abspath, dirname, join
+from time import sleep
+from unittest import skipIf
+
+import six
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+import course.page.code
+from course.page.code import ping_runpy, PythonCodeQuestion
+from course.page.code_pool import RunpyContainerPool, FakeDockerClient
+from relate.utils import dict_to_struct
+
+RUNPY_DIR = join(dirname(dirname(abspath(__file__))), "docker-image-run-py")
+
+
+class RunpyContainerPoolTest(SimpleTestCase):
+    def setUp(self):  # noqa
+        self.docker_cnx = FakeDockerClient()
+        self.pool = RunpyContainerPool(
+                lambda: self.docker_cnx, "fake-image",
+                min_size=2, max_size=4)
+        self.pool.refill_interval = 0.1
+
+    def tearDown(self):  # noqa
+        self.pool.close()
+
+    def wait_for_ready_count(self, count):
+        for i in range(100):
+            if len(self.pool.ready) >= count:
+                return
+            sleep(0.05)
+
+        self.fail("pool did not fill up")
+
+    def test_refill(self):
+        container = self.pool.get()
+        container.remove()
+
+        self.wait_for_ready_count(2)
+
+        container = self.pool.get()
+        self.assertTrue(ping_runpy(container.port, timeout=1))
+        container.remove()
+
+        self.assertNotIn(container.container_id,
+                self.docker_cnx.running_container_ids())
+
+    def test_dead_container_discarded(self):
+        self.pool.get().remove()
+        self.wait_for_ready_count(2)
+
+        dead = self.pool.ready[0]
+        self.docker_cnx.remove_container(dead.container_id)
+
+        container = self.pool.get()
+        self.assertNotEqual(container.container_id, dead.container_id)
+        self.assertTrue(ping_runpy(container.port, timeout=1))
+        container.remove()
+
+    def test_close_removes_idle_containers(self):
+        self.pool.get().remove()
+        self.wait_for_ready_count(2)
+
+        self.pool.close()
+        self.assertEqual(self.docker_cnx.running_container_ids(), [])
+
+
+@skipIf(six.PY2, "runpy needs Python 3")
+@override_settings(
+        RELATE_CODE_RUNNER="docker",
+        RELATE_DOCKER_RUNPY_IMAGE="fake-image",
+        RELATE_DOCKER_RUNPY_POOL_MAX_SIZE=0,
+        RELATE_RUNPY_MAX_RESPONSE_BYTES=2000)
+class RunpyBatchOutputLimitTest(SimpleTestCase):
+    def setUp(self):  # noqa
+        self.orig_make_docker_client = course.page.code.make_docker_client
+
+    def tearDown(self):  # noqa
+        course.page.code.make_docker_client = self.orig_make_docker_client
+
+    def run_batch_in_runpy(self, user_codes):
+        import imp
+        sys.path.insert(0, RUNPY_DIR)
+        try:
+            runpy = imp.load_source("relate_runpy", join(RUNPY_DIR, "runpy"))
+        finally:
+            sys.path.remove(RUNPY_DIR)
+
+        return runpy.run_batch({
+            "compile_only": False,
+            "jobs": [{"user_code": user_code} for user_code in user_codes],
+            "timeout": 10,
+            "max_result_bytes": 2000,
+            })
+
+    def test_oversize_job_graded_like_single_run(self):
+        user_codes = ["print('x' * 5000)", "print('fine')"]
+
+        batch_result = self.run_batch_in_runpy(user_codes)
+        self.assertEqual(
+                [result["result"] for result in batch_result["results"]],
+                ["output_too_large", "success"])
+
+        # Serve runpy's response from a fake container.
+        course.page.code.make_docker_client = (
+                lambda: FakeDockerClient(run_response=batch_result))
+
+        page = PythonCodeQuestion(None, "test", dict_to_struct({
+            "type": "PythonCodeQuestion",
+            "id": "test",
+            "title": "Test",
+            "prompt": "Print something.",
+            "timeout": 10,
+            "value": 1,
+            }))
+
+        feedbacks = page.grade_batch([
+            (None, None, {"answer": user_code}, None)
+            for user_code in user_codes])
+
+        self.assertEqual(feedbacks[0].correctness, 0)
+        self.assertIn("too much output", feedbacks[0].feedback)
+        self.assertNotIn("grading code failed", feedbacks[0].feedback)
+
+        self.assertIsNone(feedbacks[1].correctness)
+        self.assertIn("fine", feedbacks[1].bulk_feedback)